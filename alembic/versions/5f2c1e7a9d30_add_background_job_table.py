@@ -0,0 +1,53 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License.
+
+"""Add the background_job table for durable background tasks.
+
+Revision ID: 5f2c1e7a9d30
+Revises: 464899566429
+Create Date: 2026-10-18 22:10:00.000000
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "5f2c1e7a9d30"
+down_revision = "464899566429"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "background_job",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(length=64), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("subject", sa.String(length=256), nullable=True),
+        sa.Column("tag", sa.String(length=64), nullable=True),
+        sa.Column("priority", sa.Integer(), nullable=False),
+        sa.Column("pool", sa.String(length=32), nullable=False),
+        sa.Column("dispatch_key", sa.Float(precision=53), nullable=False),
+        sa.Column("state", sa.String(length=16), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("max_attempts", sa.Integer(), nullable=False),
+        sa.Column("lease_owner", sa.String(length=128), nullable=True),
+        sa.Column("lease_expires", sa.DateTime(), nullable=True),
+        sa.Column("not_before", sa.DateTime(), nullable=True),
+        sa.Column("submit_time", sa.DateTime(), nullable=False),
+        sa.Column("start_time", sa.DateTime(), nullable=True),
+        sa.Column("finish_time", sa.DateTime(), nullable=True),
+        sa.Column("result", sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "background_job_dispatch", "background_job", ["state", "dispatch_key"], unique=False
+    )
+    op.create_index("background_job_subject", "background_job", ["subject"], unique=False)
+
+
+def downgrade():
+    op.drop_index("background_job_subject", table_name="background_job")
+    op.drop_index("background_job_dispatch", table_name="background_job")
+    op.drop_table("background_job")
@@ -0,0 +1,38 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License.
+
+"""Add the standing_order_progress table for tracking failed copies.
+
+Revision ID: a3d81c6f0b52
+Revises: 5f2c1e7a9d30
+Create Date: 2026-10-18 22:40:00.000000
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "a3d81c6f0b52"
+down_revision = "5f2c1e7a9d30"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "standing_order_progress",
+        sa.Column("order_id", sa.Integer(), nullable=False),
+        sa.Column("file_name", sa.String(length=256), nullable=False),
+        sa.Column("state", sa.String(length=16), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("next_attempt", sa.DateTime(), nullable=True),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("updated", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["order_id"], ["standing_order.id"]),
+        sa.ForeignKeyConstraint(["file_name"], ["file.name"]),
+        sa.PrimaryKeyConstraint("order_id", "file_name"),
+    )
+
+
+def downgrade():
+    op.drop_table("standing_order_progress")
@@ -0,0 +1,89 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License.
+
+"""Add materialized rollup columns to the file, observation and session tables.
+
+The new columns are backfilled from the existing records, one tier at a
+time, since each tier is computed from the one below it.
+
+Revision ID: a9d3e5f17b42
+Revises: f4b7c2d91e08
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "a9d3e5f17b42"
+down_revision = "f4b7c2d91e08"
+branch_labels = None
+depends_on = None
+
+
+def _add_count_column(table, name, kind=sa.Integer):
+    op.add_column(table, sa.Column(name, kind(), nullable=False, server_default="0"))
+
+
+def upgrade():
+    _add_count_column("file", "num_instances")
+
+    _add_count_column("observation", "num_files")
+    _add_count_column("observation", "total_size", sa.BigInteger)
+    _add_count_column("observation", "num_files_with_instances")
+
+    _add_count_column("observing_session", "num_obs")
+    _add_count_column("observing_session", "num_files")
+    _add_count_column("observing_session", "total_size", sa.BigInteger)
+    _add_count_column("observing_session", "num_files_with_instances")
+
+    op.execute(
+        """
+        UPDATE file SET num_instances = (
+            SELECT COUNT(*) FROM file_instance fi WHERE fi.name = file.name
+        )
+        """
+    )
+    op.execute(
+        """
+        UPDATE observation SET
+            num_files = (SELECT COUNT(*) FROM file f WHERE f.obsid = observation.obsid),
+            total_size = (
+                SELECT COALESCE(SUM(f.size), 0) FROM file f WHERE f.obsid = observation.obsid
+            ),
+            num_files_with_instances = (
+                SELECT COUNT(*) FROM file f
+                WHERE f.obsid = observation.obsid AND f.num_instances > 0
+            )
+        """
+    )
+    op.execute(
+        """
+        UPDATE observing_session SET
+            num_obs = (
+                SELECT COUNT(*) FROM observation o WHERE o.session_id = observing_session.id
+            ),
+            num_files = (
+                SELECT COALESCE(SUM(o.num_files), 0) FROM observation o
+                WHERE o.session_id = observing_session.id
+            ),
+            total_size = (
+                SELECT COALESCE(SUM(o.total_size), 0) FROM observation o
+                WHERE o.session_id = observing_session.id
+            ),
+            num_files_with_instances = (
+                SELECT COALESCE(SUM(o.num_files_with_instances), 0) FROM observation o
+                WHERE o.session_id = observing_session.id
+            )
+        """
+    )
+
+
+def downgrade():
+    for name in ("num_files_with_instances", "total_size", "num_files", "num_obs"):
+        op.drop_column("observing_session", name)
+
+    for name in ("num_files_with_instances", "total_size", "num_files"):
+        op.drop_column("observation", name)
+
+    op.drop_column("file", "num_instances")
@@ -0,0 +1,90 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License.
+
+"""Add a trigram index of file names for substring searches.
+
+On PostgreSQL this is a GIN index using the pg_trgm extension; creating the
+extension needs suitable privileges. On SQLite it's an FTS5 table, kept up to
+date by triggers, which is backfilled from the existing file records, plus
+a table giving each name the key of its FTS5 row, so that the triggers can
+find it without a scan. Either way this has to read the whole file table,
+which can take a while on big catalogs.
+
+Revision ID: b3c8e2a61f07
+Revises: a9d3e5f17b42
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+
+from alembic import op
+
+revision = "b3c8e2a61f07"
+down_revision = "a9d3e5f17b42"
+branch_labels = None
+depends_on = None
+
+# Keep synchronized with librarian_server.nameindex.
+
+SQLITE_TRIGGERS = {
+    "file_name_trigram_insert": """
+        AFTER INSERT ON file BEGIN
+            INSERT INTO file_name_trigram_key (name) VALUES (new.name);
+            INSERT INTO file_name_trigram (rowid, name)
+                SELECT id, name FROM file_name_trigram_key WHERE name = new.name;
+        END
+    """,
+    "file_name_trigram_delete": """
+        AFTER DELETE ON file BEGIN
+            DELETE FROM file_name_trigram
+                WHERE rowid = (SELECT id FROM file_name_trigram_key WHERE name = old.name);
+            DELETE FROM file_name_trigram_key WHERE name = old.name;
+        END
+    """,
+    "file_name_trigram_rename": """
+        AFTER UPDATE OF name ON file BEGIN
+            UPDATE file_name_trigram SET name = new.name
+                WHERE rowid = (SELECT id FROM file_name_trigram_key WHERE name = old.name);
+            UPDATE file_name_trigram_key SET name = new.name WHERE name = old.name;
+        END
+    """,
+}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.create_index(
+            "file_name_trgm",
+            "file",
+            ["name"],
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        )
+    elif dialect == "sqlite":
+        op.execute("CREATE VIRTUAL TABLE file_name_trigram USING fts5(name, tokenize='trigram')")
+        op.execute(
+            "CREATE TABLE file_name_trigram_key "
+            "(id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)"
+        )
+        op.execute("INSERT INTO file_name_trigram_key (name) SELECT name FROM file")
+        op.execute(
+            "INSERT INTO file_name_trigram (rowid, name) SELECT id, name FROM file_name_trigram_key"
+        )
+
+        for name, body in SQLITE_TRIGGERS.items():
+            op.execute(f"CREATE TRIGGER {name} {body}")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        op.drop_index("file_name_trgm", table_name="file")
+    elif dialect == "sqlite":
+        for name in SQLITE_TRIGGERS:
+            op.execute(f"DROP TRIGGER {name}")
+
+        op.execute("DROP TABLE file_name_trigram_key")
+        op.execute("DROP TABLE file_name_trigram")
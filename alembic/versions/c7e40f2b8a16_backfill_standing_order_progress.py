@@ -0,0 +1,55 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License.
+
+"""Track standing-order completion in standing_order_progress.
+
+Adds indexes for the standing-order anti-join and backfills "succeeded"
+records from the existing "standing_order_succeeded:<name>" file events.
+
+Revision ID: c7e40f2b8a16
+Revises: a3d81c6f0b52
+Create Date: 2026-10-18 23:10:00.000000
+
+"""
+from alembic import op
+
+revision = "c7e40f2b8a16"
+down_revision = "a3d81c6f0b52"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "standing_order_progress_state",
+        "standing_order_progress",
+        ["order_id", "state"],
+        unique=False,
+    )
+    op.create_index(
+        "standing_order_progress_file_name",
+        "standing_order_progress",
+        ["file_name"],
+        unique=False,
+    )
+
+    op.execute(
+        """
+        INSERT INTO standing_order_progress (order_id, file_name, state, attempts, updated)
+        SELECT so.id, fe.name, 'succeeded', 0, MAX(fe.time)
+        FROM file_event fe
+        JOIN standing_order so ON fe.type = 'standing_order_succeeded:' || so.name
+        WHERE fe.name IS NOT NULL
+        AND NOT EXISTS (
+            SELECT 1 FROM standing_order_progress p
+            WHERE p.order_id = so.id AND p.file_name = fe.name
+        )
+        GROUP BY so.id, fe.name
+        """
+    )
+
+
+def downgrade():
+    op.execute("DELETE FROM standing_order_progress WHERE state IN ('launched', 'succeeded')")
+    op.drop_index("standing_order_progress_file_name", table_name="standing_order_progress")
+    op.drop_index("standing_order_progress_state", table_name="standing_order_progress")
@@ -0,0 +1,42 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License.
+
+"""Add indexes for the columns used by common searches.
+
+The single-column index on FileEvent.name is replaced by a composite one on
+(name, type), which also serves lookups by name alone.
+
+Revision ID: d5e1a7c3b920
+Revises: b3c8e2a61f07
+Create Date: 2026-10-20 12:00:00.000000
+
+"""
+from alembic import op
+
+revision = "d5e1a7c3b920"
+down_revision = "b3c8e2a61f07"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("file_obsid", "file", ["obsid"]),
+    ("file_create_time", "file", ["create_time"]),
+    ("file_source", "file", ["source", "obsid"]),
+    ("file_event_name_type", "file_event", ["name", "type"]),
+    ("file_event_type_name", "file_event", ["type", "name"]),
+    ("observation_start_time", "observation", ["start_time_jd"]),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+    op.drop_index("file_event_name", table_name="file_event")
+
+
+def downgrade():
+    op.create_index("file_event_name", "file_event", ["name"], unique=False)
+
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,94 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License.
+
+"""Add the file_name_prefix table used for obsid inference.
+
+The table is backfilled from the existing file records. This has to scan the
+whole file table once, which can take a while on big catalogs. The names are
+streamed and merged into the new table a batch at a time, so memory use
+doesn't grow with the size of the catalog.
+
+Revision ID: e1f3a6b9c2d4
+Revises: c7e40f2b8a16
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "e1f3a6b9c2d4"
+down_revision = "c7e40f2b8a16"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500  # also the size of the IN lists that we use
+
+
+def _hera_name_prefix(name):
+    # Keep synchronized with librarian_server.file.hera_name_prefix.
+    bits = name.split(".")
+    if len(bits) < 4:
+        return None
+    return ".".join(bits[:3])
+
+
+def upgrade():
+    prefix_table = op.create_table(
+        "file_name_prefix",
+        sa.Column("prefix", sa.String(length=256), nullable=False),
+        sa.Column("obsid", sa.BigInteger(), nullable=True),
+        sa.Column("conflicted", sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint("prefix"),
+    )
+
+    conn = op.get_bind()
+    result = conn.execution_options(stream_results=True).execute(
+        sa.text("SELECT name, obsid FROM file")
+    )
+
+    for batch in result.partitions(BATCH_SIZE):
+        obsids = {}
+
+        for name, obsid in batch:
+            prefix = _hera_name_prefix(name)
+            if prefix is not None:
+                obsids.setdefault(prefix, set()).add(obsid)
+
+        if len(obsids):
+            _merge_prefixes(conn, prefix_table, obsids)
+
+
+def _merge_prefixes(conn, prefix_table, obsids):
+    # Merge a batch of prefixes, mapped to their sets of obsids, into the
+    # table, marking a prefix as conflicted if its obsids disagree with
+    # earlier batches.
+    c = prefix_table.c
+    existing = conn.execute(
+        sa.select(c.prefix, c.obsid, c.conflicted).where(c.prefix.in_(list(obsids)))
+    )
+    conflicts = []
+
+    for prefix, obsid, conflicted in existing:
+        o = obsids.pop(prefix)
+        if not conflicted and o != {obsid}:
+            conflicts.append({"p": prefix})
+
+    if len(conflicts):
+        conn.execute(
+            prefix_table.update().where(c.prefix == sa.bindparam("p")).values(conflicted=sa.true()),
+            conflicts,
+        )
+
+    if len(obsids):
+        op.bulk_insert(
+            prefix_table,
+            [
+                {"prefix": prefix, "obsid": min(o, key=str), "conflicted": len(o) > 1}
+                for prefix, o in obsids.items()
+            ],
+        )
+
+
+def downgrade():
+    op.drop_table("file_name_prefix")
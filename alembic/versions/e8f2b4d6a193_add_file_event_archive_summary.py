@@ -0,0 +1,33 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License.
+
+"""Add the file_event_archive_summary table.
+
+Revision ID: e8f2b4d6a193
+Revises: d5e1a7c3b920
+Create Date: 2026-10-20 15:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "e8f2b4d6a193"
+down_revision = "d5e1a7c3b920"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "file_event_archive_summary",
+        sa.Column("type", sa.String(length=64), nullable=False),
+        sa.Column("num_archived", sa.BigInteger(), nullable=False),
+        sa.Column("first_time", sa.DateTime(), nullable=False),
+        sa.Column("last_time", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("type"),
+    )
+
+
+def downgrade():
+    op.drop_table("file_event_archive_summary")
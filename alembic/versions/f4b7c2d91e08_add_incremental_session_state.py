@@ -0,0 +1,32 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License.
+
+"""Add state for incremental observing-session assignment.
+
+Existing sessions are all closed, so the new column starts out null.
+
+Revision ID: f4b7c2d91e08
+Revises: e1f3a6b9c2d4
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "f4b7c2d91e08"
+down_revision = "e1f3a6b9c2d4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("observing_session", sa.Column("open_until", sa.DateTime(), nullable=True))
+    op.create_index(
+        "observation_session", "observation", ["session_id", "start_time_jd"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("observation_session", table_name="observation")
+    op.drop_column("observing_session", "open_until")
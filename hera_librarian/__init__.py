@@ -26,6 +26,9 @@ LibrarianClient
 with contextlib.suppress(PackageNotFoundError):
     __version__ = version("hera_librarian")
 
+# The number of results to fetch at once when paging through search results.
+DEFAULT_SEARCH_PAGE_SIZE = 1000
+
 
 class NoSuchConnectionError(Exception):
     """Raised when a connection name is not found in the client configuration file."""
@@ -96,12 +99,7 @@ class LibrarianClient:
             if self.config is None:
                 raise NoSuchConnectionError(conn_name)
 
-    def _do_http_post(self, operation, **kwargs):
-        """Do a POST operation.
-
-        Pass a JSON version of the request and expecting a
-        JSON reply; return the decoded version of the latter.
-        """
+    def _encode_request(self, operation, kwargs):
         kwargs["authenticator"] = self.config["authenticator"]
         for k in list(kwargs.keys()):
             if kwargs[k] is None:
@@ -110,6 +108,15 @@ class LibrarianClient:
 
         params = urllib.parse.urlencode({"request": req_json}).encode("utf-8")
         url = self.config["url"] + "api/" + operation
+        return url, params
+
+    def _do_http_post(self, operation, **kwargs):
+        """Do a POST operation.
+
+        Pass a JSON version of the request and expecting a
+        JSON reply; return the decoded version of the latter.
+        """
+        url, params = self._encode_request(operation, kwargs)
         try:
             f = urllib.request.urlopen(url, params)
             reply = f.read()
@@ -125,6 +132,50 @@ class LibrarianClient:
 
         return reply_json
 
+    def _do_http_post_stream(self, operation, **kwargs):
+        """Do a POST operation whose reply is streamed as newline-delimited JSON.
+
+        This is a generator that decodes and yields the items in the reply as
+        they arrive. The server finishes the stream with a trailer saying
+        whether everything went OK; if it reports a problem, or the stream is
+        cut off before the trailer, an RPCError is raised.
+
+        """
+        url, params = self._encode_request(operation, kwargs)
+        try:
+            f = urllib.request.urlopen(url, params)
+        except urllib.error.HTTPError as err:
+            # Problems detected before streaming starts get a regular reply.
+            reply = err.read()
+            try:
+                reply_json = json.loads(reply)
+            except ValueError as e:
+                raise RPCError(kwargs, f"failed to parse reply as JSON: {repr(reply)}") from e
+            raise RPCError(kwargs, reply_json.get("message", "<no error message provided>"))
+
+        trailer = None
+
+        with f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    raise RPCError(kwargs, f"failed to parse reply line as JSON: {line!r}") from e
+
+                if "success" in item:
+                    trailer = item
+                    break
+
+                yield item
+
+        if trailer is None:
+            raise RPCError(kwargs, "streamed reply ended unexpectedly")
+        if not trailer["success"]:
+            raise RPCError(kwargs, trailer.get("message", "<no error message provided>"))
+
     def ping(self, **kwargs):
         """Ping the Librarian."""
         return self._do_http_post("ping", **kwargs)
@@ -161,6 +212,32 @@ class LibrarianClient:
             maximum_start_jd=maximum_start_jd,
         )
 
+    def _get_globus_endpoints(self, use_globus, source_endpoint_id):
+        """Figure out the globus endpoint information for an upload.
+
+        Returns a tuple `(source_endpoint_id, destination_endpoint_id,
+        host_path)`. These are all None if `use_globus` is False.
+
+        """
+        if not use_globus:
+            return None, None, None
+
+        if source_endpoint_id is None:
+            try:
+                import globus_sdk
+
+                # assume we're running a local personal client
+                # if we're not, local_ep.endpoint_id will return None
+                local_ep = globus_sdk.LocalGlobusConnectPersonal()
+                source_endpoint_id = local_ep.endpoint_id
+            except ModuleNotFoundError:
+                source_endpoint_id = None
+
+        # get the relevant destination info from config file
+        destination_endpoint_id = self.config.get("globus_endpoint_id", None)
+        host_path = self.config.get("globus_host_path", None)
+        return source_endpoint_id, destination_endpoint_id, host_path
+
     def upload_file(
         self,
         local_path,
@@ -302,24 +379,9 @@ class LibrarianClient:
         store = BaseStore(info["name"], info["path_prefix"], info["ssh_host"])
         staging_dir = info["staging_dir"]
 
-        if use_globus:
-            if source_endpoint_id is None:
-                try:
-                    import globus_sdk
-
-                    # assume we're running a local personal client
-                    # if we're not, local_ep.endpoint_id will return None
-                    local_ep = globus_sdk.LocalGlobusConnectPersonal()
-                    source_endpoint_id = local_ep.endpoint_id
-                except ModuleNotFoundError:
-                    source_endpoint_id = None
-            # get the relevant destination info from config file
-            destination_endpoint_id = self.config.get("globus_endpoint_id", None)
-            host_path = self.config.get("globus_host_path", None)
-        else:
-            source_endpoint_id = None
-            destination_endpoint_id = None
-            host_path = None
+        source_endpoint_id, destination_endpoint_id, host_path = self._get_globus_endpoints(
+            use_globus, source_endpoint_id
+        )
 
         # Now, (try to) actually copy the data. This runs an SCP, potentially
         # across the globe, that in the real world will occasionally stall or
@@ -354,6 +416,131 @@ class LibrarianClient:
             null_obsid=null_obsid,
         )
 
+    def upload_files(
+        self,
+        uploads,
+        meta_mode,
+        rec_info=None,
+        deletion_policy="disallowed",
+        known_staging_store=None,
+        known_staging_subdir=None,
+        null_obsid=False,
+        use_globus=False,
+        client_id=None,
+        transfer_token=None,
+        source_endpoint_id=None,
+    ):
+        """Upload several files to the Librarian in one batch.
+
+        This works like `upload_file`, but all of the files go into a single
+        staging directory with one `initiate_upload` call and one data
+        transfer, and are ingested with one `complete_upload_batch` call. For
+        lots of small files, this is much faster than uploading them one at a
+        time.
+
+        Parameters
+        ----------
+        uploads : list of (str, str)
+            A list of tuples `(local_path, dest_store_path)`, with the same
+            meanings as in `upload_file`. The basenames of the destination
+            paths, which are the names of the new files, must be unique.
+        meta_mode, rec_info, deletion_policy : optional
+            As in `upload_file`. `rec_info` should describe all of the files.
+        known_staging_store, known_staging_subdir, null_obsid : optional
+            As in `upload_file`.
+        use_globus, client_id, transfer_token, source_endpoint_id : optional
+            As in `upload_file`.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping the names of the files that the Librarian
+            could not ingest to error messages describing what went wrong.
+            Files not in the dictionary were ingested successfully.
+
+        Raises
+        ------
+        Exception
+            Raised if any of the destination paths is absolute, if their names
+            are not unique, or if `meta_mode` is "infer" and `null_obsid` is
+            True.
+        """
+        rec_info = rec_info or {}
+
+        for _, dest_store_path in uploads:
+            if os.path.isabs(dest_store_path):
+                raise Exception(f"destination path may not be absolute; got {dest_store_path!r}")
+
+        names = [os.path.basename(dest_store_path) for _, dest_store_path in uploads]
+        if len(set(names)) != len(names):
+            raise Exception(f"destination file names must be unique; got {names!r}")
+
+        deletion_policy = _normalize_deletion_policy(deletion_policy)
+
+        if null_obsid and meta_mode != "infer":
+            raise Exception('null_obsid may only be True when meta_mode is "infer"')
+
+        from . import utils
+
+        kwargs = {
+            "upload_size": sum(utils.get_size_from_path(p) for p, _ in uploads),
+            "known_staging_store": known_staging_store,
+            "known_staging_subdir": known_staging_subdir,
+        }
+        kwargs.update(rec_info)
+        info = self._do_http_post("initiate_upload", **kwargs)
+
+        from .base_store import BaseStore
+
+        store = BaseStore(info["name"], info["path_prefix"], info["ssh_host"])
+        staging_dir = info["staging_dir"]
+
+        source_endpoint_id, destination_endpoint_id, host_path = self._get_globus_endpoints(
+            use_globus, source_endpoint_id
+        )
+
+        # A single transfer can only drop the files into the staging
+        # directory under their existing names. If any of them are being
+        # renamed, we have to fall back to copying them individually.
+
+        local_paths = [local_path for local_path, _ in uploads]
+
+        if all(os.path.basename(p.rstrip("/")) == n for p, n in zip(local_paths, names)):
+            store.copy_many_to_store(
+                local_paths,
+                staging_dir,
+                use_globus,
+                client_id,
+                transfer_token,
+                source_endpoint_id,
+                destination_endpoint_id,
+                host_path,
+            )
+        else:
+            for local_path, name in zip(local_paths, names):
+                store.copy_to_store(
+                    local_path,
+                    os.path.join(staging_dir, name),
+                    use_globus,
+                    client_id,
+                    transfer_token,
+                    source_endpoint_id,
+                    destination_endpoint_id,
+                    host_path,
+                )
+
+        result = self._do_http_post(
+            "complete_upload_batch",
+            store_name=store.name,
+            staging_dir=staging_dir,
+            dest_store_paths=[dest_store_path for _, dest_store_path in uploads],
+            meta_mode=meta_mode,
+            deletion_policy=deletion_policy,
+            staging_was_known=(known_staging_store is not None),
+            null_obsid=null_obsid,
+        )
+        return result["errors"]
+
     def register_instances(self, store_name, file_info, null_obsid):
         return self._do_http_post(
             "register_instances", store_name=store_name, file_info=file_info, null_obsid=null_obsid
@@ -415,6 +602,13 @@ class LibrarianClient:
             "describe_session_without_event", source=source, event_type=event_type
         )
 
+    def file_event_summary(self):
+        """Get the number and time range of the file events of each type on the
+        Librarian, including ones that have been archived.
+
+        """
+        return self._do_http_post("file_event_summary")
+
     def launch_local_disk_stage_operation(self, user, search, dest_dir):
         return self._do_http_post(
             "search",
@@ -425,14 +619,77 @@ class LibrarianClient:
             output_format="stage-the-files-json",
         )
 
-    def search_sessions(self, search):
-        return self._do_http_post("search", search=search, output_format="session-listing-json")
+    def _search(self, output_format, search, limit, cursor):
+        return self._do_http_post(
+            "search", search=search, output_format=output_format, limit=limit, cursor=cursor
+        )
+
+    def _iter_search(self, output_format, search, page_size):
+        """Generate all of the results of a search, fetching them from the server
+        one page at a time. Servers that don't support pagination return
+        everything in the first page.
+
+        """
+        cursor = None
+
+        while True:
+            reply = self._search(output_format, search, page_size, cursor)
+            yield from reply["results"]
+            cursor = reply.get("next_cursor")
+            if cursor is None:
+                return
+
+    def search_sessions(self, search, limit=None, cursor=None):
+        return self._search("session-listing-json", search, limit, cursor)
+
+    def search_files(self, search, limit=None, cursor=None):
+        return self._search("file-listing-json", search, limit, cursor)
+
+    def search_instances(self, search, limit=None, cursor=None):
+        return self._search("instance-listing-json", search, limit, cursor)
 
-    def search_files(self, search):
-        return self._do_http_post("search", search=search, output_format="file-listing-json")
+    def search_observations(self, search, limit=None, cursor=None):
+        return self._search("obs-listing-json", search, limit, cursor)
 
-    def search_instances(self, search):
-        return self._do_http_post("search", search=search, output_format="instance-listing-json")
+    def iter_search_sessions(self, search, page_size=DEFAULT_SEARCH_PAGE_SIZE):
+        return self._iter_search("session-listing-json", search, page_size)
 
-    def search_observations(self, search):
-        return self._do_http_post("search", search=search, output_format="obs-listing-json")
+    def iter_search_files(self, search, page_size=DEFAULT_SEARCH_PAGE_SIZE):
+        return self._iter_search("file-listing-json", search, page_size)
+
+    def iter_search_instances(self, search, page_size=DEFAULT_SEARCH_PAGE_SIZE):
+        return self._iter_search("instance-listing-json", search, page_size)
+
+    def iter_search_observations(self, search, page_size=DEFAULT_SEARCH_PAGE_SIZE):
+        return self._iter_search("obs-listing-json", search, page_size)
+
+    def search_file_stats(self, search, group_by=None):
+        """Get aggregate statistics of the files matching a search: their number,
+        total size, and range of creation times. If `group_by` is a list of
+        keys ("type", "source", "obsid", "session", or "store"), the
+        statistics are broken down by their values.
+
+        """
+        return self._do_http_post(
+            "search", search=search, output_format="file-stats-json", group_by=group_by
+        )
+
+    def stream_search_sessions(self, search):
+        return self._do_http_post_stream(
+            "search", search=search, output_format="session-listing-ndjson"
+        )
+
+    def stream_search_files(self, search):
+        return self._do_http_post_stream(
+            "search", search=search, output_format="file-listing-ndjson"
+        )
+
+    def stream_search_instances(self, search):
+        return self._do_http_post_stream(
+            "search", search=search, output_format="instance-listing-ndjson"
+        )
+
+    def stream_search_observations(self, search):
+        return self._do_http_post_stream(
+            "search", search=search, output_format="obs-listing-ndjson"
+        )
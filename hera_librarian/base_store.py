@@ -174,6 +174,67 @@ class BaseStore:
         if not success:
             raise RPCError(argv, "exit code %d; output:\n\n%r" % (proc.returncode, output))
 
+    def _rsync_transfer_many(self, local_paths, store_dir):
+        """Copy several files into one directory using a single rsync.
+
+        Parameters
+        ----------
+        local_paths : list of str
+            Paths to the local files to be copied. They will land in
+            `store_dir` under their basenames, so the basenames must be
+            unique.
+        store_dir : str
+            Path to the directory to store the files in on the destination
+            host.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        RPCError
+            Raised if rsync transfer does not complete successfully.
+        """
+        # We feed the file list to rsync on its standard input. Paths in a
+        # --files-from list are relative to the source directory, so we make
+        # them absolute and use "/" as the source; --no-relative then drops
+        # the leading directories at the destination. Unlike "-a" on its own,
+        # --files-from doesn't imply recursion, so we have to ask for it
+        # explicitly in case some of our "files" are directories.
+
+        file_list = "".join(os.path.abspath(p).lstrip("/").rstrip("/") + "\n" for p in local_paths)
+
+        argv = [
+            "rsync",
+            "-aPr",
+            "--no-relative",
+            "--files-from=-",
+            "-e",
+            "ssh -c aes128-ctr -o BatchMode=yes -o UserKnownHostsFile=/dev/null "
+            "-o StrictHostKeyChecking=no",
+            "/",
+            f"{self.ssh_host}:{self._path(store_dir)}/",
+        ]
+        success = False
+
+        for _ in range(NUM_RSYNC_TRIES):
+            proc = subprocess.Popen(
+                argv,
+                shell=False,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            output = proc.communicate(input=file_list.encode("utf-8"))[0]
+
+            if proc.returncode == 0:
+                success = True
+                break
+
+        if not success:
+            raise RPCError(argv, "exit code %d; output:\n\n%r" % (proc.returncode, output))
+
     def _globus_transfer(
         self,
         local_path,
@@ -365,6 +426,63 @@ class BaseStore:
             # use rsync from the get-go
             self._rsync_transfer(local_path, store_path)
 
+    def copy_many_to_store(
+        self,
+        local_paths,
+        store_dir,
+        try_globus=False,
+        client_id=None,
+        transfer_token=None,
+        source_endpoint_id=None,
+        destination_endpoint_id=None,
+        host_path=None,
+    ):
+        """Transfer several files into one directory in the store.
+
+        The files are placed in `store_dir` under their basenames. When using
+        rsync, this is done with a single rsync process, which avoids paying
+        the connection setup costs for every file. Globus transfers are still
+        made one file at a time.
+
+        Parameters
+        ----------
+        local_paths : list of str
+            Paths to the local files to upload. Their basenames must be
+            unique.
+        store_dir : str
+            Path to the directory to store the files in on the destination
+            host; typically a staging directory.
+        try_globus : bool, optional
+            Whether to try to use globus to transfer. If False, or if globus
+            fails, automatically fall back on rsync.
+        client_id, transfer_token, source_endpoint_id : str, optional
+            As in `copy_to_store`.
+        destination_endpoint_id, host_path : str, optional
+            As in `copy_to_store`.
+
+        Returns
+        -------
+        None
+        """
+        basenames = [os.path.basename(p.rstrip("/")) for p in local_paths]
+        if len(set(basenames)) != len(basenames):
+            raise ValueError(f"file names to copy must be unique; got {basenames!r}")
+
+        if try_globus:
+            for local_path, basename in zip(local_paths, basenames):
+                self.copy_to_store(
+                    local_path,
+                    os.path.join(store_dir, basename),
+                    try_globus=True,
+                    client_id=client_id,
+                    transfer_token=transfer_token,
+                    source_endpoint_id=source_endpoint_id,
+                    destination_endpoint_id=destination_endpoint_id,
+                    host_path=host_path,
+                )
+        else:
+            self._rsync_transfer_many(local_paths, store_dir)
+
     def _chmod(self, store_path, modespec):
         """Change Unix permissions on a path in the store.
 
@@ -626,6 +744,94 @@ class BaseStore:
         # actually run the command
         return self._ssh_slurp(command, input_stream=rec_text.encode("utf-8"))
 
+    def upload_files_to_other_librarian(
+        self,
+        conn_name,
+        rec_info,
+        local_store_paths,
+        remote_store_paths=None,
+        known_staging_store=None,
+        known_staging_subdir=None,
+        use_globus=False,
+        client_id=None,
+        transfer_token=None,
+        source_endpoint_id=None,
+    ):
+        """Upload several files to a different Librarian in one go.
+
+        This is like `upload_file_to_other_librarian`, but the store host runs
+        "librarian upload-batch", which copies all of the files with one
+        transfer and one pair of `initiate_upload` / `complete_upload_batch`
+        calls. This is much more efficient than uploading lots of small files
+        one at a time. The remote Librarian must be new enough to support the
+        `complete_upload_batch` API call.
+
+        Parameters
+        ----------
+        conn_name : str
+            The name of the external librarian to upload the files to.
+        rec_info : dict
+            A dictionary containing information about the file records being
+            transferred. These are needed by the receiving librarian.
+        local_store_paths : list of str
+            The paths of the files in the local store.
+        remote_store_paths : list of str, optional
+            The destination paths of the files in the remote store. If not
+            specified, or if an individual item is None, the local store path
+            is used.
+        known_staging_store, known_staging_subdir : str, optional
+            As in `upload_file_to_other_librarian`.
+        use_globus, client_id, transfer_token, source_endpoint_id : optional
+            As in `upload_file_to_other_librarian`.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping the names of the files that could not be
+            ingested by the remote Librarian to error messages. Files not in
+            the dictionary were uploaded successfully. If the transfer as a
+            whole fails, an exception is raised instead.
+        """
+        if remote_store_paths is None:
+            remote_store_paths = [None] * len(local_store_paths)
+
+        if len(remote_store_paths) != len(local_store_paths):
+            raise ValueError("must have the same number of local and remote store paths")
+
+        if (known_staging_store is None) ^ (known_staging_subdir is None):
+            raise ValueError("both known_staging_store and known_staging_subdir must be specified")
+
+        if known_staging_store is None:
+            pre_staged_arg = ""
+        else:
+            pre_staged_arg = f" --pre-staged={known_staging_store}:{known_staging_subdir}"
+
+        import json
+
+        uploads = []
+
+        for local, remote in zip(local_store_paths, remote_store_paths):
+            if remote is None:
+                remote = local
+            uploads.append({"local_path": self._path(local), "dest_store_path": remote})
+
+        text = json.dumps({"rec_info": rec_info, "uploads": uploads})
+
+        command = f"librarian upload-batch --meta=json-stdin{pre_staged_arg} {conn_name}"
+        if use_globus:
+            command += f" --use_globus --client_id={client_id}"
+            command += f" --transfer_token={transfer_token}"
+            if source_endpoint_id is not None:
+                command += f" --source_endpoint_id={source_endpoint_id}"
+
+        output = self._ssh_slurp(command, input_stream=text.encode("utf-8"))
+
+        # The results are printed as JSON on the last line of the output.
+        try:
+            return json.loads(output.decode("utf-8").strip().splitlines()[-1])["errors"]
+        except Exception:
+            raise RPCError(command, f"unexpected output from upload-batch: {output!r}")
+
     def upload_file_to_local_store(self, local_store_path, dest_store, dest_rel):
         """Fire off an rsync process on the store that will upload a given file to
         another store *on the same Librarian*. Like
@@ -159,9 +159,11 @@ def generate_parser():
     config_launch_copy_subparser(sub_parsers)
     config_locate_file_subparser(sub_parsers)
     config_search_files_subparser(sub_parsers)
+    config_search_stats_subparser(sub_parsers)
     config_set_file_deletion_policy_subparser(sub_parsers)
     config_stage_files_subparser(sub_parsers)
     config_upload_subparser(sub_parsers)
+    config_upload_batch_subparser(sub_parsers)
 
     return ap
 
@@ -425,11 +427,50 @@ def config_search_files_subparser(sub_parsers):
         metavar="JSON-SEARCH",
         help="A JSON search specification; files that match will be displayed.",
     )
+    sp.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print matching files as they arrive, without formatting them as a table. "
+        "Use this for very large searches.",
+    )
     sp.set_defaults(func=search_files)
 
     return
 
 
+def config_search_stats_subparser(sub_parsers):
+    # function documentation
+    doc = """Summarize the files in the librarian that match a search: how many
+    there are, their total size, and when they were created. The numbers are
+    computed by the server, so this is fast even for very large searches.
+
+    """
+    example = """For example, `librarian search-stats local '{"name-matches": "zen.2458%"}'
+    --group-by type,store` breaks down the matching files by their type and the
+    store holding them. When grouping by store, files are counted once for each
+    of their instances."""
+    hlp = "Summarize the files matching a query"
+
+    # add sub parser
+    sp = sub_parsers.add_parser("search-stats", description=doc, epilog=example, help=hlp)
+    sp.add_argument("conn_name", metavar="CONNECTION-NAME", help=_conn_name_help)
+    sp.add_argument(
+        "search",
+        metavar="JSON-SEARCH",
+        help="A JSON search specification; files that match will be summarized.",
+    )
+    sp.add_argument(
+        "--group-by",
+        metavar="KEYS",
+        default="",
+        help="A comma-separated list of keys to break down the statistics by: any of "
+        '"type", "source", "obsid", "session", and "store".',
+    )
+    sp.set_defaults(func=search_stats)
+
+    return
+
+
 def config_set_file_deletion_policy_subparser(sub_parsers):
     # function documentation
     doc = """Set the "deletion policy" of one instance of this file.
@@ -575,6 +616,79 @@ def config_upload_subparser(sub_parsers):
     return
 
 
+def config_upload_batch_subparser(sub_parsers):
+    # function documentation
+    doc = """Upload several files to a Librarian in one go. This is like "librarian
+   upload", but all of the files are transferred together and ingested with a
+   single pair of API calls, which is much faster for lots of small files. It
+   is mainly used by Librarian servers to implement standing orders.
+
+   """
+
+    example = """The list of files is read from standard input as a JSON document of the
+   form {"uploads": [{"local_path": ..., "dest_store_path": ...}, ...]}, with
+   LOCAL-PATH and DEST-PATH having the same meanings as in "librarian
+   upload". If --meta=json-stdin is given, the document should also contain a
+   "rec_info" item holding the metadata for all of the files. When done, the
+   command prints a JSON document on its last line of output that lists any
+   files that could not be ingested.
+
+   """
+    hlp = "Upload a batch of files to the librarian"
+
+    # add sub parser
+    sp = sub_parsers.add_parser("upload-batch", description=doc, epilog=example, help=hlp)
+    sp.add_argument(
+        "--meta",
+        dest="meta",
+        default="infer",
+        help='How to gather metadata: "json-stdin" or "infer"',
+    )
+    sp.add_argument(
+        "--null-obsid",
+        dest="null_obsid",
+        action="store_true",
+        help="Require the new files to have *no* obsid associated (for maint. files)",
+    )
+    sp.add_argument(
+        "--deletion",
+        dest="deletion",
+        default="disallowed",
+        help=("Whether the created file instances will be deletable: " '"allowed" or "disallowed"'),
+    )
+    sp.add_argument(
+        "--pre-staged",
+        dest="pre_staged",
+        metavar="STORENAME:SUBDIR",
+        help="Specify that the data have already been staged at the destination.",
+    )
+    sp.add_argument("conn_name", metavar="CONNECTION-NAME", help=_conn_name_help)
+    sp.add_argument(
+        "--use_globus",
+        dest="use_globus",
+        action="store_true",
+        help="Specify that we should try to use globus to transfer data.",
+    )
+    sp.add_argument(
+        "--client_id", dest="client_id", metavar="CLIENT-ID", help="The globus client ID."
+    )
+    sp.add_argument(
+        "--transfer_token",
+        dest="transfer_token",
+        metavar="TRANSFER-TOKEN",
+        help="The globus transfer token.",
+    )
+    sp.add_argument(
+        "--source_endpoint_id",
+        dest="source_endpoint_id",
+        metavar="SOURCE-ENDPOINT-ID",
+        help="The source endpoint ID for the globus transfer.",
+    )
+    sp.set_defaults(func=upload_batch)
+
+    return
+
+
 def add_file_event(args):
     """
     Add a file event to a file in the librarian.
@@ -894,30 +1008,73 @@ def search_files(args):
     """
     # Let's do it
     client = LibrarianClient(args.conn_name)
+    columns = ["name", "create_time", "obsid", "type", "size"]
+
+    if args.stream:
+        nresults = 0
+
+        try:
+            for entry in client.stream_search_files(args.search):
+                print("\t".join(str(entry[col]) for col in columns))
+                nresults += 1
+        except RPCError as e:
+            die(f"search failed after {nresults:d} files: {e}")
+
+        if nresults == 0:
+            die("No files matched this search")
+        return
 
     try:
-        result = client.search_files(args.search)
+        results = list(client.iter_search_files(args.search))
     except RPCError as e:
         die(f"search failed: {e}")
 
-    nresults = len(result["results"])
+    nresults = len(results)
     if nresults == 0:
         # we didn't get anything
         die("No files matched this search")
 
     print(f"Found {nresults:d} matching files")
     # first go through entries to format file size and remove potential null obsids
-    for entry in result["results"]:
+    for entry in results:
         entry["size"] = sizeof_fmt(entry["size"])
         if entry["obsid"] is None:
             entry["obsid"] = "None"
 
     # now print the results as a table
-    print_table(
-        result["results"],
-        ["name", "create_time", "obsid", "type", "size"],
-        ["Name", "Created", "Observation", "Type", "Size"],
-    )
+    print_table(results, columns, ["Name", "Created", "Observation", "Type", "Size"])
+
+    return
+
+
+def search_stats(args):
+    """
+    Summarize the files matching a search.
+    """
+    client = LibrarianClient(args.conn_name)
+    group_by = [key.strip() for key in args.group_by.split(",") if len(key.strip())]
+
+    try:
+        results = client.search_file_stats(args.search, group_by=group_by)["results"]
+    except RPCError as e:
+        die(f"search failed: {e}")
+
+    for entry in results:
+        entry["count"] = f"{entry['count']:d}"
+        entry["total_size"] = sizeof_fmt(entry["total_size"])
+
+        for col in ("min_create_time", "max_create_time"):
+            if entry[col] is not None:
+                entry[col] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(entry[col]))
+
+    columns = group_by + ["count", "total_size", "min_create_time", "max_create_time"]
+    names = [key.capitalize() for key in group_by] + [
+        "Files",
+        "Total size",
+        "Earliest created (UTC)",
+        "Latest created (UTC)",
+    ]
+    print_table(results, columns, names)
 
     return
 
@@ -1075,6 +1232,72 @@ def upload(args):
     return
 
 
+def upload_batch(args):
+    """
+    Upload a batch of files to a Librarian.
+    """
+    if args.null_obsid and args.meta != "infer":
+        die('illegal to specify --null-obsid when --meta is not "infer"')
+
+    try:
+        doc = json.load(sys.stdin)
+    except Exception as e:
+        die(f"cannot parse stdin as JSON data: {e}")
+
+    try:
+        uploads = [(item["local_path"], item["dest_store_path"]) for item in doc["uploads"]]
+    except Exception as e:
+        die(f"cannot parse list of uploads from stdin: {e}")
+
+    for _, dest_store_path in uploads:
+        if os.path.isabs(dest_store_path):
+            die("destination path must be relative to store top; " f"got {dest_store_path}")
+
+    if args.meta == "json-stdin":
+        rec_info = doc.get("rec_info", {})
+        meta_mode = "direct"
+    elif args.meta == "infer":
+        rec_info = {}
+        meta_mode = "infer"
+    else:
+        die(f"unexpected metadata-gathering method {args.meta}")
+
+    known_staging_store = None
+    known_staging_subdir = None
+
+    if args.pre_staged is not None:
+        known_staging_store, known_staging_subdir = args.pre_staged.split(":", 1)
+
+    # Let's do it
+    client = LibrarianClient(args.conn_name)
+
+    try:
+        errors = client.upload_files(
+            uploads,
+            meta_mode,
+            rec_info,
+            deletion_policy=args.deletion,
+            known_staging_store=known_staging_store,
+            known_staging_subdir=known_staging_subdir,
+            null_obsid=args.null_obsid,
+            use_globus=args.use_globus,
+            client_id=args.client_id,
+            transfer_token=args.transfer_token,
+            source_endpoint_id=args.source_endpoint_id,
+        )
+    except RPCError as e:
+        die(f"upload failed: {e}")
+
+    for name, message in sorted(errors.items()):
+        print(f"failed to ingest {name}: {message}", file=sys.stderr)
+
+    # This needs to be the last line of output; the Librarian server parses
+    # it when it runs this command for standing orders.
+    print(json.dumps({"errors": errors}))
+
+    return
+
+
 def main():
     # make a parser and run the specified command
     parser = generate_parser()
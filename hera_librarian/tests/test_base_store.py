@@ -71,6 +71,33 @@ def test_copy_to_store(tmp_path, local_store):
     return
 
 
+def test_copy_many_to_store(tmp_path, local_store):
+    # make a couple of fake files in our tmp_path
+    paths = []
+    for name in ["a.txt", "b.txt"]:
+        path = tmp_path / name
+        with open(path, "w") as f:
+            print("hello world", file=f)
+        paths.append(str(path))
+
+    # copy them over in one go
+    local_store[0]._ssh_slurp(f"mkdir {local_store[1]}/test_directory")
+    local_store[0].copy_many_to_store(paths, "test_directory")
+
+    # check that they exist
+    dirpath = os.path.join(local_store[1], "test_directory")
+    assert local_store[0]._ssh_slurp(f"ls {dirpath}").decode("utf-8") == "a.txt\nb.txt\n"
+
+    # names must be unique
+    with pytest.raises(ValueError, match="must be unique"):
+        local_store[0].copy_many_to_store(paths + paths[:1], "test_directory")
+
+    # clean up
+    shutil.rmtree(os.path.join(local_store[1]))
+
+    return
+
+
 def test_chmod(local_store):
     # make a small test file on the store, then change permissions
     tempdir = local_store[1]
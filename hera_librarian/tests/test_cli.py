@@ -119,9 +119,11 @@ def test_generate_parser():
     assert "initiate-offload" in available_subparsers
     assert "offload-helper" in available_subparsers
     assert "search-files" in available_subparsers
+    assert "search-stats" in available_subparsers
     assert "set-file-deletion-policy" in available_subparsers
     assert "stage-files" in available_subparsers
     assert "upload" in available_subparsers
+    assert "upload-batch" in available_subparsers
 
     return
 
@@ -0,0 +1,75 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License
+
+"""Test code in hera_librarian/__init__.py
+
+"""
+
+import pytest
+
+import io
+import json
+import urllib.request
+
+from hera_librarian import LibrarianClient, RPCError
+
+
+class FakeClient(LibrarianClient):
+    """A client that serves search results from a list, a page at a time."""
+
+    def __init__(self, results, paginate=True):
+        super().__init__("fake", {"url": "http://localhost/", "authenticator": "x"})
+        self.results = results
+        self.paginate = paginate
+        self.requests = []
+
+    def _do_http_post(self, operation, **kwargs):
+        self.requests.append(kwargs)
+
+        if not self.paginate:
+            return {"success": True, "results": self.results}
+
+        start = int(kwargs.get("cursor") or 0)
+        stop = start + kwargs["limit"]
+        next_cursor = str(stop) if stop < len(self.results) else None
+        return {"success": True, "results": self.results[start:stop], "next_cursor": next_cursor}
+
+
+def test_iter_search():
+    client = FakeClient(list(range(7)))
+    assert list(client.iter_search_files("{}", page_size=3)) == list(range(7))
+    assert [r.get("cursor") for r in client.requests] == [None, "3", "6"]
+    assert client.requests[0]["output_format"] == "file-listing-json"
+
+    # Old servers that ignore the page size give us everything at once.
+    client = FakeClient(list(range(7)), paginate=False)
+    assert list(client.iter_search_observations("{}", page_size=3)) == list(range(7))
+    assert len(client.requests) == 1
+
+
+def test_stream_search(monkeypatch):
+    client = LibrarianClient("fake", {"url": "http://localhost/", "authenticator": "x"})
+
+    def fake_urlopen(lines):
+        def urlopen(url, params):
+            assert url == "http://localhost/api/search"
+            return io.BytesIO(b"".join(json.dumps(x).encode("utf-8") + b"\n" for x in lines))
+
+        return urlopen
+
+    items = [{"name": "a"}, {"name": "b"}]
+    monkeypatch.setattr(
+        urllib.request, "urlopen", fake_urlopen(items + [{"success": True, "n_results": 2}])
+    )
+    assert list(client.stream_search_files("{}")) == items
+
+    # Errors reported in the trailer, and truncated streams, are errors.
+    monkeypatch.setattr(
+        urllib.request, "urlopen", fake_urlopen(items + [{"success": False, "message": "oops"}])
+    )
+    with pytest.raises(RPCError, match="oops"):
+        list(client.stream_search_files("{}"))
+
+    monkeypatch.setattr(urllib.request, "urlopen", fake_urlopen(items))
+    with pytest.raises(RPCError):
+        list(client.stream_search_files("{}"))
@@ -100,7 +100,19 @@ def is_primary_server():
 # We have to manually import the modules that implement services. It's not
 # crazy to worry about circular dependency issues, but everything will be all
 # right.
-from . import bgtasks, file, misc, observation, search, store, webutil  # noqa: E402
+from . import (  # noqa: E402
+    bgtasks,
+    file,
+    fileevents,
+    misc,
+    nameindex,
+    observation,
+    rollups,
+    search,
+    searchcache,
+    store,
+    webutil,
+)
 
 
 def get_version_info():
@@ -180,11 +192,10 @@ def commandline(argv):
         from tornado import web
         from tornado.httpserver import HTTPServer
         from tornado.ioloop import IOLoop
-        from tornado.wsgi import WSGIContainer
 
-        from .webutil import StreamFile
+        from .webutil import StreamFile, StreamingWSGIContainer
 
-        flask_app = WSGIContainer(app)
+        flask_app = StreamingWSGIContainer(app)
         tornado_app = web.Application(
             [(r"/stream/.*", StreamFile), (r".*", web.FallbackHandler, {"fallback": flask_app})]
         )
@@ -206,12 +217,29 @@ def commandline(argv):
         # that the server is alive.
         bgtasks.register_background_task_reporter()
 
+        # Every server process takes jobs from the persistent queue, including
+        # ones left behind by processes that died.
+        bgtasks.register_job_poller()
+
+        # ... writes out buffered file events, if we're buffering them.
+        fileevents.start_event_buffer()
+
+        # ... and evaluates the standing orders against the files that it
+        # ingests.
+        search.start_standing_order_manager()
+
         if is_primary_server():
-            # Primary server is also in charge of checking out whether there's
-            # anything to do with our standing orders.
+            # Primary server is also in charge of periodically sweeping
+            # through our standing orders for anything that's been missed.
             IOLoop.current().add_callback(search.queue_standing_order_copies)
             search.register_standing_order_checkin()
 
+            # ... and for fixing up any drift in the catalog rollups.
+            rollups.register_reconcile_job()
+
+            # ... and for archiving old file events.
+            fileevents.register_maintenance_job()
+
         # Hack the logger to indicate which server we are.
         import tornado.process
 
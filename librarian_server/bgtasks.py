@@ -3,9 +3,15 @@
 
 """Manage background tasks.
 
-These are of course chained to the lifetime of the server process, so we lose
-track of them all if the server dies, which of course could happen without
-notice at any time.
+Plain BackgroundTasks are chained to the lifetime of the server process, so we
+lose track of them all if the server dies, which of course could happen
+without notice at any time.
+
+Tasks of "durable" types can instead be persisted in the database as
+BackgroundJob records. Every server process polls the job table and claims
+jobs when it has idle workers. A claimed job is "leased" to its process, which
+has to keep renewing the lease while the job runs; if the process dies, the
+lease expires and the job is handed out again.
 
 This system requires Tornado.
 
@@ -14,21 +20,62 @@ This system requires Tornado.
 
 __all__ = str(
     """
+BackgroundJob
 BackgroundTask
+TaskPriority
+durable_task
 submit_background_task
+submit_durable_task
 register_background_task_reporter
+register_job_poller
+register_periodic_job
 get_unfinished_task_count
 """
 ).split()
 
+import datetime
+import heapq
+import itertools
+import json
+import os
+import socket
+import threading
 import time
+import uuid
 from flask import render_template
-from tornado.ioloop import IOLoop
+from sqlalchemy import func, or_
+from sqlalchemy.exc import SQLAlchemyError
+from tornado.ioloop import IOLoop, PeriodicCallback
 
-from . import app, logger
+from . import app, db, logger
+from .dbutil import NotNull
 from .webutil import login_required
 
 
+class TaskPriority:
+    """A simple enumeration of symbolic constants for the priority classes of
+    background tasks. Lower values are dispatched first.
+
+    """
+
+    INTERACTIVE = 0
+    NORMAL = 1
+    BULK = 2
+
+    def __init__(self):
+        raise AssertionError("instantiation of enum not allowed")
+
+    @classmethod
+    def textualize(cls, value):
+        if value == cls.INTERACTIVE:
+            return "interactive"
+        if value == cls.NORMAL:
+            return "normal"
+        if value == cls.BULK:
+            return "bulk"
+        return f"???({value!r})"
+
+
 class BackgroundTask:
     """A class implementing a background task.
 
@@ -42,10 +89,18 @@ class BackgroundTask:
 
     You need to submit the task to TaskManager for it to actually run!
 
+    Each task has a `priority`, one of the TaskPriority constants, and names
+    the worker `pool` that should run it. Tasks in different pools never
+    compete for the same threads, so (e.g.) a pile of long-haul transfers
+    can't hold up quick local operations.
+
     """
 
     _manager = None
+    _job_id = None
     desc = "unset description"
+    priority = TaskPriority.NORMAL
+    pool = "default"
     submit_time = None
     start_time = None
     finish_time = None
@@ -92,10 +147,15 @@ class BackgroundTask:
             return "success"
         return str(self.exception)
 
+    @property
+    def priority_str(self):
+        return TaskPriority.textualize(self.priority)
+
 
 MAX_PURGE_FREQUENCY = 60  # seconds
 MIN_TASK_LIST_LENGTH = 20  # don't purge tasks if more than these are left
 TASK_LINGER_TIME = 600  # seconds
+PRIORITY_AGING_TIME = 300  # seconds of waiting that are worth one priority class
 
 
 def _thread_wrapper(task, parent_ioloop):
@@ -120,12 +180,96 @@ def _wrapup_wrapper(task, thread_retval, thread_exc):
         logger.warn("exception in %s wrapup function: %s", task, e)
         task.exception = thread_exc = e
 
+    if task._job_id is not None:
+        the_job_poller.record_outcome(task)
+
     # We let the task linger in task list for a little while so that it's
     # possible to review historical activity. But while we're here, see if
     # there's anything to purge.
     the_task_manager._maybe_purge_tasks()
 
 
+def _task_sort_key(task):
+    """Compute the key that orders pending tasks for dispatch.
+
+    A task's effective priority improves by one class for every
+    PRIORITY_AGING_TIME seconds that it waits, so that bulk work is never
+    starved. Because every pending task ages at the same rate, ordering by
+    effective priority is the same as ordering by the static quantity below,
+    which means that we can keep the pending tasks in a heap. Ties are broken
+    in submission order.
+
+    """
+    return task.priority * PRIORITY_AGING_TIME + task.submit_time
+
+
+class WorkerPool:
+    """A set of worker threads that pull tasks off of a shared priority queue.
+
+    We used to use a `multiprocessing.pool.ThreadPool` here, but it only
+    knows how to run tasks in submission order.
+
+    """
+
+    def __init__(self, name, n_threads, parent_ioloop):
+        self.name = name
+        self.n_threads = n_threads
+        self.parent_ioloop = parent_ioloop
+        self.n_active = 0
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = []
+
+    @property
+    def n_pending(self):
+        return len(self._heap)
+
+    def submit(self, task):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("cannot submit tasks to closed worker pool %r" % self.name)
+
+            heapq.heappush(self._heap, (_task_sort_key(task), next(self._counter), task))
+
+            if len(self._threads) < self.n_threads:
+                t = threading.Thread(
+                    target=self._worker, name=f"librarian-{self.name}-{len(self._threads)}"
+                )
+                t.daemon = True
+                self._threads.append(t)
+                t.start()
+
+            self._cond.notify()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not len(self._heap) and not self._closed:
+                    self._cond.wait()
+
+                if not len(self._heap):
+                    return  # closed and drained
+
+                task = heapq.heappop(self._heap)[2]
+                self.n_active += 1
+
+            try:
+                _thread_wrapper(task, self.parent_ioloop)
+            finally:
+                with self._cond:
+                    self.n_active -= 1
+
+    def close_and_join(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        for t in self._threads:
+            t.join()
+
+
 class TaskManager:
     tasks = None
     """This is a list of all tasks that are pending, in processing, or have exited
@@ -133,8 +277,9 @@ class TaskManager:
     server's recent activity.
 
     """
-    worker_pool = None
-    """A ThreadPool of workers that can execute the background tasks.
+    pools = None
+    """A dict mapping pool names to WorkerPools that execute the background
+    tasks. Pools are created on demand.
 
     """
     last_purge = 0
@@ -142,6 +287,7 @@ class TaskManager:
 
     def __init__(self):
         self.tasks = []
+        self.pools = {}
         self.last_purge = time.time()
 
     def _maybe_purge_tasks(self):
@@ -164,16 +310,34 @@ class TaskManager:
             if (t.finish_time is None or (now - t.finish_time) < TASK_LINGER_TIME)
         ]
 
+    def _get_pool(self, name):
+        """Get the WorkerPool with the specified name, creating it if needed.
+
+        Pool sizes come from the "worker_pools" configuration item, which maps
+        pool names to thread counts. Pools not listed there get
+        "n_worker_threads" threads.
+
+        """
+        pool = self.pools.get(name)
+
+        if pool is None:
+            n_threads = app.config.get("worker_pools", {}).get(
+                name, app.config.get("n_worker_threads", 8)
+            )
+            pool = self.pools[name] = WorkerPool(name, n_threads, IOLoop.current())
+
+        return pool
+
     def submit(self, task):
         """Submit a task to be run in the background.
 
         It may not be launched immediately if there are a lot of background
-        tasks to deal with.
+        tasks to deal with. Tasks are dispatched in order of their priority
+        class, with older tasks gradually promoted.
 
-        apply_async() returns a result object, but we're a web service so we
-        can't wait around to see what it is. Instead we run the function in a
-        wrapper that uses Tornado's infrastructure to let the main thread know
-        what happened to it.
+        We're a web service so we can't wait around to see what happens to
+        the task. Instead we run the function in a wrapper that uses Tornado's
+        infrastructure to let the main thread know what happened to it.
 
         """
         assert task._manager is None, "may not submit task to multiple managers"
@@ -181,26 +345,17 @@ class TaskManager:
         self._maybe_purge_tasks()
 
         task._manager = self
-
-        if self.worker_pool is None:
-            import multiprocessing.util
-
-            multiprocessing.util.log_to_stderr(5)
-            from multiprocessing.pool import ThreadPool
-
-            self.worker_pool = ThreadPool(app.config.get("n_worker_threads", 8))
-
         task.submit_time = time.time()
         self.tasks.append(task)
-        self.worker_pool.apply_async(_thread_wrapper, (task, IOLoop.current()))
+        self._get_pool(task.pool).submit(task)
 
     def maybe_wait_for_threads_to_finish(self):
-        if self.worker_pool is None:
+        if not len(self.pools):
             return
 
         print("Waiting for background jobs to complete ...")
-        self.worker_pool.close()
-        self.worker_pool.join()
+        for pool in self.pools.values():
+            pool.close_and_join()
         print("   ... done.")
 
 
@@ -215,6 +370,318 @@ def maybe_wait_for_threads_to_finish():
     the_task_manager.maybe_wait_for_threads_to_finish()
 
 
+# Durable jobs. These are BackgroundTasks that are recorded in the database
+# before they're run, so that they survive server restarts and can be picked up
+# by any server process.
+
+DEFAULT_JOB_POLL_INTERVAL = 10  # seconds
+DEFAULT_JOB_LEASE_DURATION = 300  # seconds
+DEFAULT_JOB_MAX_ATTEMPTS = 3
+DEFAULT_JOB_RETRY_DELAY = 300  # seconds
+MAX_JOB_CLAIMS_PER_POLL = 64
+
+_durable_task_kinds = {}
+
+
+def durable_task(cls):
+    """A class decorator that registers a BackgroundTask subclass as being
+    able to be persisted in the job table.
+
+    The class must have a unique `kind` attribute, a method `to_payload()`
+    that returns a JSON-serializable dict, and a classmethod
+    `from_payload(payload)` that reconstructs the task from such a dict.
+    `from_payload` is called on the main thread and so is allowed to access
+    the database. Secrets shouldn't go in the payload; they should be
+    re-read from the server configuration instead.
+
+    """
+    assert cls.kind not in _durable_task_kinds, "duplicate durable task kind %r" % cls.kind
+    _durable_task_kinds[cls.kind] = cls
+    return cls
+
+
+class BackgroundJob(db.Model):
+    """A BackgroundJob is the persistent record of a durable background task.
+
+    Jobs go from "pending" to "running" when a server process claims them,
+    and then to "done" or "failed". Failed attempts are retried, after a
+    delay, until `max_attempts` is reached. The `dispatch_key` orders
+    pending jobs in the same way as `_task_sort_key` does in memory.
+
+    The optional `subject` and `tag` fields let other parts of the server
+    find jobs related to their own records, e.g. the standing-order copies
+    of a particular file.
+
+    """
+
+    __tablename__ = "background_job"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = NotNull(db.String(64))
+    payload = NotNull(db.Text)
+    subject = db.Column(db.String(256))
+    tag = db.Column(db.String(64))
+    priority = NotNull(db.Integer)
+    pool = NotNull(db.String(32))
+    dispatch_key = NotNull(db.Float(precision="53"))
+    state = NotNull(db.String(16))
+    attempts = NotNull(db.Integer)
+    max_attempts = NotNull(db.Integer)
+    lease_owner = db.Column(db.String(128))
+    lease_expires = db.Column(db.DateTime)
+    not_before = db.Column(db.DateTime)
+    submit_time = NotNull(db.DateTime)
+    start_time = db.Column(db.DateTime)
+    finish_time = db.Column(db.DateTime)
+    result = db.Column(db.Text)
+
+    dispatch_index = db.Index("background_job_dispatch", state, dispatch_key)
+    subject_index = db.Index("background_job_subject", subject)
+
+    def __init__(self, task, subject=None, tag=None, max_attempts=None):
+        if max_attempts is None:
+            max_attempts = app.config.get("job_max_attempts", DEFAULT_JOB_MAX_ATTEMPTS)
+
+        now = datetime.datetime.utcnow()
+        self.kind = task.kind
+        self.payload = json.dumps(task.to_payload())
+        self.subject = subject
+        self.tag = tag
+        self.priority = task.priority
+        self.pool = task.pool
+        self.dispatch_key = task.priority * PRIORITY_AGING_TIME + time.time()
+        self.state = "pending"
+        self.attempts = 0
+        self.max_attempts = max_attempts
+        self.submit_time = now
+
+
+def submit_durable_task(task, subject=None, tag=None, max_attempts=None):
+    """Record a durable task in the job table so that some server process will
+    run it.
+
+    The job is added to the current database session but *not* committed, so
+    that callers can commit it atomically with their own records. If this
+    process has a job poller, it is prodded to look for new work right away.
+
+    """
+    assert task.kind in _durable_task_kinds, "task kind %r is not durable" % task.kind
+
+    job = BackgroundJob(task, subject=subject, tag=tag, max_attempts=max_attempts)
+    db.session.add(job)
+
+    if the_job_poller.callback is not None:
+        the_job_poller.ioloop.add_callback(the_job_poller.poll)
+
+    return job
+
+
+def _make_lease_owner_id():
+    return "%s:%d:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+class JobPoller:
+    """Claims jobs from the persistent queue and feeds them to the TaskManager.
+
+    Each server process has one of these. Claims are made with conditional
+    UPDATEs, so that if several processes go after the same job, only one of
+    them gets it. A process only claims as many jobs as its worker pools have
+    free slots, so that busy processes leave work for idle ones.
+
+    """
+
+    callback = None
+    ioloop = None
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.owner = _make_lease_owner_id()
+        self.in_flight = {}
+
+    @property
+    def lease_duration(self):
+        return datetime.timedelta(
+            seconds=app.config.get("job_lease_duration", DEFAULT_JOB_LEASE_DURATION)
+        )
+
+    def start(self):
+        # Our owner ID needs to be recomputed after the server forks.
+        self.owner = _make_lease_owner_id()
+        self.ioloop = IOLoop.current()
+
+        interval = app.config.get("job_poll_interval", DEFAULT_JOB_POLL_INTERVAL)
+        self.callback = PeriodicCallback(self.poll, interval * 1000)
+        self.callback.start()
+        self.ioloop.add_callback(self.poll)
+
+    def poll(self):
+        try:
+            self._recover_expired_leases()
+            self._renew_leases()
+            self._claim_jobs()
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.exception("failed to poll the background job queue")
+
+    def _recover_expired_leases(self):
+        """Jobs whose leases have expired were being run by a process that
+        died. Put them back in the queue, unless they're out of attempts.
+
+        """
+        now = datetime.datetime.utcnow()
+        expired = BackgroundJob.query.filter(
+            BackgroundJob.state == "running", BackgroundJob.lease_expires < now
+        )
+
+        n_retry = expired.filter(BackgroundJob.attempts < BackgroundJob.max_attempts).update(
+            {"state": "pending", "lease_owner": None, "lease_expires": None},
+            synchronize_session=False,
+        )
+        n_failed = expired.filter(BackgroundJob.attempts >= BackgroundJob.max_attempts).update(
+            {
+                "state": "failed",
+                "lease_owner": None,
+                "lease_expires": None,
+                "finish_time": now,
+                "result": "lease expired on final attempt",
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+        if n_retry or n_failed:
+            logger.warn(
+                "recovered %d background jobs with expired leases; %d gave up", n_retry, n_failed
+            )
+
+    def _renew_leases(self):
+        if not len(self.in_flight):
+            return
+
+        BackgroundJob.query.filter(
+            BackgroundJob.id.in_(list(self.in_flight.keys())),
+            BackgroundJob.lease_owner == self.owner,
+        ).update(
+            {"lease_expires": datetime.datetime.utcnow() + self.lease_duration},
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+    def _claim_jobs(self):
+        now = datetime.datetime.utcnow()
+        candidates = (
+            BackgroundJob.query.filter(
+                BackgroundJob.state == "pending",
+                or_(BackgroundJob.not_before.is_(None), BackgroundJob.not_before <= now),
+            )
+            .order_by(BackgroundJob.dispatch_key)
+            .limit(MAX_JOB_CLAIMS_PER_POLL)
+            .all()
+        )
+
+        for job in candidates:
+            pool = self.manager._get_pool(job.pool)
+            if pool.n_active + pool.n_pending >= pool.n_threads:
+                continue
+
+            n = BackgroundJob.query.filter(
+                BackgroundJob.id == job.id, BackgroundJob.state == "pending"
+            ).update(
+                {
+                    "state": "running",
+                    "lease_owner": self.owner,
+                    "lease_expires": now + self.lease_duration,
+                    "attempts": BackgroundJob.attempts + 1,
+                    "start_time": now,
+                },
+                synchronize_session=False,
+            )
+            db.session.commit()
+
+            if n != 1:
+                continue  # some other process beat us to it
+
+            try:
+                task = _durable_task_kinds[job.kind].from_payload(json.loads(job.payload))
+            except Exception as e:
+                logger.warn("cannot reconstruct background job #%d (%s): %s", job.id, job.kind, e)
+                self._finish(job.id, "failed", "cannot reconstruct task: %s" % e)
+                continue
+
+            task.priority = job.priority
+            task.pool = job.pool
+            task._job_id = job.id
+            self.in_flight[job.id] = task
+            self.manager.submit(task)
+
+    def _finish(self, job_id, state, result, not_before=None):
+        now = datetime.datetime.utcnow()
+        values = {
+            "state": state,
+            "lease_owner": None,
+            "lease_expires": None,
+            "not_before": not_before,
+            "result": result,
+        }
+        if state != "pending":
+            values["finish_time"] = now
+
+        n = BackgroundJob.query.filter(
+            BackgroundJob.id == job_id, BackgroundJob.lease_owner == self.owner
+        ).update(values, synchronize_session=False)
+
+        try:
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.exception("failed to record the outcome of background job #%d", job_id)
+            return
+
+        if n != 1:
+            logger.warn("lost the lease on background job #%d before it finished", job_id)
+
+    def record_outcome(self, task):
+        """Record the outcome of a job in the database. Called on the main
+        thread after the task's wrapup function has run.
+
+        """
+        self.in_flight.pop(task._job_id, None)
+
+        if task.exception is None:
+            self._finish(task._job_id, "done", task.outcome_str)
+            return
+
+        job = BackgroundJob.query.get(task._job_id)
+
+        if job is not None and job.attempts < job.max_attempts:
+            delay = app.config.get("job_retry_delay", DEFAULT_JOB_RETRY_DELAY)
+            not_before = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+            self._finish(task._job_id, "pending", task.outcome_str, not_before=not_before)
+        else:
+            self._finish(task._job_id, "failed", task.outcome_str)
+
+
+the_job_poller = JobPoller(the_task_manager)
+
+
+def register_job_poller():
+    """Start polling the persistent job queue for work. Every server process
+    should do this.
+
+    """
+    the_job_poller.start()
+    return the_job_poller.callback
+
+
+def get_job_state_counts():
+    """Get a dict mapping job states to the number of jobs in each state."""
+    return dict(
+        db.session.query(BackgroundJob.state, func.count(BackgroundJob.id)).group_by(
+            BackgroundJob.state
+        )
+    )
+
+
 def log_background_task_status():
     active = [
         t for t in the_task_manager.tasks if t.start_time is not None and t.finish_time is None
@@ -230,6 +697,127 @@ def log_background_task_status():
         len(finished),
     )
 
+    for pool in the_task_manager.pools.values():
+        logger.info(
+            'worker pool "%s": %d/%d threads busy, %d pending',
+            pool.name,
+            pool.n_active,
+            pool.n_threads,
+            pool.n_pending,
+        )
+
+    for job in _periodic_jobs:
+        if job.last_start is not None:
+            logger.info(
+                'periodic job "%s": last run took %.1f s with outcome "%s"; %d skipped',
+                job.name,
+                job.last_duration,
+                job.last_status,
+                job.n_skipped,
+            )
+
+
+# Periodic jobs. Unlike BackgroundTasks, these are housekeeping operations
+# that need to use the database, which they do in their own threads so that
+# they don't block the IOLoop while they grind away.
+
+
+class PeriodicJob:
+    """A function that is run from time to time in its own thread.
+
+    The function is run inside a fresh application context, so that it gets
+    its own database session. Only one run of a given job happens at a time.
+    If the job is triggered while it's already running, the trigger is
+    ignored, unless `coalesce` is True, in which case the job is run one more
+    time after the current run finishes.
+
+    Because the function doesn't run on the IOLoop thread, it must not call
+    into Tornado, except for `IOLoop.add_callback`, which is thread-safe.
+
+    """
+
+    def __init__(self, name, func, coalesce=False):
+        self.name = name
+        self.func = func
+        self.coalesce = coalesce
+        self.running = False
+        self.rerun_requested = False
+        self.n_runs = 0
+        self.n_skipped = 0
+        self.last_start = None
+        self.last_finish = None
+        self.last_status = None
+        self._lock = threading.Lock()
+
+    @property
+    def last_duration(self):
+        if self.last_start is None or self.last_finish is None:
+            return None
+        return self.last_finish - self.last_start
+
+    def trigger(self):
+        """Start running the job, unless it's already running. Returns True if
+        a new run was started.
+
+        """
+        with self._lock:
+            if self.running:
+                if self.coalesce:
+                    self.rerun_requested = True
+                else:
+                    self.n_skipped += 1
+                    logger.info('periodic job "%s" still running; skipping this run', self.name)
+                return False
+
+            self.running = True
+
+        t = threading.Thread(target=self._run, name="librarian-periodic-" + self.name)
+        t.daemon = True
+        t.start()
+        return True
+
+    def _run(self):
+        while True:
+            start = time.time()
+
+            with app.app_context():
+                try:
+                    self.func()
+                    status = "success"
+                except Exception as e:
+                    db.session.rollback()
+                    logger.exception('periodic job "%s" failed', self.name)
+                    status = str(e) or e.__class__.__name__
+
+            with self._lock:
+                self.n_runs += 1
+                self.last_start = start
+                self.last_finish = time.time()
+                self.last_status = status
+
+                if not self.rerun_requested:
+                    self.running = False
+                    return
+
+                self.rerun_requested = False
+
+
+_periodic_jobs = []
+
+
+def register_periodic_job(name, func, interval, coalesce=False):
+    """Create a PeriodicJob that runs `func` every `interval` seconds. If
+    `interval` is None, the job is only run when explicitly triggered.
+
+    """
+    job = PeriodicJob(name, func, coalesce=coalesce)
+    _periodic_jobs.append(job)
+
+    if interval is not None:
+        PeriodicCallback(job.trigger, interval * 1000).start()
+
+    return job
+
 
 def register_background_task_reporter():
     """Create a Tornado PeriodicCallback that will periodically report on the
@@ -274,6 +862,25 @@ def tasks():
     pending = [t for t in the_task_manager.tasks if t.start_time is None]
     finished = [t for t in the_task_manager.tasks if t.finish_time is not None]
 
+    pending.sort(key=_task_sort_key)
+    pools = sorted(the_task_manager.pools.values(), key=lambda p: p.name)
+    periodic_jobs = sorted(_periodic_jobs, key=lambda j: j.name)
+    job_counts = get_job_state_counts()
+    failed_jobs = (
+        BackgroundJob.query.filter(BackgroundJob.state == "failed")
+        .order_by(BackgroundJob.finish_time.desc())
+        .limit(20)
+        .all()
+    )
+
     return render_template(
-        "task-listing.html", title="Tasks", active=active, pending=pending, finished=finished
+        "task-listing.html",
+        title="Tasks",
+        active=active,
+        pending=pending,
+        finished=finished,
+        pools=pools,
+        periodic_jobs=periodic_jobs,
+        job_counts=job_counts,
+        failed_jobs=failed_jobs,
     )
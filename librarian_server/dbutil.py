@@ -9,17 +9,133 @@
 __all__ = str(
     """
 NotNull
+in_chunks
+insert_missing_rows
+note_new_keys
+watch_new_objects
 """
 ).split()
 
+from sqlalchemy import event
+
 from . import db
 
 # Useful name reexport
 
 
-# Right now this module does almost nothing. Maybe that will change in the
-# future?
-
-
 def NotNull(kind, **kwargs):  # noqa: N802
     return db.Column(kind, nullable=False, **kwargs)
+
+
+IN_CLAUSE_CHUNK_SIZE = 500
+
+
+def in_chunks(items, size=IN_CLAUSE_CHUNK_SIZE):
+    """Split a sequence into lists that are small enough to use as the
+    arguments of an SQL "IN" clause. Databases limit the number of parameters
+    that a statement can have, and huge IN lists are slow to plan anyway, so
+    lookups of large sets of keys should be done a chunk at a time.
+
+    """
+    items = list(items)
+
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def insert_missing_rows(conn, table, rows):
+    """Insert the dicts `rows` into `table` using the connection `conn`,
+    skipping any whose primary keys are already taken. On PostgreSQL and
+    SQLite this holds even for keys that a concurrent transaction inserts
+    while we're at it; elsewhere, we just leave out the keys that are already
+    there when we look.
+
+    """
+    if not len(rows):
+        return
+
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif conn.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy import select, tuple_
+
+        cols = list(table.primary_key.columns)
+        keys = [tuple(row[c.name] for c in cols) for row in rows]
+        taken = set()
+
+        for chunk in in_chunks(keys):
+            taken.update(
+                tuple(k) for k in conn.execute(select(*cols).where(tuple_(*cols).in_(chunk)))
+            )
+
+        rows = [row for row, key in zip(rows, keys) if key not in taken]
+        if len(rows):
+            conn.execute(table.insert(), rows)
+        return
+
+    conn.execute(insert(table).on_conflict_do_nothing(), rows)
+
+
+# Hooks that let other parts of the server find out about new database
+# records once they've actually been committed. Watchers are called with
+# the set of keys of the new objects of their model type. They run inside the
+# session's "after_commit" event, so they may not use the database themselves;
+# they should just make a note of what's happened and schedule any further
+# work for later.
+
+_watchers = []
+
+
+def watch_new_objects(model, key, callback):
+    """Arrange for `callback(keys)` to be called after every commit that
+    inserted new `model` objects. `keys` is the set of the values of the
+    `key` attribute of those objects.
+
+    """
+    _watchers.append((model, key, callback))
+
+
+def note_new_keys(model, keys):
+    """Tell the watchers about new `model` objects that were inserted without
+    going through the ORM, e.g. with bulk INSERTs. Like ORM-created objects,
+    they are only reported if and when the current session is committed.
+
+    """
+    pending = db.session().info.setdefault("dbutil_new_keys", {})
+    pending.setdefault(model, set()).update(keys)
+
+
+@event.listens_for(db.session, "after_flush")
+def _collect_new_objects(session, flush_context):
+    if not len(_watchers):
+        return
+
+    pending = session.info.setdefault("dbutil_new_keys", {})
+
+    for model, key, _callback in _watchers:
+        for obj in session.new:
+            if isinstance(obj, model):
+                pending.setdefault(model, set()).add(getattr(obj, key))
+
+
+@event.listens_for(db.session, "after_commit")
+def _report_new_objects(session):
+    pending = session.info.pop("dbutil_new_keys", None)
+    if not pending:
+        return
+
+    for model, _key, callback in _watchers:
+        keys = pending.get(model)
+        if keys:
+            callback(keys)
+
+
+@event.listens_for(db.session, "after_transaction_end")
+def _forget_new_objects(session, transaction):
+    # Rolling back a SAVEPOINT doesn't affect the objects flushed outside it,
+    # so we only give up on them when the outermost transaction ends. After a
+    # commit, `_report_new_objects` has already taken them.
+    if transaction.parent is None:
+        session.info.pop("dbutil_new_keys", None)
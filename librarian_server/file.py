@@ -9,6 +9,7 @@ __all__ = str(
 File
 FileInstance
 FileEvent
+FileNamePrefix
 """
 ).split()
 
@@ -17,23 +18,37 @@ import json
 import os.path
 import sys
 from flask import flash, redirect, render_template, url_for
+from sqlalchemy import event
 from sqlalchemy.engine.row import Row
 from sqlalchemy.exc import SQLAlchemyError
 
 from . import app, db, logger
 from .dbutil import NotNull
+from .fileevents import record_event
 from .observation import Observation
 from .store import Store
 from .webutil import ServerError, json_api, login_required, optional_arg, required_arg
 
 
+def hera_name_prefix(name):
+    """Get the "zen.JD" prefix of a HERA-style file name, e.g. "zen.2458000.12345"
+    for "zen.2458000.12345.xx.uvh5". Returns None if the name doesn't follow
+    the HERA conventions.
+
+    """
+    bits = name.split(".")
+    if len(bits) < 4:
+        return None
+    return ".".join(bits[:3])
+
+
 def infer_file_obsid(parent_dirs, name, info):
     """Infer the obsid associated with a file based on the limited information we
     have about it. Raises an exception if this cannot be done *with
     certainty*.
 
     The "hera" mode does this by looking for existing files whose names start
-    with the same "zen.JD" prefix.
+    with the same "zen.JD" prefix, as recorded in the FileNamePrefix table.
 
     The "none" mode refuses to do this.
 
@@ -46,26 +61,7 @@ def infer_file_obsid(parent_dirs, name, info):
         raise ServerError('refusing to try to infer the obsid of candidate new file "%s"', name)
 
     if mode == "hera":
-        bits = name.split(".")
-        if len(bits) < 4:
-            raise ServerError(
-                'need to infer obsid of HERA file "%s", but its name looks weird', name
-            )
-
-        prefix = ".".join(bits[:3])
-        obsids = list(
-            db.session.query(File.obsid).filter(File.name.like(prefix + ".%")).group_by(File.obsid)
-        )
-
-        if len(obsids) != 1:
-            raise ServerError(
-                'need to infer obsid of HERA file "%s", but got %d candidate '
-                "obsids from similarly-named files",
-                name,
-                len(obsids),
-            )
-
-        return obsids[0]
+        return ObsidInferrer().infer(name)
 
     if mode == "_testing":
         bits = name.split(".")
@@ -83,6 +79,73 @@ def infer_file_obsid(parent_dirs, name, info):
     raise ServerError('configuration problem: unknown "obsid_inference_mode" setting %r', mode)
 
 
+_CONFLICTING_OBSIDS = object()  # candidate marker for FileNamePrefix conflicts
+
+
+class ObsidInferrer:
+    """Infer the obsids of new files.
+
+    This implements the "hera" mode of `infer_file_obsid`. Candidate obsids
+    are looked up by prefix in the FileNamePrefix table, and cached, so that
+    it's cheap to handle large batches of files. The obsids of new files
+    in a batch should be passed to `note_file()` as they're determined, so
+    that later files can be matched up with earlier ones, just as if the
+    earlier ones had already been committed to the database.
+
+    """
+
+    def __init__(self):
+        self.mode = app.config.get("obsid_inference_mode", "none")
+        self._candidates = {}  # "zen.JD" prefix => set of obsids
+
+    def _get_candidates(self, prefix):
+        candidates = self._candidates.get(prefix)
+
+        if candidates is None:
+            candidates = self._candidates[prefix] = set()
+            row = FileNamePrefix.query.get(prefix)
+
+            if row is not None:
+                candidates.add(row.obsid)
+                if row.conflicted:
+                    candidates.add(_CONFLICTING_OBSIDS)
+
+        return candidates
+
+    def note_file(self, name, obsid):
+        """Record that the file *name* has the obsid *obsid*."""
+        prefix = hera_name_prefix(name)
+        if prefix is not None:
+            self._get_candidates(prefix).add(obsid)
+
+    def infer(self, name):
+        """Infer the obsid of the file *name*, raising a ServerError if this
+        can't be done with certainty.
+
+        """
+        if self.mode != "hera":
+            # The other modes don't use the database.
+            return infer_file_obsid(None, name, None)
+
+        prefix = hera_name_prefix(name)
+        if prefix is None:
+            raise ServerError(
+                'need to infer obsid of HERA file "%s", but its name looks weird', name
+            )
+
+        obsids = self._get_candidates(prefix)
+
+        if len(obsids) != 1:
+            raise ServerError(
+                'need to infer obsid of HERA file "%s", but got %d candidate '
+                "obsids from similarly-named files",
+                name,
+                len(obsids),
+            )
+
+        return next(iter(obsids))
+
+
 class File(db.Model):
     """A File describes a data product generated by HERA.
 
@@ -111,10 +174,15 @@ class File(db.Model):
     md5 = NotNull(db.String(32))
 
     source = NotNull(db.String(64))
+    num_instances = NotNull(db.Integer, default=0)  # rollup; see the `rollups` module
     observation = db.relationship("Observation", back_populates="files")
     instances = db.relationship("FileInstance", back_populates="file")
     events = db.relationship("FileEvent", back_populates="file")
 
+    obsid_index = db.Index("file_obsid", obsid)
+    create_time_index = db.Index("file_create_time", create_time)
+    source_index = db.Index("file_source", source, obsid)
+
     def __init__(self, name, type, obsid, source, size, md5, create_time=None):
         if create_time is None:
             # We round our times to whole seconds so that they can be
@@ -251,6 +319,80 @@ class File(db.Model):
 
         return fobj
 
+    @classmethod
+    def infer_new_files(cls, store, entries, source_name, null_obsid=False):
+        """A bulk version of `get_inferring_info` for files that don't have File
+        records yet.
+
+        *entries* is a list of `(store_path, info)` tuples, in the order in
+        which the files should be created. As in `get_inferring_info`, if
+        an *info* is None, we SSH into the store to gather it ourselves.
+
+        Returns a list of new File objects, which are *not* added to the
+        database session. Any Observations that they need are created and
+        added to the session. Nothing is committed. A ServerError is raised
+        if any of the files is unacceptable.
+
+        """
+        from . import mc_integration as mc
+        from .dbutil import in_chunks
+
+        inferrer = ObsidInferrer()
+        files = []
+
+        for store_path, info in entries:
+            name = os.path.basename(store_path)
+
+            if info is None:
+                try:
+                    info = store.get_info_for_path(store_path)
+                except Exception as e:
+                    raise ServerError("cannot register %s:%s: %s", store.name, store_path, e)
+
+            size = required_arg(info, int, "size")
+            md5 = required_arg(info, str, "md5")
+            ttp = required_arg(info, str, "type")
+            obsid = optional_arg(info, int, "obsid")
+
+            if null_obsid:
+                if obsid is not None:
+                    raise ServerError(
+                        "new file %s is expected to have a null obsid, but it has %r", name, obsid
+                    )
+            elif obsid is None:
+                # See get_inferring_info() for the story here.
+                obsid = inferrer.infer(name)
+
+            inferrer.note_file(name, obsid)
+            files.append(cls(name, ttp, obsid, source_name, size, md5))
+
+        # Make sure that all of the needed Observations exist, looking up the
+        # ones that we already have in as few queries as possible.
+
+        obsids = {f.obsid for f in files if f.obsid is not None}
+        known_obsids = set()
+
+        for chunk in in_chunks(sorted(obsids)):
+            q = db.session.query(Observation.obsid).filter(Observation.obsid.in_(chunk))
+            known_obsids.update(row[0] for row in q)
+
+        for obsid in sorted(obsids - known_obsids):
+            mc.create_observation_record(obsid)
+
+        invalid = mc.find_invalid_file_records(files)
+        if len(invalid):
+            raise ServerError(
+                (
+                    "new file %s (obsid %s) and %d others rejected by M&C; "
+                    "see M&C error logs for the reason"
+                ),
+                invalid[0].name,
+                invalid[0].obsid,
+                len(invalid) - 1,
+            )
+
+        return files
+
     def delete_instances(self, mode="standard", restrict_to_store=None):
         """DANGER ZONE! Delete instances of this file on all stores!
 
@@ -468,6 +610,89 @@ class DeletionPolicy:
         return f"???({value!r})"
 
 
+class FileNamePrefix(db.Model):
+    """A FileNamePrefix records the obsid of the files whose names start with a
+    given HERA-style "zen.JD" prefix (see `hera_name_prefix`). This makes
+    the "hera" obsid inference mode a primary-key lookup, rather than a
+    search of the whole file table.
+
+    All of the files with a given prefix should have the same obsid. If they
+    don't, the prefix is marked as `conflicted` and obsids can't be inferred
+    from it. Maintenance files with null obsids count as having a distinct
+    obsid of their own.
+
+    Rows are maintained automatically when File records are added through
+    the ORM. Code that bulk-inserts File records must call `note_files()`
+    itself.
+
+    """
+
+    __tablename__ = "file_name_prefix"
+
+    prefix = db.Column(db.String(256), primary_key=True)
+    obsid = db.Column(db.BigInteger, nullable=True)
+    conflicted = NotNull(db.Boolean, default=False)
+
+    def __init__(self, prefix, obsid):
+        self.prefix = prefix
+        self.obsid = obsid
+        self.conflicted = False
+
+    @classmethod
+    def note_files(cls, files):
+        """Update the table for a batch of new files. *files* is an iterable of
+        `(name, obsid)` tuples. The changes are made in the current database
+        session but not committed.
+
+        """
+        from .dbutil import in_chunks, insert_missing_rows
+
+        by_prefix = {}
+
+        for name, obsid in files:
+            prefix = hera_name_prefix(name)
+            if prefix is not None:
+                by_prefix.setdefault(prefix, set()).add(obsid)
+
+        # Another server process may be adding files with the same new
+        # prefixes, so we insert the rows that we need, skipping any that
+        # already exist, and then read back whatever actually got stored.
+        insert_missing_rows(
+            db.session.connection(),
+            cls.__table__,
+            [
+                dict(prefix=prefix, obsid=next(iter(obsids)), conflicted=False)
+                for prefix, obsids in by_prefix.items()
+            ],
+        )
+
+        existing = {}
+
+        with db.session.no_autoflush:
+            for chunk in in_chunks(sorted(by_prefix)):
+                for row in cls.query.filter(cls.prefix.in_(chunk)):
+                    existing[row.prefix] = row
+
+        for prefix, obsids in by_prefix.items():
+            row = existing[prefix]
+
+            if obsids != {row.obsid} and not row.conflicted:
+                logger.warn(
+                    "files with name prefix %s have conflicting obsids %s; can no "
+                    "longer infer obsids for them",
+                    prefix,
+                    sorted(obsids | {row.obsid}, key=str),
+                )
+                row.conflicted = True
+
+
+@event.listens_for(db.session, "before_flush")
+def _note_new_file_name_prefixes(session, flush_context, instances):
+    new_files = [(obj.name, obj.obsid) for obj in session.new if isinstance(obj, File)]
+    if len(new_files):
+        FileNamePrefix.note_files(new_files)
+
+
 class FileInstance(db.Model):
     """A FileInstance is a copy of a File that lives on one of this Librarian's
     stores.
@@ -564,7 +789,10 @@ class FileEvent(db.Model):
     payload = db.Column(db.Text)
     file = db.relationship("File", back_populates="events")
 
-    name_index = db.Index("file_event_name", name)
+    # The first serves lookups of a given file's events, the second searches
+    # for all of the files that have an event of a given type.
+    name_index = db.Index("file_event_name_type", name, type)
+    type_index = db.Index("file_event_type_name", type, name)
 
     def __init__(self, name, type, payload_struct):
         if "/" in name:
@@ -599,8 +827,8 @@ def create_file_event(args, sourcename=None):
     if file is None:
         raise ServerError('no known file "%s"', file_name)
 
-    event = file.make_generic_event(tp, **payload)
-    db.session.add(event)
+    # Clients expect to see their events right away, so these aren't buffered.
+    db.session.add(file.make_generic_event(tp, **payload))
 
     try:
         db.session.commit()
@@ -673,7 +901,7 @@ def set_one_file_deletion_policy(args, sourcename=None):
     else:
         raise ServerError('no instances of file "%s" on this librarian', file_name)
 
-    db.session.add(
+    record_event(
         file.make_generic_event(
             "instance_deletion_policy_changed",
             store_name=inst.store_object.name,
@@ -0,0 +1,689 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the BSD License.
+
+"""Recording, retention, archiving, and partitioning of file events.
+
+The file_event table only ever grows: every upload, copy, deletion, policy
+change, and standing order completion adds rows to it, as do clients through
+the `create_file_event` API call. The server records its own events with
+`record_event()`, which can buffer them up to be written in batches; see
+below. Two things keep the table itself manageable.
+
+First, retention. If `file_event_retention_days` is set, the primary server
+periodically moves events older than that out of the database and into
+gzipped JSON-lines files in `file_event_archive_dir`. Only the types listed
+in `file_event_archive_types` are archived; a type ending in "*" matches all
+types with that prefix. The default list covers the audit-trail events that
+the Librarian creates for itself and never looks at again. Events of other
+types, notably the ones that clients create, are kept, since searches such
+as `no-file-has-event` and the `describe_session_without_event` API call
+depend on them. Each archive file holds one batch of events and is named
+after the range of their IDs. Per-type counts and time ranges of the
+archived events are kept in the database, so that `summarize_file_events()`
+can still describe the whole history.
+
+Second, partitioning. On PostgreSQL, `partition_file_events()` converts the
+table into one that is range-partitioned by month on the event time, so
+that the indexes of the recent partitions stay small and time-bounded
+queries, including the archiving ones, skip old partitions. The conversion
+rewrites the whole table, so it's a one-off operation to be done while the
+server is stopped, using `scripts/partition_file_events.py`. After that, the
+archiving job also creates partitions for the upcoming months.
+
+"""
+
+
+__all__ = str(
+    """
+DEFAULT_ARCHIVE_TYPES
+FileEventArchiveSummary
+archive_file_events
+ensure_partitions
+flush_events
+maintain_file_events
+partition_file_events
+record_event
+register_maintenance_job
+start_event_buffer
+summarize_file_events
+"""
+).split()
+
+import atexit
+import calendar
+import contextlib
+import datetime
+import gzip
+import json
+import os
+import threading
+from sqlalchemy import Table, and_, event, false, func, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import visitors
+
+from . import app, db, logger
+from .dbutil import NotNull
+from .webutil import ServerError, json_api
+
+DEFAULT_ARCHIVE_TYPES = [
+    "copy_finished",
+    "create_instance",
+    "delete_instance",
+    "instance_deletion_policy_changed",
+    "launch_copy",
+    "standing_order_succeeded:*",
+]
+ARCHIVE_BATCH_SIZE = 10000
+PARTITION_MONTHS_AHEAD = 3
+
+
+class FileEventArchiveSummary(db.Model):
+    """The number and time range of the archived file events of one type."""
+
+    __tablename__ = "file_event_archive_summary"
+
+    type = db.Column(db.String(64), primary_key=True)
+    num_archived = NotNull(db.BigInteger)
+    first_time = NotNull(db.DateTime)
+    last_time = NotNull(db.DateTime)
+
+    def __init__(self, type, first_time, last_time):
+        self.type = type
+        self.num_archived = 0
+        self.first_time = first_time
+        self.last_time = last_time
+
+
+# Archiving
+
+
+def _type_condition(events, types):
+    exact = [t for t in types if not t.endswith("*")]
+    clauses = [events.c.type.in_(exact)] if len(exact) else []
+    clauses += [events.c.type.startswith(t[:-1], autoescape=True) for t in types if t.endswith("*")]
+    return or_(*clauses) if len(clauses) else false()
+
+
+def _write_archive(rows, archive_dir):
+    """Write the event rows `rows` to a new archive file, making sure that
+    it's on disk before we return its path.
+
+    """
+    path = os.path.join(archive_dir, "file_events.%d-%d.jsonl.gz" % (rows[0].id, rows[-1].id))
+    temp_path = path + ".tmp"
+
+    with open(temp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for row in rows:
+                record = dict(row._mapping, time=row.time.isoformat())
+                f.write(json.dumps(record).encode("utf-8") + b"\n")
+
+        raw.flush()
+        os.fsync(raw.fileno())
+
+    os.rename(temp_path, path)
+    return path
+
+
+def _note_archived(rows):
+    by_type = {}
+
+    for row in rows:
+        n, first, last = by_type.get(row.type, (0, row.time, row.time))
+        by_type[row.type] = (n + 1, min(first, row.time), max(last, row.time))
+
+    for tp, (n, first, last) in by_type.items():
+        summary = FileEventArchiveSummary.query.get(tp)
+        if summary is None:
+            summary = FileEventArchiveSummary(tp, first, last)
+            db.session.add(summary)
+
+        summary.num_archived += n
+        summary.first_time = min(summary.first_time, first)
+        summary.last_time = max(summary.last_time, last)
+
+
+def archive_file_events(now=None):
+    """Move old file events of the archivable types out of the database and
+    into archive files, according to the server configuration. Returns the
+    number of events archived.
+
+    If the server dies at just the wrong moment, a batch of events may be
+    written to an archive file but not deleted from the database, in which
+    case they'll be archived again the next time around. Their IDs make such
+    duplicates easy to spot.
+
+    """
+    from .file import FileEvent
+
+    days = app.config.get("file_event_retention_days")
+    if days is None:
+        return 0
+
+    archive_dir = app.config.get("file_event_archive_dir")
+    if archive_dir is None:
+        raise ServerError('"file_event_archive_dir" must be set to archive old file events')
+
+    types = app.config.get("file_event_archive_types", DEFAULT_ARCHIVE_TYPES)
+
+    if now is None:
+        now = datetime.datetime.utcnow()
+
+    events = FileEvent.__table__
+    condition = and_(
+        events.c.time < now - datetime.timedelta(days=days), _type_condition(events, types)
+    )
+    os.makedirs(archive_dir, exist_ok=True)
+    n_archived = 0
+
+    while True:
+        conn = db.session.connection()
+        rows = conn.execute(
+            select(events).where(condition).order_by(events.c.id).limit(ARCHIVE_BATCH_SIZE)
+        ).all()
+
+        if not len(rows):
+            break
+
+        path = _write_archive(rows, archive_dir)
+
+        # We took the lowest matching IDs, so there aren't any other matches
+        # between the first and last of them.
+        try:
+            conn.execute(
+                events.delete().where(condition, events.c.id.between(rows[0].id, rows[-1].id))
+            )
+            _note_archived(rows)
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            os.unlink(path)
+            raise
+
+        n_archived += len(rows)
+        logger.info("archived %d file events to %s", len(rows), path)
+
+    return n_archived
+
+
+def summarize_file_events():
+    """Summarize the file events of each type, including any that have been
+    archived. Returns a list of dicts, sorted by type, giving the "type", the
+    total "count" of events, how many of them are "num_archived", and the
+    "first_time" and "last_time" of the events as Unix times.
+
+    """
+    from .file import FileEvent
+
+    summary = {}
+    live = db.session.query(
+        FileEvent.type, func.count(), func.min(FileEvent.time), func.max(FileEvent.time)
+    ).group_by(FileEvent.type)
+
+    for tp, count, first, last in live:
+        summary[tp] = dict(type=tp, count=count, num_archived=0, first_time=first, last_time=last)
+
+    for archived in FileEventArchiveSummary.query:
+        item = summary.setdefault(
+            archived.type,
+            dict(
+                type=archived.type,
+                count=0,
+                num_archived=0,
+                first_time=archived.first_time,
+                last_time=archived.last_time,
+            ),
+        )
+        item["count"] += archived.num_archived
+        item["num_archived"] = archived.num_archived
+        item["first_time"] = min(item["first_time"], archived.first_time)
+        item["last_time"] = max(item["last_time"], archived.last_time)
+
+    results = sorted(summary.values(), key=lambda item: item["type"] or "")
+
+    for item in results:
+        item["first_time"] = calendar.timegm(item["first_time"].timetuple())
+        item["last_time"] = calendar.timegm(item["last_time"].timetuple())
+
+    return results
+
+
+@app.route("/api/file_event_summary", methods=["GET", "POST"])
+@json_api
+def file_event_summary(args, sourcename=None):
+    """Summarize the file events of each type, including archived ones."""
+    return {"types": summarize_file_events()}
+
+
+# Partitioning
+
+
+def _next_month(t):
+    return datetime.datetime(t.year + t.month // 12, t.month % 12 + 1, 1)
+
+
+def _month_partitions(first, last):
+    """Yield `(name, start, end)` for the monthly partitions covering the times
+    `first` through `last`.
+
+    """
+    t = datetime.datetime(first.year, first.month, 1)
+
+    while t <= last:
+        end = _next_month(t)
+        yield "file_event_y%04dm%02d" % (t.year, t.month), t, end
+        t = end
+
+
+def _months_ahead(now):
+    t = now
+
+    for _ in range(PARTITION_MONTHS_AHEAD):
+        t = _next_month(t)
+
+    return t
+
+
+def _is_partitioned(conn):
+    if conn.dialect.name != "postgresql":
+        return False
+
+    return conn.exec_driver_sql(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = 'file_event'::regclass)"
+    ).scalar()
+
+
+def _create_partitions(conn, first, last):
+    existing = set(
+        conn.exec_driver_sql(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'file_event'::regclass"
+        ).scalars()
+    )
+    n = 0
+
+    for name, start, end in _month_partitions(first, last):
+        if name not in existing:
+            conn.exec_driver_sql(
+                f"CREATE TABLE {name} PARTITION OF file_event "
+                f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+            )
+            n += 1
+
+    return n
+
+
+def ensure_partitions(now=None):
+    """If the file_event table is partitioned, create any missing partitions
+    for the next few months. Returns the number of partitions created.
+
+    """
+    conn = db.session.connection()
+    if not _is_partitioned(conn):
+        return 0
+
+    if now is None:
+        now = datetime.datetime.utcnow()
+
+    n = _create_partitions(conn, now, _months_ahead(now))
+    db.session.commit()
+    return n
+
+
+# Keep the column definitions synchronized with the FileEvent model. The
+# primary key has to include the partitioning column.
+
+_partition_setup = [
+    "ALTER TABLE file_event RENAME TO file_event_unpartitioned",
+    "ALTER TABLE file_event_unpartitioned RENAME CONSTRAINT file_event_pkey "
+    "TO file_event_unpartitioned_pkey",
+    "ALTER SEQUENCE file_event_id_seq OWNED BY NONE",
+    "DROP INDEX file_event_name_type",
+    "DROP INDEX file_event_type_name",
+    """CREATE TABLE file_event (
+        id BIGINT NOT NULL DEFAULT nextval('file_event_id_seq'),
+        name VARCHAR(256) REFERENCES file (name),
+        time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        type VARCHAR(64),
+        payload TEXT,
+        PRIMARY KEY (id, time)
+    ) PARTITION BY RANGE (time)""",
+    "ALTER SEQUENCE file_event_id_seq OWNED BY file_event.id",
+    "CREATE INDEX file_event_name_type ON file_event (name, type)",
+    "CREATE INDEX file_event_type_name ON file_event (type, name)",
+    "CREATE TABLE file_event_default PARTITION OF file_event DEFAULT",
+]
+
+_partition_finish = [
+    "INSERT INTO file_event (id, name, time, type, payload) "
+    "SELECT id, name, time, type, payload FROM file_event_unpartitioned",
+    "DROP TABLE file_event_unpartitioned",
+]
+
+
+def partition_file_events(now=None):
+    """Convert the file_event table into one that is partitioned by month,
+    copying over all of the existing events. This only works with
+    PostgreSQL. Returns the number of monthly partitions created.
+
+    """
+    conn = db.session.connection()
+
+    if conn.dialect.name != "postgresql":
+        raise ServerError("file events can only be partitioned with PostgreSQL")
+    if _is_partitioned(conn):
+        raise ServerError("the file_event table is already partitioned")
+
+    if now is None:
+        now = datetime.datetime.utcnow()
+
+    first = conn.exec_driver_sql("SELECT MIN(time) FROM file_event").scalar() or now
+
+    try:
+        for stmt in _partition_setup:
+            conn.exec_driver_sql(stmt)
+
+        n = _create_partitions(conn, first, _months_ahead(now))
+
+        for stmt in _partition_finish:
+            conn.exec_driver_sql(stmt)
+
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+
+    return n
+
+
+# Background maintenance
+
+
+def maintain_file_events():
+    """Archive old file events and create upcoming partitions, as configured.
+    This is meant to be run periodically in the background.
+
+    """
+    try:
+        n_partitions = ensure_partitions()
+        n_archived = archive_file_events()
+    except (SQLAlchemyError, ServerError, OSError):
+        db.session.rollback()
+        logger.exception("failed to maintain the file event table")
+        return
+
+    if n_partitions or n_archived:
+        logger.info(
+            "file event maintenance: created %d partitions, archived %d events",
+            n_partitions,
+            n_archived,
+        )
+
+
+def register_maintenance_job():
+    """Periodically maintain the file event table in a worker thread. Only the
+    primary server should do this.
+
+    """
+    from .bgtasks import register_periodic_job
+
+    interval = app.config.get("file_event_maintenance_interval", 86400)
+    return register_periodic_job("file event maintenance", maintain_file_events, interval)
+
+
+# Buffered event writes. Most of the events that we record are audit trail
+# that nothing reads back right away, and under bursts of standing order
+# activity giving each one its own small transaction adds up. If
+# `file_event_buffer_rows` is set, `record_event()` instead holds events in
+# the database session until it commits, and then moves them to an in-memory
+# buffer. The buffer is written out in multi-row INSERTs, every
+# `file_event_buffer_interval` milliseconds or whenever that many are
+# waiting. Events recorded in a transaction, or a savepoint, that's rolled
+# back are dropped along with it. Before the session runs any statement that
+# involves the file_event table, its own events and the buffer are written
+# into its transaction so that it sees all of the events recorded so far.
+#
+# If a batch of events can't be inserted, we insert them one at a time, and
+# log and drop the ones that still fail, so that one bad event can't hold up
+# the rest forever.
+#
+# Buffered events are lost if the server process dies before they're
+# written, so buffering is off by default, in which case `record_event()`
+# just adds the event to the session like any other record. It's also off
+# in processes that haven't called `start_event_buffer()`, such as the Flask
+# development server and scripts, since nothing would write out the buffer.
+# Events that clients create are always written right away, since clients
+# expect them to be there once the API call returns.
+
+_buffer_lock = threading.Lock()
+_buffer = []  # event row dicts
+_buffer_started = False
+
+
+def _buffer_limit():
+    return app.config.get("file_event_buffer_rows", 0)
+
+
+def _current_transaction(session):
+    return session.get_nested_transaction() or session.get_transaction()
+
+
+def record_event(event):
+    """Record the FileEvent `event`. If event buffering is off, or this
+    process hasn't started the buffer, it's added to the database session.
+    Otherwise it's held until the session's transaction is committed, and
+    then added to the buffer, to be written out later. Either way, the caller
+    must commit the session as usual.
+
+    """
+    if _buffer_limit() < 1 or not _buffer_started:
+        db.session.add(event)
+        return
+
+    session = db.session()
+
+    if not session.in_transaction():
+        session.begin()
+
+    transaction = _current_transaction(session)
+    row = dict(name=event.name, time=event.time, type=event.type, payload=event.payload)
+    session.info.setdefault("fileevents_pending", []).append((transaction, row))
+
+
+def _insert_events(conn, rows):
+    """Insert the event row dicts `rows` in the current transaction of `conn`.
+    Returns the rows that were inserted; the others are logged and dropped.
+
+    """
+    from sqlalchemy.exc import DataError, IntegrityError
+
+    from .file import FileEvent
+
+    if not len(rows):
+        return rows
+
+    insert = FileEvent.__table__.insert()
+
+    # On PostgreSQL a failed statement spoils the whole transaction, so each
+    # attempt gets a savepoint. SQLite only undoes the failed statement, but
+    # it inserts a batch one row at a time, so a failed batch can leave some
+    # of its rows behind, and pysqlite commits early if a savepoint is the
+    # first thing in a transaction. So there we go row by row from the start.
+    if conn.dialect.name == "sqlite":
+        savepoint = contextlib.nullcontext
+    else:
+        savepoint = conn.begin_nested
+
+        try:
+            with savepoint():
+                conn.execute(insert, rows)
+            return rows
+        except (DataError, IntegrityError):
+            pass
+
+    saved = []
+
+    for row in rows:
+        try:
+            with savepoint():
+                conn.execute(insert, row)
+        except (DataError, IntegrityError):
+            logger.exception("dropping file event that can't be saved: %r", row)
+        else:
+            saved.append(row)
+
+    return saved
+
+
+def _take_buffer():
+    with _buffer_lock:
+        rows = _buffer[:]
+        del _buffer[:]
+
+    return rows
+
+
+def _requeue(rows):
+    with _buffer_lock:
+        _buffer[:0] = rows
+
+
+def flush_events():
+    """Write the events that the current database session has recorded, and
+    any buffered events, into the session's transaction. If that's rolled
+    back rather than committed, the buffered events go back into the buffer.
+    Returns the number of events written.
+
+    """
+    session = db.session()
+    pending = session.info.pop("fileevents_pending", [])
+    rows = _take_buffer()
+
+    if not len(pending) and not len(rows):
+        return 0
+
+    try:
+        conn = session.connection()
+        saved = _insert_events(conn, [row for _, row in pending])
+        rows = _insert_events(conn, rows)
+    except Exception:
+        session.info.setdefault("fileevents_pending", [])[:0] = pending
+        _requeue(rows)
+        raise
+
+    # Remember which transaction each event went into, and where it came
+    # from (None for the buffer), in case that transaction is rolled back.
+    transaction = _current_transaction(session)
+    saved = {id(row) for row in saved}
+    written = session.info.setdefault("fileevents_written", [])
+    written.extend((transaction, t, row) for t, row in pending if id(row) in saved)
+    written.extend((transaction, None, row) for row in rows)
+    return len(saved) + len(rows)
+
+
+def _write_buffer():
+    """Write out the buffer in a transaction of its own."""
+    rows = _take_buffer()
+
+    if not len(rows):
+        return
+
+    try:
+        with db.engine.begin() as conn:
+            _insert_events(conn, rows)
+    except SQLAlchemyError:
+        _requeue(rows)
+        logger.exception("failed to write buffered file events")
+
+
+def _within(transaction, outer):
+    while transaction is not None:
+        if transaction is outer:
+            return True
+        transaction = transaction.parent
+
+    return False
+
+
+@event.listens_for(db.session, "after_commit")
+def _buffer_committed_events(session):
+    session.info.pop("fileevents_written", None)
+    pending = session.info.pop("fileevents_pending", None)
+
+    if not pending:
+        return
+
+    with _buffer_lock:
+        _buffer.extend(row for _, row in pending)
+        full = len(_buffer) >= _buffer_limit()
+
+    if full:
+        _write_buffer()
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _drop_rolled_back_events(session, previous_transaction):
+    # This also fires for savepoints. Events recorded inside the savepoint
+    # go, but ones that were only written inside it go back to where they
+    # came from.
+    pending = session.info.setdefault("fileevents_pending", [])
+    pending[:] = [(t, row) for t, row in pending if not _within(t, previous_transaction)]
+    written = session.info.get("fileevents_written", [])
+    kept = []
+
+    for entry in written:
+        into, origin, row = entry
+
+        if not _within(into, previous_transaction):
+            kept.append(entry)
+        elif origin is None:
+            _requeue([row])
+        elif not _within(origin, previous_transaction):
+            pending.append((origin, row))
+
+    written[:] = kept
+
+
+@event.listens_for(db.session, "after_transaction_end")
+def _requeue_unsaved_events(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("fileevents_pending", None)
+        written = session.info.pop("fileevents_written", [])
+        _requeue([row for _, origin, row in written if origin is None])
+
+
+@event.listens_for(db.session, "do_orm_execute")
+def _flush_before_reading_events(orm_execute_state):
+    if not len(_buffer) and not orm_execute_state.session.info.get("fileevents_pending"):
+        return
+
+    for element in visitors.iterate(orm_execute_state.statement):
+        if isinstance(element, Table) and element.name == "file_event":
+            flush_events()
+            return
+
+
+def _flush_in_background():
+    with app.app_context():
+        _write_buffer()
+
+
+def start_event_buffer():
+    """If event buffering is on, start writing out the buffer periodically.
+    Events are only buffered in processes that have done this.
+
+    """
+    global _buffer_started
+
+    if _buffer_limit() < 1:
+        return None
+
+    from tornado.ioloop import PeriodicCallback
+
+    atexit.register(_flush_in_background)
+    interval = app.config.get("file_event_buffer_interval", 500)
+    cb = PeriodicCallback(_flush_in_background, interval)
+    cb.start()
+    _buffer_started = True
+    return cb
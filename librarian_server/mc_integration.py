@@ -14,12 +14,15 @@ package.
 
 __all__ = """
 is_file_record_invalid
+find_invalid_file_records
 create_observation_record
 note_file_created
+note_files_created
 note_file_upload_succeeded
 register_callbacks
 """.split()
 
+import threading
 import time
 from astropy.time import Time
 from sqlalchemy.engine.row import Row
@@ -60,30 +63,46 @@ class MCManager:
         # reporting.
 
         self._remote_upload_stats = {}
+        self._remote_upload_stats_lock = threading.Lock()
         self._last_report_time = time.time()
 
-    def error(self, severity, fmt, *args):
+    def error(self, severity, fmt, *args, mc_session=None):
         if len(args):
             text = fmt % args
         else:
             text = str(fmt)
 
+        if mc_session is None:
+            mc_session = self.mc_session
+
         logger.error("M&C-related error (severity %d): %s", severity, text)
 
         try:
-            self.mc_session.add_subsystem_error(Time.now(), "lib", severity, text)
+            mc_session.add_subsystem_error(Time.now(), "lib", severity, text)
         except Exception as e:
             logger.error("could not log error to M&C: %s", e)
 
         try:
-            self.mc_session.commit()
+            mc_session.commit()
         except SQLAlchemyError as e:
-            self.mc_session.rollback()
+            mc_session.rollback()
             logger.error("could not commit error record to M&C: %s (rolled back)", e)
         except Exception as e:
             logger.error("could not commit error record to M&C: %s", e)
 
     def check_in(self):
+        """Report our status to M&C. This is run in a worker thread, so it
+        uses its own M&C session rather than the shared one.
+
+        """
+        mc_session = self.mc_db.sessionmaker()
+
+        try:
+            self._check_in(mc_session)
+        finally:
+            mc_session.close()
+
+    def _check_in(self, mc_session):
         from sqlalchemy import func
 
         from .file import File, FileInstance
@@ -115,7 +134,7 @@ class MCManager:
         num_processes = get_unfinished_task_count()
 
         try:
-            self.mc_session.add_lib_status(
+            mc_session.add_lib_status(
                 astro_now,
                 num_files,
                 data_volume_gb,
@@ -128,15 +147,24 @@ class MCManager:
         except Exception as e:
             # If that failed it seems unlikely that we'll be able to continue,
             # but let's try.
-            self.error(SEVERE, "could not report status to the M&C system: %s", e)
+            self.error(
+                SEVERE, "could not report status to the M&C system: %s", e, mc_session=mc_session
+            )
 
         try:
-            self.mc_session.commit()
+            mc_session.commit()
         except SQLAlchemyError as e:
-            self.mc_session.rollback()
-            self.error(SEVERE, "could not commit status to the M&C system: %s (rolled back)", e)
+            mc_session.rollback()
+            self.error(
+                SEVERE,
+                "could not commit status to the M&C system: %s (rolled back)",
+                e,
+                mc_session=mc_session,
+            )
         except Exception as e:
-            self.error(SEVERE, "could not commit status to the M&C system: %s", e)
+            self.error(
+                SEVERE, "could not commit status to the M&C system: %s", e, mc_session=mc_session
+            )
 
         # Now report information on our remotes. The Librarian *server*
         # doesn't actually directly know about the other connections defined
@@ -162,7 +190,14 @@ class MCManager:
         # corner cases the bandwidth will get wonky, but we also have the
         # direct measurements from the pots to look at.
 
-        for conn_name, file_sizes in self._remote_upload_stats.items():
+        # Uploads are noted on the main thread while we run, so we grab the
+        # current stats and reset them under a lock.
+
+        with self._remote_upload_stats_lock:
+            remote_upload_stats = self._remote_upload_stats
+            self._remote_upload_stats = {conn_name: [] for conn_name in remote_upload_stats}
+
+        for conn_name, file_sizes in remote_upload_stats.items():
             num_file_uploads = len(file_sizes)
             bytes_uploaded = sum(file_sizes)  # this works when the list is empty.
             bandwidth_Mbs = bytes_uploaded * 8 / (1024**2 * (unix_now - self._last_report_time))
@@ -188,16 +223,20 @@ class MCManager:
 
             # OK now we're ready to file our report!
 
-            self.mc_session.add_lib_remote_status(
+            mc_session.add_lib_remote_status(
                 astro_now, conn_name, ping_time, num_file_uploads, bandwidth_Mbs
             )
-            del file_sizes[:]
 
         try:
-            self.mc_session.commit()
+            mc_session.commit()
         except SQLAlchemyError as e:
-            self.mc_session.rollback()
-            self.error(SEVERE, "could not commit ping report to the M&C system: %s", e)
+            mc_session.rollback()
+            self.error(
+                SEVERE,
+                "could not commit ping report to the M&C system: %s",
+                e,
+                mc_session=mc_session,
+            )
 
         self._last_report_time = time.time()
 
@@ -227,6 +266,39 @@ class MCManager:
         )
         return True
 
+    def find_invalid_file_records(self, file_objs):
+        """Batch version of is_file_record_invalid(). We only ask M&C about
+        each distinct obsid once, which matters when registering a night's
+        worth of files at a time. Returns a list of the invalid files.
+
+        """
+        obsid_ok = {}
+        invalid = []
+
+        for file_obj in file_objs:
+            if file_obj.obsid is None:
+                continue  # this is OK, for maintenance files
+
+            if isinstance(file_obj.obsid, Row):
+                obsid = file_obj.obsid._asdict()["obsid"]
+            else:
+                obsid = file_obj.obsid
+
+            ok = obsid_ok.get(obsid)
+            if ok is None:
+                ok = obsid_ok[obsid] = any(True for _ in self.mc_session.get_obs(obsid=obsid))
+
+            if not ok:
+                self.error(
+                    SEVERE,
+                    "rejecting file %s (obsid %d): its obsid is not in M&C's hera_obs table",
+                    file_obj.name,
+                    obsid,
+                )
+                invalid.append(file_obj)
+
+        return invalid
+
     def create_observation_record(self, obsid):
         mc_obses = list(self.mc_session.get_obs(obsid=obsid))
 
@@ -275,9 +347,36 @@ class MCManager:
             self.mc_session.rollback()
             self.error(SEVERE, "could not commit file creation note to the M&C system: %s", e)
 
+    def note_files_created(self, file_objs):
+        """Batch version of note_file_created(), committing to M&C just once."""
+        for file_obj in file_objs:
+            try:
+                self.mc_session.add_lib_file(
+                    file_obj.name,
+                    file_obj.obsid,
+                    file_obj.create_time_astropy,
+                    file_obj.size / 1024**3,
+                )
+            except InvalidRequestError as e:
+                self.error(
+                    SEVERE,
+                    "couldn't register file %s (obsid %s) with M&C: %s",
+                    file_obj.name,
+                    file_obj.obsid,
+                    e,
+                )
+
+        try:
+            self.mc_session.commit()
+        except SQLAlchemyError as e:
+            self.mc_session.rollback()
+            self.error(SEVERE, "could not commit file creation notes to the M&C system: %s", e)
+
     def note_file_upload_succeeded(self, conn_name, file_size):
         self._last_file_upload_time = time.time()
-        self._remote_upload_stats.setdefault(conn_name, []).append(file_size)
+
+        with self._remote_upload_stats_lock:
+            self._remote_upload_stats.setdefault(conn_name, []).append(file_size)
 
 
 the_mc_manager = None
@@ -292,13 +391,12 @@ def register_callbacks(version_string, git_hash):
         # BACKGROUND TASK REPORTING WILL BE INACCURATE!!!!
         return
 
-    from tornado import ioloop
+    # Checking in involves catalog-wide queries and network traffic, so it
+    # runs in a worker thread.
+
+    from .bgtasks import register_periodic_job
 
-    cb = ioloop.PeriodicCallback(
-        the_mc_manager.check_in, 15 * 60 * 1000
-    )  # measured in milliseconds
-    cb.start()
-    return cb
+    return register_periodic_job("M&C check-in", the_mc_manager.check_in, 15 * 60)
 
 
 # Hooks for other subsystems to send info to M&C without having to worry about
@@ -316,6 +414,17 @@ def is_file_record_invalid(file_obj):
     return the_mc_manager.is_file_record_invalid(file_obj)
 
 
+def find_invalid_file_records(file_objs):
+    """Batch version of is_file_record_invalid(): returns a list of the files
+    whose records M&C rejects.
+
+    """
+    if the_mc_manager is None:
+        return []
+
+    return the_mc_manager.find_invalid_file_records(file_objs)
+
+
 def create_observation_record(obsid):
     """If we're M&C-enabled, we copy observation records out of the M&C database.
     Otherwise, signal an error. The only ways to create Observations are to
@@ -334,6 +443,10 @@ def create_observation_record(obsid):
         raise ServerError("expected M&C to know about obsid %s but it didn't", obsid)
 
     db.session.add(rec)
+
+    from .observation import attach_to_session
+
+    attach_to_session(rec)
     return rec
 
 
@@ -343,6 +456,12 @@ def note_file_created(file_obj):
     the_mc_manager.note_file_created(file_obj)
 
 
+def note_files_created(file_objs):
+    if the_mc_manager is None:
+        return
+    the_mc_manager.note_files_created(file_objs)
+
+
 def note_file_upload_succeeded(conn_name, file_size):
     if the_mc_manager is None:
         return
@@ -11,73 +11,136 @@ gather_records
 
 from flask import render_template
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy.orm.exc import NoResultFound
 
 from . import app, db
 from .webutil import ServerError, json_api, login_required
 
 
-def gather_records(file):
+def gather_records(files):
     """Gather up the set of database records that another Librarian will need if
-    we're to upload *file* to it.
+    we're to upload *files* to it.
 
-    Right now this function is fairly simple because the relevant code only
-    works with one file at a time. You could imagine extending this function
-    to take a list of files and gather all of the records at once, which might
-    lead to a little bit less redundancy.
+    *files* is a list of File objects; for convenience, a single File is
+    accepted too. Each observation and observing session is included only
+    once, however many of the files belong to it, so it's much more
+    efficient to gather the records for a batch of files in one call than to
+    do them one at a time.
 
     """
+    from .file import File
+    from .observation import Observation
+
+    if isinstance(files, File):
+        files = [files]
+
     info = {}
-    info["files"] = {file.name: file.to_dict()}
+    info["files"] = {file.name: file.to_dict() for file in files}
+
+    obsids = {file.obsid for file in files if file.obsid is not None}
+    if not len(obsids):
+        return info
 
-    if file.obsid is not None:
-        obs = file.observation
-        info["observations"] = {obs.obsid: obs.to_dict()}
+    observations = {}
+    sessions = {}
+
+    for obs in Observation.query.filter(Observation.obsid.in_(obsids)):
+        observations[obs.obsid] = obs.to_dict()
 
         sess = obs.session
-        if sess is not None:
-            info["sessions"] = {sess.id: sess.to_dict()}
+        if sess is not None and sess.id not in sessions:
+            sessions[sess.id] = sess.to_dict()
+
+    info["observations"] = observations
+    if len(sessions):
+        info["sessions"] = sessions
 
     return info
 
 
+def _merge_all(model, key, objs):
+    """Merge a list of detached records into the database session, as with
+    `db.session.merge()`, but look up the existing records with a single
+    query rather than one query per record.
+
+    Returns a list of the records that are new.
+
+    """
+    if not len(objs):
+        return []
+
+    column = getattr(model, key)
+    keys = [getattr(obj, key) for obj in objs]
+    existing = {getattr(rec, key) for rec in model.query.filter(column.in_(keys))}
+    new_objs = []
+
+    for obj in objs:
+        if getattr(obj, key) in existing:
+            # The record is in the identity map now, so this doesn't need to
+            # go back to the database.
+            db.session.merge(obj)
+        else:
+            db.session.add(obj)
+            new_objs.append(obj)
+
+    return new_objs
+
+
 def create_records(info, sourcename):
     """Create database records for various items that should be synchronized among
     librarians. Various actions, such as file upload, cause records to be
     synchronized from one Librarian to another; this function implements the
     record-receiving end.
 
+    The records usually come in batches, so we try to do as few database
+    round-trips as we can: existing records are looked up with one query per
+    table, and new files are inserted with one flush.
+
     """
     from .file import File
-    from .observation import Observation, ObservingSession
+    from .observation import Observation, ObservingSession, attach_to_session
 
-    for subinfo in info.get("sessions", {}).values():
-        obj = ObservingSession.from_dict(subinfo)
-        db.session.merge(obj)
+    _merge_all(
+        ObservingSession,
+        "id",
+        [ObservingSession.from_dict(subinfo) for subinfo in info.get("sessions", {}).values()],
+    )
+    new_obs = _merge_all(
+        Observation,
+        "obsid",
+        [Observation.from_dict(subinfo) for subinfo in info.get("observations", {}).values()],
+    )
+
+    # Observations that arrive without a session can be assigned to one right
+    # away if we're doing that incrementally.
 
-    for subinfo in info.get("observations", {}).values():
-        obj = Observation.from_dict(subinfo)
-        db.session.merge(obj)
+    for obs in sorted(new_obs, key=lambda o: o.start_time_jd):
+        attach_to_session(obs)
 
     from .mc_integration import is_file_record_invalid, note_file_created
 
-    for subinfo in info.get("files", {}).values():
-        obj = File.from_dict(sourcename, subinfo)
-
-        # Things get slightly more complicated here because if we're linked in
-        # to HERA M&C, we need to check if files are valid, and report when
-        # new File records are created. I don't think `merge()` gives us any
-        # reasonable path to do that, so we need a hand-rolled UPSERT to
-        # figure out what happened. Fortunately the primary key of the File
-        # table is simple, and file records are immutable, so we don't need to
-        # get too tricky. Cf.
-        # https://stackoverflow.com/questions/2546207/
-        #                does-sqlalchemy-have-an-equivalent-of-djangos-get-or-create
-        #
-        # Note, however, that only the Karoo Librarian has M&C integration,
-        # and that's the one Librarian that it is unlikely that anyone is ever
-        # going to upload a file *to*, which is how this code path gets
-        # activated. But let's be thorough.
+    files = [File.from_dict(sourcename, subinfo) for subinfo in info.get("files", {}).values()]
+    names = [f.name for f in files]
+
+    if len(names):
+        existing = {row[0] for row in db.session.query(File.name).filter(File.name.in_(names))}
+    else:
+        existing = set()
+
+    # If we're linked in to HERA M&C, we need to check if files are valid,
+    # and report when new File records are created. File records are
+    # immutable, so we don't need to do anything with the ones that we
+    # already have.
+    #
+    # Note, however, that only the Karoo Librarian has M&C integration,
+    # and that's the one Librarian that it is unlikely that anyone is ever
+    # going to upload a file *to*, which is how this code path gets
+    # activated. But let's be thorough.
+
+    new_files = []
+
+    for obj in files:
+        if obj.name in existing:
+            continue
 
         if is_file_record_invalid(obj):
             raise ServerError(
@@ -86,16 +149,37 @@ def create_records(info, sourcename):
                 obj.obsid,
             )
 
-        try:
-            db.session.query(File).filter_by(name=obj.name).one()
-        except NoResultFound:
+        existing.add(obj.name)  # in case of duplicates
+        new_files.append(obj)
+
+    # Insert the new files in one go. If someone else has created some of the
+    # same records since we looked, the flush will fail; in that case we
+    # fall back to inserting the files one at a time and skipping the ones
+    # that collide, which is what a hand-rolled UPSERT would do. The
+    # savepoints keep the failures from discarding the sessions and
+    # observations merged above.
+
+    try:
+        with db.session.begin_nested():
+            db.session.add_all(new_files)
+    except IntegrityError:
+        created = []
+
+        for obj in new_files:
+            obj = File.from_dict(sourcename, obj.to_dict())
+
             try:
-                db.session.add(obj)
-                db.session.flush()
+                with db.session.begin_nested():
+                    db.session.add(obj)
             except IntegrityError:
-                db.session.rollback()
+                pass
             else:
-                note_file_created(obj)
+                created.append(obj)
+
+        new_files = created
+
+    for obj in new_files:
+        note_file_created(obj)
 
     try:
         db.session.commit()
@@ -0,0 +1,136 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the BSD License.
+
+"""Indexing of file names for substring searches.
+
+Most file searches use `name-matches` with a pattern that starts with a
+wildcard, like `%12345%.uv`. An ordinary B-tree index on the name can't help
+with those, so without something else every such search is a full scan of
+the file table. We maintain a trigram index of the names instead:
+
+- On PostgreSQL, this is a GIN index using the `pg_trgm` extension. The
+  query planner uses it for LIKE patterns automatically, so searches don't
+  need to do anything special.
+- On SQLite, this is an FTS5 virtual table with the `trigram` tokenizer,
+  kept up to date by triggers on the file table. The FTS5 table is only
+  consulted if it's queried directly, so `name_matches()` rewrites the
+  search clause to go through it. FTS5 can only look up its rows quickly by
+  rowid, so a second table gives each name a key, which the triggers use as
+  the rowid of its entry. The key is an INTEGER PRIMARY KEY, so unlike the
+  file table's own rowids, VACUUM and dumps leave it alone.
+
+Either way, only patterns that contain a run of at least three literal
+characters benefit, since anything shorter doesn't yield a trigram.
+
+The index is created by an Alembic migration for existing databases, and
+along with the file table when the tables are created from scratch.
+
+"""
+
+
+__all__ = str(
+    """
+TRIGRAM_TABLE
+name_matches
+trigram_index_available
+"""
+).split()
+
+import re
+from sqlalchemy import DDL, column, event, inspect, select, table
+
+from . import db
+from .file import File
+
+TRIGRAM_TABLE = "file_name_trigram"
+_KEY_TABLE = TRIGRAM_TABLE + "_key"
+
+# Keep synchronized with the corresponding Alembic migration.
+
+_sqlite_create = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TRIGRAM_TABLE} USING fts5(name, tokenize='trigram')",
+    f"CREATE TABLE IF NOT EXISTS {_KEY_TABLE} (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGRAM_TABLE}_insert AFTER INSERT ON file BEGIN
+        INSERT INTO {_KEY_TABLE} (name) VALUES (new.name);
+        INSERT INTO {TRIGRAM_TABLE} (rowid, name)
+            SELECT id, name FROM {_KEY_TABLE} WHERE name = new.name;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGRAM_TABLE}_delete AFTER DELETE ON file BEGIN
+        DELETE FROM {TRIGRAM_TABLE}
+            WHERE rowid = (SELECT id FROM {_KEY_TABLE} WHERE name = old.name);
+        DELETE FROM {_KEY_TABLE} WHERE name = old.name;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGRAM_TABLE}_rename AFTER UPDATE OF name ON file BEGIN
+        UPDATE {TRIGRAM_TABLE} SET name = new.name
+            WHERE rowid = (SELECT id FROM {_KEY_TABLE} WHERE name = old.name);
+        UPDATE {_KEY_TABLE} SET name = new.name WHERE name = old.name;
+    END""",
+]
+
+_postgresql_create = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS file_name_trgm ON file USING gin (name gin_trgm_ops)",
+]
+
+_trigram_table = table(TRIGRAM_TABLE, column("name"))
+_literal_run = re.compile(r"[^%_]{3,}")
+_available = {}  # engine => bool
+
+
+def _sqlite_has_trigrams(ddl, target, bind, **kw):
+    # The trigram tokenizer was added in SQLite 3.34.
+    return bind.dialect.name == "sqlite" and bind.dialect.dbapi.sqlite_version_info >= (3, 34)
+
+
+for _stmt in _sqlite_create:
+    event.listen(
+        File.__table__, "after_create", DDL(_stmt).execute_if(callable_=_sqlite_has_trigrams)
+    )
+
+for _stmt in _postgresql_create:
+    event.listen(File.__table__, "after_create", DDL(_stmt).execute_if(dialect="postgresql"))
+
+for _name in TRIGRAM_TABLE, _KEY_TABLE:
+    event.listen(
+        File.__table__,
+        "after_drop",
+        DDL(f"DROP TABLE IF EXISTS {_name}").execute_if(dialect="sqlite"),
+    )
+
+
+@event.listens_for(File.__table__, "after_create")
+@event.listens_for(File.__table__, "after_drop")
+def _forget_availability(target, connection, **kw):
+    _available.pop(connection.engine, None)
+
+
+def trigram_index_available():
+    """Find out whether `name_matches()` needs to, and can, route searches
+    through the SQLite trigram table. The answer is always False for other
+    databases.
+
+    """
+    engine = db.engine
+    available = _available.get(engine)
+
+    if available is None:
+        available = engine.dialect.name == "sqlite" and inspect(engine).has_table(TRIGRAM_TABLE)
+        _available[engine] = available
+
+    return available
+
+
+def name_matches(pattern):
+    """Get a clause matching files whose names are LIKE `pattern`, using the
+    trigram index if it can help.
+
+    """
+    clause = File.name.like(pattern)
+
+    if _literal_run.search(pattern) is None or not trigram_index_available():
+        return clause
+
+    # FTS5 folds case a bit more aggressively than SQLite's LIKE, so we keep
+    # the original test to check the candidates that the index gives us.
+    candidates = select(_trigram_table.c.name).where(_trigram_table.c.name.like(pattern))
+    return File.name.in_(candidates) & clause
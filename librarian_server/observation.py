@@ -11,6 +11,7 @@ Observation
 """
 ).split()
 
+import datetime
 import sys
 from flask import flash, redirect, render_template, url_for
 from sqlalchemy.exc import SQLAlchemyError
@@ -40,6 +41,12 @@ class ObservingSession(db.Model):
 
     ObservingSessions should not overlap.
 
+    When sessions are assigned incrementally (see `attach_to_session`), a
+    session is "open" until `open_until`: new observations that follow on
+    from its last one are added to it. The session closes once it goes
+    quiet for long enough. Sessions created by the batch
+    `assign_observing_sessions` call are never open.
+
     """
 
     __tablename__ = "observing_session"
@@ -47,8 +54,18 @@ class ObservingSession(db.Model):
     id = db.Column(db.BigInteger, primary_key=True)
     start_time_jd = NotNull(db.Float(precision="53"))
     stop_time_jd = NotNull(db.Float(precision="53"))
+    open_until = db.Column(db.DateTime, nullable=True)
     observations = db.relationship("Observation", back_populates="session")
 
+    # Rollups maintained by the `rollups` module: the number of Observations
+    # in this session, the number of Files associated with them and their
+    # total size in bytes, and how many of those Files have at least one
+    # FileInstance.
+    num_obs = NotNull(db.Integer, default=0)
+    num_files = NotNull(db.Integer, default=0)
+    total_size = NotNull(db.BigInteger, default=0)
+    num_files_with_instances = NotNull(db.Integer, default=0)
+
     def __init__(self, id, start_time_jd, stop_time_jd):
         self.id = id
         self.start_time_jd = start_time_jd
@@ -63,6 +80,11 @@ class ObservingSession(db.Model):
                 % (self.start_time_jd, self.stop_time_jd)
             )
 
+    @property
+    def is_open(self):
+        "Whether new observations can still be added to the end of this session."
+        return self.open_until is not None and self.open_until > datetime.datetime.utcnow()
+
     @property
     def start_time_calendar_date(self):
         "The session start time in YYYY-MM-DD format."
@@ -83,55 +105,6 @@ class ObservingSession(db.Model):
         "The duration of the session in days."
         return self.stop_time_jd - self.start_time_jd
 
-    @property
-    def num_obs(self):
-        "The number of Observations associated with this session."
-        from sqlalchemy import func
-
-        return (
-            db.session.query(func.count(Observation.obsid))
-            .filter(Observation.session_id == self.id)
-            .scalar()
-        )
-
-    @property
-    def num_files(self):
-        "The number of Files associated with this session."
-        from sqlalchemy import func
-
-        from .file import File
-
-        my_obsids = db.session.query(Observation.obsid).filter(Observation.session_id == self.id)
-        return db.session.query(func.count(File.name)).filter(File.obsid.in_(my_obsids)).scalar()
-
-    @property
-    def num_files_with_instances(self):
-        """The number of Files associated with this session for which we have at least
-        one FileInstance.
-
-        """
-        from sqlalchemy import distinct, func
-
-        from .file import File, FileInstance
-
-        my_obsids = db.session.query(Observation.obsid).filter(Observation.session_id == self.id)
-        my_filenames = db.session.query(File.name).filter(File.obsid.in_(my_obsids))
-        return (
-            db.session.query(func.count(distinct(FileInstance.name)))
-            .filter(FileInstance.name.in_(my_filenames))
-            .scalar()
-        )
-
-    @property
-    def total_size(self):
-        "The total size (in bytes) of all Files associated with this session."
-        from sqlalchemy import func
-
-        from .file import File
-
-        my_obsids = db.session.query(Observation.obsid).filter(Observation.session_id == self.id)
-        return db.session.query(func.sum(File.size)).filter(File.obsid.in_(my_obsids)).scalar()
-
     def to_dict(self):
         return dict(id=self.id, start_time_jd=self.start_time_jd, stop_time_jd=self.stop_time_jd)
 
@@ -161,6 +134,13 @@ class Observation(db.Model):
     session_id = db.Column(db.BigInteger, db.ForeignKey(ObservingSession.id), nullable=True)
     session = db.relationship("ObservingSession", back_populates="observations")
     files = db.relationship("File", back_populates="observation")
+    session_index = db.Index("observation_session", session_id, start_time_jd)
+    start_time_index = db.Index("observation_start_time", start_time_jd)
+
+    # Rollups maintained by the `rollups` module, as for ObservingSession.
+    num_files = NotNull(db.Integer, default=0)
+    total_size = NotNull(db.BigInteger, default=0)
+    num_files_with_instances = NotNull(db.Integer, default=0)
 
     def __init__(self, obsid, start_time_jd, stop_time_jd, start_lst_hr):
         self.obsid = obsid
@@ -184,15 +164,6 @@ class Observation(db.Model):
             return float("NaN")
         return self.stop_time_jd - self.start_time_jd
 
-    @property
-    def total_size(self):
-        "The total size (in bytes) of all Files associated with this observation."
-        from sqlalchemy import func
-
-        from .file import File
-
-        return db.session.query(func.sum(File.size)).filter(File.obsid == self.obsid).scalar()
-
     def to_dict(self):
         return dict(
             obsid=self.obsid,
@@ -215,6 +186,139 @@ class Observation(db.Model):
         return obj
 
 
+# Session detection. `SESSION_GAP_TOLERANCE` is the size of time gap that we
+# allow before declaring that a new session has started, in units of the
+# time gap between the first two observations of the session. The allowed gap
+# is clamped to be between 1 minute and 0.5 day.
+
+SESSION_GAP_TOLERANCE = 20
+MIN_SESSION_GAP = 1.0 / 1440  # days
+MAX_SESSION_GAP = 0.5  # days
+
+
+def _allowed_session_gap(first_djd, gap_tol=SESSION_GAP_TOLERANCE):
+    """The largest allowed gap between observations in a session whose first two
+    observations started `first_djd` days apart.
+
+    """
+    return min(max(first_djd * gap_tol, MIN_SESSION_GAP), MAX_SESSION_GAP)
+
+
+def _segment_sessions(start_jds, gap_tol=SESSION_GAP_TOLERANCE):
+    """Split a sorted array of observation start times into sessions.
+
+    Returns a list of `(i0, i1)` tuples giving the slice of the array
+    belonging to each session.
+
+    The allowed gap depends on the start of each session, so we can't find
+    all of the boundaries in one vectorized operation. But gaps longer than
+    `MAX_SESSION_GAP` always end a session, so we first split the data at
+    those, and then search for the remaining boundaries one night at a time.
+    This keeps the work roughly linear in the number of observations.
+
+    """
+    import numpy as np
+
+    start_jds = np.asarray(start_jds, dtype=float)
+    n = len(start_jds)
+    djds = np.diff(start_jds)
+    hard_breaks = np.flatnonzero(djds >= MAX_SESSION_GAP) + 1
+    bounds = [0] + hard_breaks.tolist() + [n]
+    segments = []
+
+    for s0, s1 in zip(bounds[:-1], bounds[1:]):
+        i0 = s0
+
+        while i0 < s1:
+            if i0 == s1 - 1:
+                # This is worrisome, but all we can do is trust that this is
+                # legitimately a session that lasted only a single observation.
+                i1 = s1
+            else:
+                gap = _allowed_session_gap(djds[i0], gap_tol)
+                breaks = np.flatnonzero(djds[i0 + 1 : s1 - 1] >= gap)
+                i1 = s1 if not len(breaks) else i0 + 2 + int(breaks[0])
+
+            segments.append((i0, i1))
+            i0 = i1
+
+    return segments
+
+
+def attach_to_session(obs):
+    """Assign a new Observation to an ObservingSession as soon as it is created,
+    if incremental session assignment is enabled with the
+    "session_assignment_mode" configuration item.
+
+    We use the same gap-tolerance rule as `assign_observing_sessions`. The
+    Observation joins the latest session that started before it if it falls
+    within that session, or if that session is still open and the
+    Observation follows on from its last one closely enough. Otherwise it
+    starts a new open session. Each addition keeps the session open for
+    another "session_quiet_period" seconds.
+
+    This assumes that observations arrive roughly in time order, as they do
+    from M&C. Observations without stop times can't be placed and are left
+    for `assign_observing_sessions`.
+
+    Returns the session, or None if the Observation was not assigned. The
+    caller is responsible for committing the changes.
+
+    """
+    if app.config.get("session_assignment_mode", "batch") != "incremental":
+        return None
+    if obs.session_id is not None or obs.stop_time_jd is None:
+        return None
+
+    from sqlalchemy import func
+
+    quiet_period = datetime.timedelta(seconds=app.config.get("session_quiet_period", 7200))
+    open_until = datetime.datetime.utcnow() + quiet_period
+
+    sess = (
+        ObservingSession.query.filter(ObservingSession.start_time_jd <= obs.start_time_jd)
+        .order_by(ObservingSession.start_time_jd.desc())
+        .first()
+    )
+
+    if sess is not None and obs.start_time_jd > sess.stop_time_jd:
+        if not sess.is_open:
+            sess = None
+        else:
+            first_starts = [
+                row[0]
+                for row in db.session.query(Observation.start_time_jd)
+                .filter(Observation.session_id == sess.id)
+                .order_by(Observation.start_time_jd.asc())
+                .limit(2)
+            ]
+            last_start = (
+                db.session.query(func.max(Observation.start_time_jd))
+                .filter(Observation.session_id == sess.id)
+                .scalar()
+            )
+
+            if len(first_starts) < 2:
+                gap = MAX_SESSION_GAP
+            else:
+                gap = _allowed_session_gap(first_starts[1] - first_starts[0])
+
+            if last_start is None or obs.start_time_jd - last_start >= gap:
+                sess = None
+
+    if sess is None:
+        sess = ObservingSession(obs.obsid, obs.start_time_jd, obs.stop_time_jd)
+        sess.open_until = open_until
+        db.session.add(sess)
+    else:
+        if sess.is_open:
+            sess.open_until = open_until
+        sess.stop_time_jd = max(sess.stop_time_jd, obs.stop_time_jd)
+
+    obs.session_id = sess.id
+    return sess
+
+
 # RPC endpoints
 
 
@@ -241,118 +345,139 @@ def assign_observing_sessions(args, sourcename=None):
     """
     minimum_start_jd = optional_arg(args, float, "minimum_start_jd")
     maximum_start_jd = optional_arg(args, float, "maximum_start_jd")
+    new_sess_info = assign_sessions(minimum_start_jd, maximum_start_jd)
+    return {"new_sessions": new_sess_info}
 
-    new_sess_info = []
-    retval = {"new_sessions": new_sess_info}
 
-    # Build a list of all prior sessions so we can see if any Observations
-    # must be assigned to preexisting sessions.
+def assign_sessions(minimum_start_jd=None, maximum_start_jd=None):
+    """Assign unassigned Observations to ObservingSessions, creating new
+    sessions as needed. This is the implementation of the
+    `assign_observing_sessions` API call; it returns a list of dicts
+    describing the new sessions.
 
-    existing_sessions = list(ObservingSession.query.all())
+    Everything is done with arrays and bulk statements, so that this stays
+    fast when there are many years' worth of observations to process.
 
-    # For all Observations without a session, either assign them to a
-    # preexisting one (if they fall inside), or save them for followup.
+    """
+    import numpy as np
+    from sqlalchemy import bindparam, update
+
+    new_sess_info = []
+
+    # Gather up the Observations without a session, ordered by start time.
+    # There can be lots of them, so we just work with arrays of their key
+    # properties rather than ORM objects.
 
-    examine_obs = []
-    query = Observation.query.filter(Observation.session_id is None)
+    query = db.session.query(
+        Observation.obsid, Observation.start_time_jd, Observation.stop_time_jd
+    ).filter(Observation.session_id.is_(None))
     if minimum_start_jd is not None:
         query = query.filter(Observation.start_time_jd >= minimum_start_jd)
     if maximum_start_jd is not None:
         query = query.filter(Observation.start_time_jd <= maximum_start_jd)
 
-    for obs in query.order_by(Observation.start_time_jd.asc()):
-        # TODO: we've got some N^2 scaling here; we could do a better job.
-        for sess in existing_sessions:
-            if (
-                obs.start_time_jd >= sess.start_time_jd
-                and obs.start_time_jd <= sess.stop_time_jd
-                and (obs.stop_time_jd is None or (obs.stop_time_jd <= sess.stop_time_jd))
-            ):
-                obs.session_id = sess.id
-                break
-        else:
-            # This branch is triggered if the 'break' clause is not called,
-            # i.e., this obs does not overlap an existing session.
-            examine_obs.append(obs)
+    rows = query.order_by(Observation.start_time_jd.asc()).all()
+    if not len(rows):
+        return new_sess_info
 
-    try:
-        db.session.commit()  # if there are any obs matching existing sessions
-    except SQLAlchemyError:
-        db.session.rollback()
-        app.log_exception(sys.exc_info())
-        raise ServerError("failed to commit obs changes to database; see logs for details")
+    obsids = np.array([r[0] for r in rows], dtype=np.int64)
+    start_jds = np.array([r[1] for r in rows], dtype=float)
+    stop_jds = np.array([np.nan if r[2] is None else r[2] for r in rows], dtype=float)
+
+    # Assign Observations to preexisting sessions if they fall inside them.
+    # Usually the only session that might contain a given Observation is the
+    # last one that starts before it does, but sessions can overlap, so for
+    # the Observations that don't fit in that one we look further back, as
+    # far as there are earlier sessions that haven't ended before it starts.
 
-    if not len(examine_obs):
-        return retval
+    sessions = (
+        db.session.query(
+            ObservingSession.id, ObservingSession.start_time_jd, ObservingSession.stop_time_jd
+        )
+        .order_by(ObservingSession.start_time_jd.asc())
+        .all()
+    )
+    session_ids = np.zeros(len(rows), dtype=np.int64)
+    matched = np.zeros(len(rows), dtype=bool)
+
+    if len(sessions):
+        sess_ids = np.array([s[0] for s in sessions], dtype=np.int64)
+        sess_starts = np.array([s[1] for s in sessions], dtype=float)
+        sess_stops = np.array([s[2] for s in sessions], dtype=float)
+
+        idx = np.searchsorted(sess_starts, start_jds, side="right") - 1
+        safe_idx = np.maximum(idx, 0)
+        matched = (
+            (idx >= 0)
+            & (start_jds <= sess_stops[safe_idx])
+            & (np.isnan(stop_jds) | (stop_jds <= sess_stops[safe_idx]))
+        )
+        session_ids[matched] = sess_ids[safe_idx[matched]]
 
-    # Now, create new sessions for the unassigned observations. From our SQL
-    # query, examine_obs is ordered by start_time_jd. `gap_tol` is the size of
-    # time gap that we allow before declaring that a new session has started,
-    # in units of the smallest time gap between observations under
-    # consideration.
+        latest_stops = np.maximum.accumulate(sess_stops)
 
-    import numpy as np
+        for i in np.flatnonzero(~matched & (idx > 0)):
+            j = idx[i] - 1
 
-    gap_tol = 20
-    start_jds = np.array([o.start_time_jd for o in examine_obs])
-    djds = np.diff(start_jds)
-    i0 = 0
-    n = len(examine_obs)
-
-    while len(examine_obs[i0:]):
-        if i0 == n - 1:
-            # This is worrisome, but all we can do is trust that this is
-            # legitimately a session that lasted only a single observation.
-            i1 = i0 + 1
-        else:
-            # Set the allowed time gap, clamping to be between 1 minute and 0.5 day.
-            gap = djds[i0] * gap_tol
-            gap = np.clip(gap, 1.0 / 1440, 0.5)
-
-            # i1 is used in Python slicing to mark the end of this session. We
-            # know that we have at least two Observations, so we can set it past
-            # i0.
-            i1 = i0 + 1
-            while i1 < n and start_jds[i1] - start_jds[i1 - 1] < gap:
-                i1 += 1
-
-        # OK, we now have a bunch of observations that we've decided are in
-        # the same session. We can create an ObservingSession and assign them.
-
-        sess_obs = examine_obs[i0:i1]
-        start = sess_obs[0].start_time_jd
-        if sess_obs[-1].stop_time_jd is None:
+            while j >= 0 and latest_stops[j] >= start_jds[i]:
+                if start_jds[i] <= sess_stops[j] and (
+                    np.isnan(stop_jds[i]) or stop_jds[i] <= sess_stops[j]
+                ):
+                    matched[i] = True
+                    session_ids[i] = sess_ids[j]
+                    break
+
+                j -= 1
+
+    # Now, create new sessions for the unassigned observations. They're
+    # still ordered by start time.
+
+    examine = np.flatnonzero(~matched)
+
+    for i0, i1 in _segment_sessions(start_jds[examine]):
+        sess_obs = examine[i0:i1]
+        first, last = sess_obs[0], sess_obs[-1]
+
+        if np.isnan(stop_jds[last]):
             raise ServerError(
-                "new observations must have recorded stop times (ID %s)", sess_obs[0].obsid
+                "new observations must have recorded stop times (ID %s)", obsids[first]
             )
-        stop = sess_obs[-1].stop_time_jd
-        sess = ObservingSession(sess_obs[0].obsid, start, stop)
-        db.session.add(sess)
-
-        try:
-            db.session.commit()
-        except SQLAlchemyError:
-            db.session.rollback()
-            app.log_exception(sys.exc_info())
-            raise ServerError("failed to commit obs changes to database (2); see logs for details")
 
+        sess = ObservingSession(int(obsids[first]), float(start_jds[first]), float(stop_jds[last]))
+        db.session.add(sess)
+        session_ids[sess_obs] = sess.id
         new_sess_info.append(
-            dict(id=sess.id, start_time_jd=start, stop_time_jd=stop, n_obs=len(sess_obs))
+            dict(
+                id=sess.id,
+                start_time_jd=sess.start_time_jd,
+                stop_time_jd=sess.stop_time_jd,
+                n_obs=len(sess_obs),
+            )
         )
 
-        for obs in sess_obs:
-            obs.session_id = sess.id
+    # Write everything out in one transaction. The session_id updates are
+    # done with a single executemany UPDATE, which bypasses the ORM, so we
+    # bring the session rollups up to date ourselves.
 
-        i0 = i1
+    from .rollups import recompute_sessions
+
+    obs = Observation.__table__
+    set_session = update(obs).where(obs.c.obsid == bindparam("o")).values(session_id=bindparam("s"))
 
     try:
+        db.session.flush()
+        db.session.connection().execute(
+            set_session,
+            [{"o": int(obsid), "s": int(sessid)} for obsid, sessid in zip(obsids, session_ids)],
+        )
+        recompute_sessions(db.session.connection(), set(session_ids.tolist()))
         db.session.commit()
     except SQLAlchemyError:
         db.session.rollback()
         app.log_exception(sys.exc_info())
-        raise ServerError("failed to commit obs changes to database (3); see logs for details")
+        raise ServerError("failed to commit obs changes to database; see logs for details")
 
-    return retval
+    return new_sess_info
 
 
 @app.route("/api/describe_session_without_event", methods=["GET", "POST"])
@@ -401,7 +526,7 @@ def describe_session_without_event(args, sourcename=None):
         .filter(FileEvent.type == event_type, File.name == FileEvent.name)
     )
     files_of_interest = File.query.join(Observation).filter(
-        Observation.session_id is not None,
+        Observation.session_id.isnot(None),
         File.source == source,
         File.name.notin_(already_done_file_names),
     )
@@ -0,0 +1,346 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the BSD License.
+
+"""Materialized rollups of file, observation, and session aggregates.
+
+The web UI and the search engine want to know things like how many files an
+observing session contains, or how many instances a file has. Computing these
+with aggregate queries for every row that we display gets slow, so we keep
+them in columns of the main tables:
+
+- file: num_instances
+- observation: num_files, total_size, num_files_with_instances
+- observing_session: num_obs, num_files, total_size, num_files_with_instances
+
+The columns are updated with relative increments, in the same transaction as
+the changes that affect them. Changes made through the ORM are picked up by a
+flush hook. Code that inserts or updates records with bulk statements
+bypasses that hook, so it must call the `apply_*` or `recompute_*` functions
+itself.
+
+As a safety net, `reconcile()` recomputes everything from scratch and fixes
+any drift. The primary server runs it periodically.
+
+"""
+
+
+__all__ = str(
+    """
+apply_file_changes
+apply_instance_changes
+apply_session_moves
+recompute_files
+recompute_observations
+recompute_sessions
+reconcile
+register_reconcile_job
+"""
+).split()
+
+from collections import Counter, defaultdict
+from sqlalchemy import bindparam, event, func, or_, select, update
+from sqlalchemy.orm import attributes
+
+from . import app, db, logger
+from .dbutil import in_chunks
+
+
+def _tables():
+    from .file import File, FileInstance
+    from .observation import Observation, ObservingSession
+
+    return (
+        File.__table__,
+        FileInstance.__table__,
+        Observation.__table__,
+        ObservingSession.__table__,
+    )
+
+
+def _bump_observations_and_sessions(conn, rows, **columns):
+    """Add deltas to observation rollup columns and those of the sessions that
+    contain them. `rows` are dicts giving the obsid as "o" and the deltas
+    keyed by the parameter names given as the values of `columns`.
+
+    """
+    if not len(rows):
+        return
+
+    _, _, obs, sess = _tables()
+
+    conn.execute(
+        update(obs)
+        .where(obs.c.obsid == bindparam("o"))
+        .values({obs.c[col]: obs.c[col] + bindparam(param) for col, param in columns.items()}),
+        rows,
+    )
+
+    session_of_obs = select(obs.c.session_id).where(obs.c.obsid == bindparam("o"))
+    conn.execute(
+        update(sess)
+        .where(sess.c.id == session_of_obs.scalar_subquery())
+        .values({sess.c[col]: sess.c[col] + bindparam(param) for col, param in columns.items()}),
+        rows,
+    )
+
+
+def apply_file_changes(conn, added=(), removed=()):
+    """Update the rollups for new and deleted Files. `added` and `removed` are
+    iterables of `(obsid, size)` tuples.
+
+    New files never have instances, and files can't be deleted while they
+    still do, so the instance coverage doesn't change here.
+
+    """
+    deltas = defaultdict(lambda: [0, 0])
+
+    for sign, items in ((1, added), (-1, removed)):
+        for obsid, size in items:
+            if obsid is not None:
+                deltas[obsid][0] += sign
+                deltas[obsid][1] += sign * size
+
+    rows = [{"o": obsid, "dn": dn, "ds": ds} for obsid, (dn, ds) in deltas.items() if dn or ds]
+    _bump_observations_and_sessions(conn, rows, num_files="dn", total_size="ds")
+
+
+def apply_instance_changes(conn, deltas):
+    """Update the rollups for new and deleted FileInstances. `deltas` maps
+    file names to the net change in their number of instances.
+
+    """
+    deltas = {name: d for name, d in deltas.items() if d}
+    if not len(deltas):
+        return
+
+    file, _, _, _ = _tables()
+
+    conn.execute(
+        update(file)
+        .where(file.c.name == bindparam("n"))
+        .values(num_instances=file.c.num_instances + bindparam("d")),
+        [{"n": name, "d": d} for name, d in deltas.items()],
+    )
+
+    # Files whose instance count went to or from zero change the coverage of
+    # their observations. The rows that we just updated are locked until we
+    # commit, so the values that we read back are the ones we wrote.
+
+    coverage = Counter()
+
+    for chunk in in_chunks(deltas.keys()):
+        q = select(file.c.name, file.c.obsid, file.c.num_instances).where(file.c.name.in_(chunk))
+
+        for name, obsid, n_after in conn.execute(q):
+            n_before = n_after - deltas[name]
+
+            if obsid is None:
+                continue
+            if n_before <= 0 < n_after:
+                coverage[obsid] += 1
+            elif n_after <= 0 < n_before:
+                coverage[obsid] -= 1
+
+    rows = [{"o": obsid, "dc": dc} for obsid, dc in coverage.items() if dc]
+    _bump_observations_and_sessions(conn, rows, num_files_with_instances="dc")
+
+
+def apply_session_moves(conn, moves):
+    """Update the session rollups for Observations that have been added to,
+    removed from, or moved between sessions. `moves` is an iterable of
+    `(obsid, old_session_id, new_session_id)` tuples, where either session ID
+    may be None.
+
+    This must be called before any file changes in the same transaction are
+    applied, since it moves the observations' current rollups wholesale.
+
+    """
+    moves = [m for m in moves if m[1] != m[2]]
+    if not len(moves):
+        return
+
+    _, _, obs, sess = _tables()
+    obs_rollups = {}
+
+    for chunk in in_chunks({m[0] for m in moves}):
+        q = select(
+            obs.c.obsid, obs.c.num_files, obs.c.total_size, obs.c.num_files_with_instances
+        ).where(obs.c.obsid.in_(chunk))
+
+        for obsid, n_files, size, n_covered in conn.execute(q):
+            obs_rollups[obsid] = (n_files, size, n_covered)
+
+    deltas = defaultdict(lambda: [0, 0, 0, 0])
+
+    for obsid, old_sessid, new_sessid in moves:
+        n_files, size, n_covered = obs_rollups.get(obsid, (0, 0, 0))
+
+        for sessid, sign in ((old_sessid, -1), (new_sessid, 1)):
+            if sessid is not None:
+                d = deltas[sessid]
+                d[0] += sign
+                d[1] += sign * n_files
+                d[2] += sign * size
+                d[3] += sign * n_covered
+
+    conn.execute(
+        update(sess)
+        .where(sess.c.id == bindparam("s"))
+        .values(
+            num_obs=sess.c.num_obs + bindparam("dobs"),
+            num_files=sess.c.num_files + bindparam("dn"),
+            total_size=sess.c.total_size + bindparam("ds"),
+            num_files_with_instances=sess.c.num_files_with_instances + bindparam("dc"),
+        ),
+        [
+            {"s": sessid, "dobs": d[0], "dn": d[1], "ds": d[2], "dc": d[3]}
+            for sessid, d in deltas.items()
+        ],
+    )
+
+
+@event.listens_for(db.session, "after_flush")
+def _apply_flushed_changes(session, flush_context):
+    from .file import File, FileInstance
+    from .observation import Observation
+
+    moves = []
+    files_added = []
+    files_removed = []
+    instance_deltas = Counter()
+
+    for obj in session.new:
+        if isinstance(obj, FileInstance):
+            instance_deltas[obj.name] += 1
+        elif isinstance(obj, File):
+            files_added.append((obj.obsid, obj.size))
+        elif isinstance(obj, Observation) and obj.session_id is not None:
+            moves.append((obj.obsid, None, obj.session_id))
+
+    for obj in session.deleted:
+        if isinstance(obj, FileInstance):
+            instance_deltas[obj.name] -= 1
+        elif isinstance(obj, File):
+            files_removed.append((obj.obsid, obj.size))
+        elif isinstance(obj, Observation) and obj.session_id is not None:
+            moves.append((obj.obsid, obj.session_id, None))
+
+    for obj in session.dirty:
+        if isinstance(obj, Observation):
+            hist = attributes.get_history(obj, "session_id")
+
+            if hist.has_changes():
+                old = hist.deleted[0] if hist.deleted else None
+                new = hist.added[0] if hist.added else None
+                moves.append((obj.obsid, old, new))
+
+    if not (len(moves) or len(files_added) or len(files_removed) or len(instance_deltas)):
+        return
+
+    conn = session.connection()
+    apply_session_moves(conn, moves)
+    apply_file_changes(conn, files_added, files_removed)
+    apply_instance_changes(conn, instance_deltas)
+
+
+# Recomputing the rollups from scratch. Each of these functions only touches
+# rows whose rollups have actually drifted, and returns the number of them.
+# The tiers depend on each other, so files should be recomputed before
+# observations, and observations before sessions.
+
+
+def _recompute(conn, table, key_column, values, keys):
+    drift = or_(*[table.c[col] != value for col, value in values.items()])
+    stmt = update(table).values(values)
+
+    if keys is None:
+        return conn.execute(stmt.where(drift)).rowcount
+
+    n = 0
+
+    for chunk in in_chunks(keys):
+        n += conn.execute(stmt.where(key_column.in_(chunk), drift)).rowcount
+
+    return n
+
+
+def recompute_files(conn, names=None):
+    """Recompute the rollups of the named Files, or all of them if `names` is
+    None.
+
+    """
+    file, inst, _, _ = _tables()
+    values = {
+        "num_instances": select(func.count()).where(inst.c.name == file.c.name).scalar_subquery()
+    }
+    return _recompute(conn, file, file.c.name, values, names)
+
+
+def recompute_observations(conn, obsids=None):
+    """Recompute the rollups of the specified Observations, or all of them if
+    `obsids` is None.
+
+    """
+    file, _, obs, _ = _tables()
+    mine = file.c.obsid == obs.c.obsid
+    values = {
+        "num_files": select(func.count()).where(mine).scalar_subquery(),
+        "total_size": select(func.coalesce(func.sum(file.c.size), 0)).where(mine).scalar_subquery(),
+        "num_files_with_instances": select(func.count())
+        .where(mine, file.c.num_instances > 0)
+        .scalar_subquery(),
+    }
+    return _recompute(conn, obs, obs.c.obsid, values, obsids)
+
+
+def recompute_sessions(conn, ids=None):
+    """Recompute the rollups of the specified ObservingSessions, or all of them
+    if `ids` is None. This uses the observation rollups, so it's cheap.
+
+    """
+    _, _, obs, sess = _tables()
+    mine = obs.c.session_id == sess.c.id
+    values = {"num_obs": select(func.count()).where(mine).scalar_subquery()}
+
+    for col in ("num_files", "total_size", "num_files_with_instances"):
+        values[col] = select(func.coalesce(func.sum(obs.c[col]), 0)).where(mine).scalar_subquery()
+
+    return _recompute(conn, sess, sess.c.id, values, ids)
+
+
+def reconcile():
+    """Recompute all of the rollups, fixing any that have drifted. This scans
+    the whole catalog, so it's meant to be run occasionally in the background.
+
+    """
+    from sqlalchemy.exc import SQLAlchemyError
+
+    try:
+        conn = db.session.connection()
+        n_files = recompute_files(conn)
+        n_obs = recompute_observations(conn)
+        n_sess = recompute_sessions(conn)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        logger.exception("failed to reconcile rollups")
+        return
+
+    if n_files or n_obs or n_sess:
+        logger.warn(
+            "reconciled drifted rollups: %d files, %d observations, %d sessions",
+            n_files,
+            n_obs,
+            n_sess,
+        )
+
+
+def register_reconcile_job():
+    """Periodically reconcile the rollups in a worker thread. Only the primary
+    server should do this.
+
+    """
+    from .bgtasks import register_periodic_job
+
+    interval = app.config.get("rollup_reconcile_interval", 86400)
+    return register_periodic_job("rollup reconciliation", reconcile, interval)
@@ -14,6 +14,7 @@ compile_search
 StandingOrder
 queue_standing_order_copies
 register_standing_order_checkin
+start_standing_order_manager
 """
 ).split()
 
@@ -22,13 +23,14 @@ import json
 import logging
 import os.path
 import sys
+import threading
 import time
 from flask import Response, flash, redirect, render_template, request, url_for
 from sqlalchemy.exc import SQLAlchemyError
 
 from . import app, bgtasks, db, is_primary_server, logger
 from .dbutil import NotNull
-from .webutil import ServerError, json_api, login_required, optional_arg, required_arg
+from .webutil import ServerError, encode_json, json_api, login_required, optional_arg, required_arg
 
 # The search parser. We save searches in a (hopefully) simple JSON format. The
 # format is documented in `docs/Searching.md`. KEEP THE DOCS UPDATED!
@@ -43,12 +45,156 @@ class _AttributeTypes:
 AttributeTypes = _AttributeTypes()
 
 
+# Searches are compiled in two steps. First, each clause is turned into a node
+# of a small intermediate representation (IR). Leaf clauses, such as
+# attribute comparisons, produce SQL expressions directly, and we just wrap
+# them up. Then the IR tree is simplified, and finally turned into SQL. The
+# simplification:
+#
+# - flattens nested ANDs and nested ORs;
+# - folds away constants, e.g. from "always-true" and "always-false";
+# - merges predicates on a related table that sit under the same AND or OR,
+#   so that, say, several observation clauses in a file search become a
+#   single subquery on the observation table rather than one apiece.
+#
+# All of these rewrites respect SQL's three-valued logic, with one wrinkle.
+# For a row that isn't related to anything, such as a file with a NULL obsid,
+# "obsid IN (a) AND obsid IN (b)" is NULL if neither subquery is empty, but
+# "obsid IN (a AND b)" is FALSE if no observation satisfies both. A WHERE
+# clause treats the two alike, and so does anything built from it with AND
+# and OR, but NOT doesn't. So we only merge under AND where an even number
+# of NOTs separate us from the WHERE clause.
+
+
+class _Const:
+    """A constant truth value."""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class _Leaf:
+    """An opaque SQL expression."""
+
+    def __init__(self, expr):
+        self.expr = expr
+
+
+class _BoolOp:
+    """A logical AND or OR of the `children`; `op` is "and" or "or"."""
+
+    def __init__(self, op, children):
+        self.op = op
+        self.children = children
+
+
+class _Not:
+    def __init__(self, child):
+        self.child = child
+
+
+class _Proxy:
+    """A condition on a related table, given by the IR tree `child`, which
+    `wrap` turns into a condition on our own table. Proxies with the same
+    `wrap` can be combined under AND and OR, which is only correct if each
+    of our rows is related to at most one row of the other table.
+
+    """
+
+    def __init__(self, wrap, child):
+        self.wrap = wrap
+        self.child = child
+
+
+_ir_nodes = (_Const, _Leaf, _BoolOp, _Not, _Proxy)
+
+
+def _simplify(node, positive=True):
+    """Simplify the IR tree `node`, returning a new tree. `positive` says
+    whether `node` sits under an even number of NOTs.
+
+    """
+    if isinstance(node, _Not):
+        child = _simplify(node.child, not positive)
+
+        if isinstance(child, _Const):
+            return _Const(not child.value)
+        if isinstance(child, _Not):
+            return child.child
+        return _Not(child)
+
+    if isinstance(node, _Proxy):
+        # The child ends up in the WHERE clause of a subquery.
+        return _Proxy(node.wrap, _simplify(node.child))
+
+    if not isinstance(node, _BoolOp):
+        return node
+
+    # TRUE absorbs an OR, and FALSE an AND; the opposite value is the identity.
+    absorbing = node.op == "or"
+    mergeable = positive or node.op == "or"
+    flat = []
+
+    for child in (_simplify(c, positive) for c in node.children):
+        if isinstance(child, _BoolOp) and child.op == node.op:
+            flat += child.children
+        else:
+            flat.append(child)
+
+    children = []
+    proxies = {}
+
+    for child in flat:
+        if isinstance(child, _Const):
+            if child.value == absorbing:
+                return child
+        elif isinstance(child, _Proxy) and mergeable:
+            if child.wrap in proxies:
+                proxies[child.wrap].append(child.child)
+            else:
+                proxies[child.wrap] = [child.child]
+                children.append(child)
+        else:
+            children.append(child)
+
+    for i, child in enumerate(children):
+        if isinstance(child, _Proxy) and len(proxies.get(child.wrap, ())) > 1:
+            merged = _simplify(_BoolOp(node.op, proxies[child.wrap]))
+            children[i] = _Proxy(child.wrap, merged)
+
+    if not len(children):
+        return _Const(not absorbing)
+    if len(children) == 1:
+        return children[0]
+    return _BoolOp(node.op, children)
+
+
+def _emit(node):
+    """Turn the IR tree `node` into an SQL expression."""
+    from sqlalchemy import and_, false, not_, or_, true
+
+    if isinstance(node, _Const):
+        return true() if node.value else false()
+    if isinstance(node, _Leaf):
+        return node.expr
+    if isinstance(node, _Not):
+        return not_(_emit(node.child))
+    if isinstance(node, _Proxy):
+        return node.wrap(_emit(node.child))
+
+    combine = and_ if node.op == "and" else or_
+    return combine(*[_emit(c) for c in node.children])
+
+
 class GenericSearchCompiler:
     """A simple singleton class that helps with compiling searches. The only state
     that we manage is the list of search clauses, which can be extended
     dynamically to support different types of attributes that searchable
     things possess.
 
+    Clause implementations return either an SQL expression or a node of the
+    IR described above.
+
     """
 
     def __init__(self):
@@ -60,15 +206,23 @@ class GenericSearchCompiler:
             "always-false": self._do_always_false,
         }
 
-    def compile(self, search):
+        # Clauses whose meaning depends on the current time. Searches that
+        # use them can't be cached; see searchcache.cached_clause().
+        self.volatile_clauses = set()
+
+    def compile(self, search, optimize=True):
         """Compile a search that is specified as a JSON-like data structure.
 
         The `search` must be a dict, which is interpreted as a set of clauses
-        that are ANDed logically.
+        that are ANDed logically. If `optimize` is false, the search is turned
+        into SQL exactly as written, which is useful for comparisons.
 
         """
         if isinstance(search, dict):
-            return self._compile_clause("and", search)
+            ir = self._compile_clause("and", search)
+            if optimize:
+                ir = _simplify(ir)
+            return _emit(ir)
 
         raise ServerError(
             "can't parse search: data must " "be in dict format; got %s", search.__class__.__name__
@@ -78,7 +232,11 @@ class GenericSearchCompiler:
         impl = self.clauses.get(name)
         if impl is None:
             raise ServerError("can't parse search: unrecognized clause %r" % name)
-        return impl(name, payload)
+
+        result = impl(name, payload)
+        if not isinstance(result, _ir_nodes):
+            result = _Leaf(result)
+        return result
 
     # Framework for doing searches on general attributes of database items.
 
@@ -244,9 +402,7 @@ class GenericSearchCompiler:
                 clause_name,
                 payload.__class__.__name__,
             )
-        from sqlalchemy import and_
-
-        return and_(*[self._compile_clause(*t) for t in payload.items()])
+        return _BoolOp("and", [self._compile_clause(*t) for t in payload.items()])
 
     def _do_or(self, clause_name, payload):
         if not isinstance(payload, dict) or not len(payload):
@@ -255,9 +411,7 @@ class GenericSearchCompiler:
                 clause_name,
                 payload.__class__.__name__,
             )
-        from sqlalchemy import or_
-
-        return or_(*[self._compile_clause(*t) for t in payload.items()])
+        return _BoolOp("or", [self._compile_clause(*t) for t in payload.items()])
 
     def _do_none_of(self, clause_name, payload):
         if not isinstance(payload, dict) or not len(payload):
@@ -266,21 +420,15 @@ class GenericSearchCompiler:
                 clause_name,
                 payload.__class__.__name__,
             )
-        from sqlalchemy import not_, or_
-
-        return not_(or_(*[self._compile_clause(*t) for t in payload.items()]))
+        return _Not(_BoolOp("or", [self._compile_clause(*t) for t in payload.items()]))
 
     def _do_always_true(self, clause_name, payload):
         """We just ignore the payload."""
-        from sqlalchemy import literal
-
-        return literal(True)
+        return _Const(True)
 
     def _do_always_false(self, clause_name, payload):
         """We just ignore the payload."""
-        from sqlalchemy import literal
-
-        return literal(False)
+        return _Const(False)
 
 
 # Searches for observing sessions
@@ -304,32 +452,6 @@ def _session_get_duration():
     return ObservingSession.stop_time_jd - ObservingSession.start_time_jd
 
 
-def _session_get_num_obs():
-    from sqlalchemy import func
-
-    from .observation import Observation, ObservingSession
-
-    return (
-        db.session.query(func.count(Observation.obsid))
-        .filter(Observation.session_id == ObservingSession.id)
-        .as_scalar()
-    )
-
-
-def _session_get_num_files():
-    from sqlalchemy import func
-
-    from .file import File
-    from .observation import Observation, ObservingSession
-
-    return (
-        db.session.query(func.count(File.name))
-        .filter(File.obsid == Observation.obsid)
-        .filter(Observation.session_id == ObservingSession.id)
-        .as_scalar()
-    )
-
-
 def _session_get_age():
     from astropy.time import Time
 
@@ -343,8 +465,8 @@ simple_session_attrs = [
     ("start_time_jd", AttributeTypes.float, None),
     ("stop_time_jd", AttributeTypes.float, None),
     ("duration", AttributeTypes.float, _session_get_duration),
-    ("num_obs", AttributeTypes.int, _session_get_num_obs),
-    ("num_files", AttributeTypes.int, _session_get_num_files),
+    ("num_obs", AttributeTypes.int, None),
+    ("num_files", AttributeTypes.int, None),
     ("age", AttributeTypes.float, _session_get_age),
 ]
 
@@ -355,6 +477,7 @@ class ObservingSessionSearchCompiler(GenericSearchCompiler):
 
         super().__init__()
         self._add_attributes(ObservingSession, simple_session_attrs)
+        self.volatile_clauses.update(n for n in self.clauses if n.startswith("age-"))
 
         self.clauses["no-file-has-event"] = self._do_no_file_has_event
 
@@ -402,26 +525,6 @@ def _obs_get_duration():
     return Observation.stop_time_jd - Observation.start_time_jd
 
 
-def _obs_get_num_files():
-    from sqlalchemy import func
-
-    from .file import File
-    from .observation import Observation
-
-    return (
-        db.session.query(func.count(File.name)).filter(File.obsid == Observation.obsid).as_scalar()
-    )
-
-
-def _obs_get_total_size():
-    from sqlalchemy import func
-
-    from .file import File
-    from .observation import Observation
-
-    return db.session.query(func.sum(File.size)).filter(File.obsid == Observation.obsid).as_scalar()
-
-
 simple_obs_attrs = [
     ("obsid", AttributeTypes.int, None),
     ("start_time_jd", AttributeTypes.float, None),
@@ -429,8 +532,8 @@ simple_obs_attrs = [
     ("start_lst_hr", AttributeTypes.float, None),
     ("session_id", AttributeTypes.int, None),
     ("duration", AttributeTypes.float, _obs_get_duration),
-    ("num_files", AttributeTypes.int, _obs_get_num_files),
-    ("total_size", AttributeTypes.int, _obs_get_total_size),
+    ("num_files", AttributeTypes.int, None),
+    ("total_size", AttributeTypes.int, None),
 ]
 
 
@@ -448,21 +551,13 @@ the_obs_search_compiler = ObservationSearchCompiler()
 # Searches for files
 
 
-def _file_get_num_instances():
-    from sqlalchemy import func
-
-    from .file import File, FileInstance
-
-    return db.session.query(func.count()).filter(FileInstance.name == File.name).as_scalar()
-
-
 simple_file_attrs = [
     ("name", AttributeTypes.string, None),
     ("type", AttributeTypes.string, None),
     ("source", AttributeTypes.string, None),
     ("size", AttributeTypes.int, None),
     ("obsid", AttributeTypes.int, None),
-    ("num-instances", AttributeTypes.int, _file_get_num_instances),
+    ("num_instances", AttributeTypes.int, None),
 ]
 
 
@@ -474,6 +569,7 @@ class FileSearchCompiler(GenericSearchCompiler):
         self._add_attributes(File, simple_file_attrs)
         self.clauses["obs-matches"] = self._do_obs_matches
 
+        self.clauses["name-matches"] = self._do_name_matches
         self.clauses["name-like"] = self.clauses["name-matches"]  # compat alias
         self.clauses["source-is"] = self.clauses["source-is-exactly"]  # compat alias
 
@@ -490,12 +586,26 @@ class FileSearchCompiler(GenericSearchCompiler):
         # I named these in a very ... weird way.
         self.clauses["not-older-than"] = self._do_not_older_than
         self.clauses["not-newer-than"] = self._do_not_newer_than
+        self.volatile_clauses.update(["not-older-than", "not-newer-than"])
+
+    def _do_name_matches(self, clause_name, payload):
+        """Name patterns can use the trigram index; see the `nameindex` module."""
+        if not isinstance(payload, str):
+            raise ServerError(
+                'can\'t parse "%s" clause: contents must be text, ' "but got %s",
+                clause_name,
+                payload.__class__.__name__,
+            )
+
+        from .nameindex import name_matches
+
+        return name_matches(payload)
 
     def _do_obsid_is_null(self, clause_name, payload):
         """We just ignore the payload."""
         from .file import File
 
-        return File.obsid is None
+        return File.obsid.is_(None)
 
     def _do_not_older_than(self, clause_name, payload):
         if not isinstance(payload, (int, float)):
@@ -523,23 +633,28 @@ class FileSearchCompiler(GenericSearchCompiler):
         cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=payload)
         return File.create_time < cutoff
 
-    def _do_obs_matches(self, clause_name, payload):
+    @staticmethod
+    def _obs_proxy(condition):
+        from sqlalchemy import select
+
         from .file import File
         from .observation import Observation
 
-        matched_obsids = db.session.query(Observation.obsid).filter(
-            the_obs_search_compiler.compile(payload)
-        )
-        return File.obsid.in_(matched_obsids)
+        return File.obsid.in_(select(Observation.obsid).where(condition))
 
-    def _do_obs_sub_query(self, clause_name, payload):
-        from .file import File
-        from .observation import Observation
+    def _do_obs_matches(self, clause_name, payload):
+        if not isinstance(payload, dict):
+            raise ServerError(
+                "can't parse search: data must " "be in dict format; got %s",
+                payload.__class__.__name__,
+            )
+
+        return _Proxy(self._obs_proxy, the_obs_search_compiler._compile_clause("and", payload))
 
-        matched_obsids = db.session.query(Observation.obsid).filter(
-            the_obs_search_compiler._compile_clause(clause_name, payload)
+    def _do_obs_sub_query(self, clause_name, payload):
+        return _Proxy(
+            self._obs_proxy, the_obs_search_compiler._compile_clause(clause_name, payload)
         )
-        return File.obsid.in_(matched_obsids)
 
 
 the_file_search_compiler = FileSearchCompiler()
@@ -549,38 +664,32 @@ def compile_search(search_string, query_type="files"):
     """This function returns a query on the File table that will return the File
     items matching the search.
 
+    The compiled search clauses are cached, so compiling the same search
+    again is cheap; see `searchcache.cached_clause`.
+
     """
+    from sqlalchemy.orm import joinedload
+
     from .file import File, FileInstance
     from .observation import Observation, ObservingSession
+    from .searchcache import cached_clause, normalize_search
     from .store import Store
 
-    # As a convenience, we strip out #-delimited comments from the input text.
-    # The default JSON parser doesn't accept them, but they're nice for users.
-
-    def filter_comments():
-        for line in search_string.splitlines():
-            yield line.split("#", 1)[0]
+    search, key = normalize_search(search_string)
 
-    search_string = "\n".join(filter_comments())
-
-    # Parse JSON.
-
-    try:
-        search = json.loads(search_string)
-    except Exception as e:
-        app.log_exception(sys.exc_info())
-        raise ServerError("can't parse search as JSON: %s", e)
+    def compiled(compiler):
+        return cached_clause(compiler, search, key)
 
     # Offload to the helper classes.
 
     if query_type == "files":
-        return File.query.filter(the_file_search_compiler.compile(search))
+        return File.query.filter(compiled(the_file_search_compiler))
     elif query_type == "names":
-        return db.session.query(File.name).filter(the_file_search_compiler.compile(search))
+        return db.session.query(File.name).filter(compiled(the_file_search_compiler))
     elif query_type == "obs":
-        return Observation.query.filter(the_obs_search_compiler.compile(search))
+        return Observation.query.filter(compiled(the_obs_search_compiler))
     elif query_type == "sessions":
-        return ObservingSession.query.filter(the_session_search_compiler.compile(search))
+        return ObservingSession.query.filter(compiled(the_session_search_compiler))
     elif query_type == "instances-stores":
         # The following syntax gives us a LEFT OUTER JOIN which is what we want to
         # get (at most) one instance for each File of interest.
@@ -588,13 +697,17 @@ def compile_search(search_string, query_type="files"):
             db.session.query(FileInstance, File, Store)
             .join(Store)
             .join(File, isouter=True)
-            .filter(the_file_search_compiler.compile(search))
+            .filter(compiled(the_file_search_compiler))
         )
     elif query_type == "instances":
+        # Instance listings need the name and path prefix of each instance's
+        # store, so load the stores in the same query rather than lazily,
+        # one by one.
         return (
             db.session.query(FileInstance)
             .join(File, isouter=True)
-            .filter(the_file_search_compiler.compile(search))
+            .options(joinedload(FileInstance.store_object, innerjoin=True))
+            .filter(compiled(the_file_search_compiler))
         )
     else:
         raise ServerError("unhandled query_type %r", query_type)
@@ -608,9 +721,10 @@ stord_logger = logging.getLogger("librarian.standingorders")
 class StandingOrder(db.Model):
     """A StandingOrder describes a rule for copying data from this Librarian to
     another. We save a search and a destination. When new files match that
-    search, we automatically start copying them to the destination. We create
-    a FileEvent with a name based on the name of the StandingOrder to mark
-    when a file has successfully been copied.
+    search, we automatically start copying them to the destination. We keep
+    track of which files have been copied in StandingOrderProgress records,
+    and also create a FileEvent with a name based on the name of the
+    StandingOrder as an audit trail.
 
     It is assumed that the relevant search has some time limit applied so that
     only files created in the last (e.g.) 7 days match.
@@ -638,83 +752,254 @@ class StandingOrder(db.Model):
     def event_type(self):
         return "standing_order_succeeded:" + self.name
 
-    def get_files_to_copy(self):
+    def _get_progress(self, file_name):
+        progress = StandingOrderProgress.query.get((self.id, file_name))
+
+        if progress is None:
+            progress = StandingOrderProgress(self.id, file_name)
+            db.session.add(progress)
+
+        return progress
+
+    def note_copy_launched(self, file_name):
+        """Record that a copy of the named file has been queued.
+
+        The caller is responsible for committing the database session.
+
+        """
+        progress = self._get_progress(file_name)
+        progress.state = "launched"
+        progress.next_attempt = None
+        progress.updated = datetime.datetime.utcnow()
+        return progress
+
+    def note_copy_failed(self, file_name, error_message):
+        """Record that a copy of the named file failed, so that we back off
+        before trying it again. Once the order has failed too many times for
+        the file, it's marked as "dead" and won't be retried unless somebody
+        requeues it manually.
+
+        The caller is responsible for committing the database session.
+
+        """
+        now = datetime.datetime.utcnow()
+        progress = self._get_progress(file_name)
+        progress.attempts += 1
+        progress.last_error = error_message
+        progress.updated = now
+
+        max_attempts = app.config.get(
+            "standing_order_max_attempts", DEFAULT_STANDING_ORDER_MAX_ATTEMPTS
+        )
+
+        if progress.attempts >= max_attempts:
+            progress.state = "dead"
+            progress.next_attempt = None
+            stord_logger.warn(
+                "standing order %s: giving up on %s after %d failed attempts",
+                self.name,
+                file_name,
+                progress.attempts,
+            )
+        else:
+            progress.state = "retrying"
+            progress.next_attempt = now + datetime.timedelta(
+                seconds=standing_order_retry_delay(progress.attempts)
+            )
+
+        return progress
+
+    def note_copy_succeeded(self, file_name):
+        """Record that the named file has been successfully copied.
+
+        The caller is responsible for committing the database session.
+
+        """
+        progress = self._get_progress(file_name)
+        progress.state = "succeeded"
+        progress.next_attempt = None
+        progress.last_error = None
+        progress.updated = datetime.datetime.utcnow()
+        return progress
+
+    def get_failed_copies(self):
+        """Get the StandingOrderProgress records of files whose copies have
+        failed, including the dead ones.
+
+        """
+        return (
+            StandingOrderProgress.query.filter(
+                StandingOrderProgress.order_id == self.id,
+                StandingOrderProgress.state.in_(FAILED_PROGRESS_STATES),
+            )
+            .order_by(StandingOrderProgress.state.asc(), StandingOrderProgress.updated.desc())
+            .all()
+        )
+
+    def get_files_to_copy(self, only_files=None):
         """Generate a list of files that ought to be copied, according to the
         specifications of this StandingOrder.
 
+        If `only_files` is not None, it is a list of file names, and only
+        those files are considered. This is how we evaluate orders against
+        newly-ingested files without re-searching the whole catalog.
+
         """
-        from .file import File, FileEvent
+        from .file import File
 
         # The core query is something freeform specified by the user.
 
         query = compile_search(self.search)
 
-        # We then layer on a check that the files don't have the specified
-        # marker event.
+        if only_files is not None:
+            query = query.filter(File.name.in_(only_files))
 
-        already_done = db.session.query(File.name).filter(
-            FileEvent.name == File.name, FileEvent.type == self.event_type
-        )
-        query = query.filter(~File.name.in_(already_done))
-
-        # Finally we filter out files that already have copy tasks associated
-        # with this standing order, exceping those tasks that encountered an
-        # error.
-
-        from .bgtasks import the_task_manager
-        from .store import UploaderTask
-
-        already_launched = {
-            os.path.basename(t.store_path)
-            for t in the_task_manager.tasks
-            if (
-                isinstance(t, UploaderTask)
-                and self.name == t.standing_order_name
-                and t.exception is None
+        # We then layer on an anti-join against this order's progress
+        # records, leaving out files that have already been copied, that have
+        # a copy in flight, or whose copies have failed recently or too many
+        # times. A "launched" record that's been around for too long means
+        # that the copy job vanished without reporting back, so we try again.
+
+        from sqlalchemy import and_, exists, or_
+
+        now = datetime.datetime.utcnow()
+        launch_timeout = datetime.timedelta(
+            seconds=app.config.get(
+                "standing_order_launch_timeout", DEFAULT_STANDING_ORDER_LAUNCH_TIMEOUT
             )
-        }
+        )
+
+        held_back = exists().where(
+            StandingOrderProgress.order_id == self.id,
+            StandingOrderProgress.file_name == File.name,
+            or_(
+                StandingOrderProgress.state.in_(("succeeded", "dead")),
+                and_(
+                    StandingOrderProgress.state == "retrying",
+                    StandingOrderProgress.next_attempt > now,
+                ),
+                and_(
+                    StandingOrderProgress.state == "launched",
+                    StandingOrderProgress.updated > now - launch_timeout,
+                ),
+            ),
+        )
+        query = query.filter(~held_back)
 
         for file in query:
-            if file.name not in already_launched:
-                yield file
+            yield file
 
-    def maybe_launch_copies(self):
+    def maybe_launch_copies(self, only_files=None):
         """Launch any file copy operations that need to happen according to this
-        StandingOrder's specification.
+        StandingOrder's specification. `only_files` is as in
+        `get_files_to_copy`.
 
         """
-        from .store import launch_copy_by_file_name
+        from .store import launch_copies_by_file_names
 
         stord_logger.debug("evaluating standing order %s", self.name)
 
-        for file in self.get_files_to_copy():
-            stord_logger.debug("got a hit: %s", file.name)
-            if launch_copy_by_file_name(
-                file.name, self.conn_name, standing_order_name=self.name, no_instance="return"
-            ):
-                stord_logger.warn(
-                    "standing order %s should copy file %s to %s, but no instances "
-                    "of it are available",
-                    self.name,
-                    file.name,
-                    self.conn_name,
-                )
+        names = [file.name for file in self.get_files_to_copy(only_files=only_files)]
+        if not len(names):
+            return
+
+        stord_logger.debug("got %d hits", len(names))
+
+        # The hits are uploaded in batches; see the "upload_batch_size"
+        # configuration item.
+        for name in launch_copies_by_file_names(
+            names, self.conn_name, standing_order_name=self.name, priority=bgtasks.TaskPriority.BULK
+        ):
+            stord_logger.warn(
+                "standing order %s should copy file %s to %s, but no instances "
+                "of it are available",
+                self.name,
+                name,
+                self.conn_name,
+            )
+
+
+DEFAULT_STANDING_ORDER_RETRY_BASE = 1200  # seconds
+DEFAULT_STANDING_ORDER_RETRY_MAX_DELAY = 86400  # seconds
+DEFAULT_STANDING_ORDER_MAX_ATTEMPTS = 8
+DEFAULT_STANDING_ORDER_LAUNCH_TIMEOUT = 86400  # seconds
+FAILED_PROGRESS_STATES = ("retrying", "dead")
+
+
+def standing_order_retry_delay(attempts):
+    """Get the number of seconds to wait before retrying a standing-order copy
+    that has failed `attempts` times. The delay doubles with every failure, up
+    to a maximum.
+
+    """
+    base = app.config.get("standing_order_retry_base", DEFAULT_STANDING_ORDER_RETRY_BASE)
+    max_delay = app.config.get(
+        "standing_order_retry_max_delay", DEFAULT_STANDING_ORDER_RETRY_MAX_DELAY
+    )
+    return min(base * 2 ** (attempts - 1), max_delay)
+
+
+class StandingOrderProgress(db.Model):
+    """The progress of a StandingOrder in copying one particular file.
+
+    The state is "launched" while a copy is queued or in flight, and
+    "succeeded" once it's done. Files whose copies have failed are
+    "retrying" if we'll try again after `next_attempt`, or "dead" if we've
+    given up on them. Failed files can be requeued from the standing order
+    web interface.
+
+    This table replaces the old practice of searching for
+    "standing_order_succeeded:" FileEvents, which are still created as an
+    audit trail but aren't used for anything.
+
+    """
+
+    __tablename__ = "standing_order_progress"
+
+    order_id = db.Column(db.Integer, db.ForeignKey(StandingOrder.id), primary_key=True)
+    file_name = db.Column(db.String(256), db.ForeignKey("file.name"), primary_key=True)
+    state = NotNull(db.String(16))
+    attempts = NotNull(db.Integer)
+    next_attempt = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    updated = NotNull(db.DateTime)
+
+    state_index = db.Index("standing_order_progress_state", order_id, state)
+    file_name_index = db.Index("standing_order_progress_file_name", file_name)
+
+    def __init__(self, order_id, file_name):
+        self.order_id = order_id
+        self.file_name = file_name
+        self.state = "retrying"
+        self.attempts = 0
+        self.updated = datetime.datetime.utcnow()
 
 
 # A simple little manager for running standing orders. We have a timeout to
 # not evaluate them that often ... in the current setup, evaluating certain
 # orders can be quite hard on the database.
+#
+# Most of the time we don't need to run a full evaluation, though. Whenever a
+# new FileInstance is committed, we evaluate the orders against just the
+# files that have gained instances. The full "sweep" is a safety net that runs
+# on a much slower timer.
 
 MIN_STANDING_ORDER_INTERVAL = 1200  # seconds
 DEFAULT_STANDING_ORDER_DELAY = 90  # seconds
+DEFAULT_STANDING_ORDER_SWEEP_INTERVAL = 21600  # seconds
+NEW_FILE_STANDING_ORDER_DELAY = 5  # seconds
+NEW_FILE_BATCH_SIZE = 500
 
 
 def _launch_copy_timeout():
     stord_logger.debug("timeout invoked")
 
-    if the_standing_order_manager.maybe_launch_copies():
-        # The checks actually ran.
+    if time.time() - the_standing_order_manager.last_check >= MIN_STANDING_ORDER_INTERVAL:
+        # Run the checks in a worker thread. If a sweep is already running,
+        # this is a no-op, which is fine, since it'll catch anything that
+        # prompted this one.
         the_standing_order_manager.launch_queued = False
+        the_standing_order_manager.sweep_job.trigger()
     else:
         # We didn't run the checks because we did so recently. If a new file
         # was uploaded we want to make sure that it's eventually checked, so
@@ -725,6 +1010,33 @@ def _launch_copy_timeout():
         IOLoop.current().call_later(DEFAULT_STANDING_ORDER_DELAY, _launch_copy_timeout)
 
 
+def _standing_orders_allowed(now):
+    """Check if there are any restrictions on what we do with standing orders.
+    TODO: it's been requested that we also add time constraints on the
+    uploads (Github issue #23).
+
+    """
+    mode = app.config.get("standing_order_mode", "normal")
+
+    if mode == "disabled":
+        stord_logger.debug("not checking standing orders: explicitly disabled")
+        return False
+    elif mode == "nighttime":
+        # Hack: qmaster is now on UTC = SAST - 2, so our definition of
+        # "night" is a bit different than you might expect. Our intent is
+        # 8pm-8am (actual) local time.
+        hour = time.localtime(now).tm_hour
+        if hour >= 6 and hour < 18:
+            stord_logger.debug(
+                'not checking standing orders: "nighttime" ' "mode and hour = %d", hour
+            )
+            return False
+    elif mode != "normal":
+        stord_logger.warn('unrecognized standing_order_mode %r; treating as "normal"', mode)
+
+    return True
+
+
 class StandingOrderManager:
     """A simple, singleton class for managing our standing orders.
 
@@ -738,49 +1050,46 @@ class StandingOrderManager:
     probably a bunch of them ready to go, not just the very first one that was
     uploaded.
 
+    New files don't need that, though: the manager is told about every
+    committed FileInstance via `note_new_instances`, and evaluates the orders
+    against just those files after a short delay. Unlike full sweeps, this
+    happens in every server process, since any of them might have ingested
+    the files; the copies themselves go through the shared job queue.
+
+    Both kinds of evaluation run in worker threads (see
+    `bgtasks.PeriodicJob`) so that they don't hold up the IOLoop.
+
     """
 
     last_check = 0
     launch_queued = False
+    ioloop = None
+    sweep_job = None
+    new_files_job = None
+    new_files = None
+    new_files_queued = False
+
+    def __init__(self):
+        self.new_files = set()
+        self._lock = threading.Lock()
 
     def maybe_launch_copies(self):
-        """Returns True unless nothing happened because we've run a search recently."""
+        """Sweep through all of the standing orders, evaluating their searches
+        against the whole catalog. This is run in the `sweep_job` worker
+        thread.
+
+        """
         now = time.time()
+        self.last_check = now
 
-        if now - self.last_check < MIN_STANDING_ORDER_INTERVAL:
-            return False  # Don't evaluate too often
-
-        # Check if there are any restrictions on what we do with standing
-        # orders. TODO: it's been requested that we also add time constraints
-        # on the uploads (Github issue #23).
-
-        mode = app.config.get("standing_order_mode", "normal")
-
-        if mode == "disabled":
-            stord_logger.debug("not checking standing orders: explicitly disabled")
-            return True
-        elif mode == "nighttime":
-            # Hack: qmaster is now on UTC = SAST - 2, so our definition of
-            # "night" is a bit different than you might expect. Our intent is
-            # 8pm-8am (actual) local time.
-            hour = time.localtime(now).tm_hour
-            if hour >= 6 and hour < 18:
-                stord_logger.debug(
-                    'not checking standing orders: "nighttime" ' "mode and hour = %d", hour
-                )
-                return True
-        elif mode != "normal":
-            stord_logger.warn('unrecognized standing_order_mode %r; treating as "normal"', mode)
-            mode = "normal"
+        if not _standing_orders_allowed(now):
+            return
 
         stord_logger.debug("running searches")
-        self.last_check = now
 
         for storder in StandingOrder.query.all():
             storder.maybe_launch_copies()
 
-        return True
-
     def queue_launch_copy(self):
         """Queue a main-thread callback to check whether we need to launch any copies
         associated with our standing orders.
@@ -796,6 +1105,80 @@ class StandingOrderManager:
         stord_logger.debug("timeout actually scheduled")
         IOLoop.current().call_later(DEFAULT_STANDING_ORDER_DELAY, _launch_copy_timeout)
 
+    def note_new_instances(self, names):
+        """Called after commits that create FileInstances. We can't touch the
+        database here, so we just remember the names and schedule an
+        evaluation. Commits can happen in worker threads, so this has to be
+        thread-safe.
+
+        If the manager hasn't been started, as in non-Tornado servers, we
+        can't do anything with the information, so we drop it.
+
+        """
+        if self.ioloop is None:
+            return
+
+        with self._lock:
+            self.new_files.update(names)
+
+            if self.new_files_queued:
+                return
+
+            self.new_files_queued = True
+
+        self.ioloop.add_callback(
+            self.ioloop.call_later, NEW_FILE_STANDING_ORDER_DELAY, self.new_files_job.trigger
+        )
+
+    def launch_copies_for_new_files(self):
+        """Evaluate all of the standing orders against the files that we've
+        recently been told about. This is run in the `new_files_job` worker
+        thread.
+
+        If standing orders are disabled right now, the files are dropped;
+        the next full sweep will pick them up if appropriate.
+
+        """
+        with self._lock:
+            names = sorted(self.new_files)
+            self.new_files = set()
+            self.new_files_queued = False
+
+        if not len(names) or not _standing_orders_allowed(time.time()):
+            return
+
+        stord_logger.debug("evaluating standing orders against %d new files", len(names))
+
+        for storder in StandingOrder.query.all():
+            for i in range(0, len(names), NEW_FILE_BATCH_SIZE):
+                try:
+                    storder.maybe_launch_copies(only_files=names[i : i + NEW_FILE_BATCH_SIZE])
+                except Exception as e:
+                    db.session.rollback()
+                    stord_logger.warn(
+                        "failed to evaluate standing order %s for new files: %s", storder.name, e
+                    )
+                    break
+
+    def start(self):
+        """Set up our worker-thread jobs and begin listening for new file
+        instances.
+
+        """
+        from tornado.ioloop import IOLoop
+
+        from .dbutil import watch_new_objects
+        from .file import FileInstance
+
+        self.ioloop = IOLoop.current()
+        self.sweep_job = bgtasks.register_periodic_job(
+            "standing-order sweep", self.maybe_launch_copies, None
+        )
+        self.new_files_job = bgtasks.register_periodic_job(
+            "standing orders for new files", self.launch_copies_for_new_files, None, coalesce=True
+        )
+        watch_new_objects(FileInstance, "name", self.note_new_instances)
+
 
 the_standing_order_manager = StandingOrderManager()
 
@@ -811,23 +1194,32 @@ def queue_standing_order_copies():
 
 
 def register_standing_order_checkin():
-    """Create a Tornado PeriodicCallback that will periodically check the
-    standing orders to see if there's anything to do.
-
-    Since we know all events related to files, in theory this shouldn't be
-    needed, but in practice this can't hurt.
+    """Create a Tornado PeriodicCallback that will periodically sweep through
+    all of the standing orders to see if there's anything to do.
 
-    The timeout for the callback is measured in milliseconds, so we queue an
-    evaluation every 10 minutes.
+    Since we evaluate the orders whenever new files arrive, in theory this
+    shouldn't be needed, but in practice this can't hurt. It's a relatively
+    expensive operation, so by default it only happens every six hours.
 
     """
     from tornado import ioloop
 
-    cb = ioloop.PeriodicCallback(queue_standing_order_copies, 60 * 10 * 1000)
+    interval = app.config.get(
+        "standing_order_sweep_interval", DEFAULT_STANDING_ORDER_SWEEP_INTERVAL
+    )
+    cb = ioloop.PeriodicCallback(queue_standing_order_copies, interval * 1000)
     cb.start()
     return cb
 
 
+def start_standing_order_manager():
+    """Start evaluating standing orders against newly-ingested files. Every
+    server process should do this.
+
+    """
+    the_standing_order_manager.start()
+
+
 # The local-disk staging system for the NRAO Librarian. In a sense this code
 # isn't super relevant to searches, but the search system is how it gets
 # launched, and it's not obvious to me that there's a better place to put it.
@@ -844,8 +1236,14 @@ class StagerTask(bgtasks.BackgroundTask):
     functionality allows users to have the server copy data over to Lustre
     as quick as possible.
 
+    Staging is requested by users waiting on the results, so it gets
+    interactive priority.
+
     """
 
+    pool = "local"
+    priority = bgtasks.TaskPriority.INTERACTIVE
+
     def __init__(self, dest, stage_info, bytes, user, chown_command):
         """Arguments:
 
@@ -1080,6 +1478,7 @@ def specific_standing_order(name):
         title="Standing Order %s" % (storder.name),
         storder=storder,
         cur_files=cur_files,
+        failed=storder.get_failed_copies(),
     )
 
 
@@ -1163,6 +1562,9 @@ def delete_standing_order(name):
         flash('No such standing order "%s"' % name)
         return redirect(url_for("standing_orders"))
 
+    StandingOrderProgress.query.filter(StandingOrderProgress.order_id == storder.id).delete(
+        synchronize_session=False
+    )
     db.session.delete(storder)
 
     try:
@@ -1176,6 +1578,41 @@ def delete_standing_order(name):
     return redirect(url_for("standing_orders"))
 
 
+@app.route("/standing-orders/<string:name>/requeue", methods=["POST"])
+@login_required
+def requeue_standing_order_files(name):
+    """Forget about the failures of a standing order to copy a file, so that
+    it's tried again from scratch. If no file name is given, all of the
+    order's failed files are requeued.
+
+    """
+    storder = StandingOrder.query.filter(StandingOrder.name == name).first()
+    if storder is None:
+        flash('No such standing order "%s"' % name)
+        return redirect(url_for("standing_orders"))
+
+    file_name = optional_arg(request.form, str, "file_name")
+    q = StandingOrderProgress.query.filter(
+        StandingOrderProgress.order_id == storder.id,
+        StandingOrderProgress.state.in_(FAILED_PROGRESS_STATES),
+    )
+    if file_name is not None:
+        q = q.filter(StandingOrderProgress.file_name == file_name)
+    n = q.delete(synchronize_session=False)
+
+    try:
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        app.log_exception(sys.exc_info())
+        raise ServerError("failed to commit requeue to database; see logs for details")
+
+    queue_standing_order_copies()
+
+    flash("Requeued %d file(s) for standing order %s" % (n, name))
+    return redirect(url_for("standing_orders") + "/" + name)
+
+
 # Web interface to searches outside of the standing order system
 
 sample_file_search = '{ "name-matches": "%12345%.uv" }'
@@ -1219,6 +1656,7 @@ full_path_format = "Raw text with full instance paths"
 human_file_format = "List of files"
 human_obs_format = "List of observations"
 human_session_format = "List of sessions"
+human_file_stats_format = "File statistics"
 stage_the_files_human_format = "stage-the-files-human"
 
 
@@ -1248,11 +1686,15 @@ def execute_search_ui():
     output_format = optional_arg(reqdata, str, "output_format", human_file_format)
     stage_user = optional_arg(reqdata, str, "stage_user", "")
     stage_dest_suffix = optional_arg(reqdata, str, "stage_dest_suffix", "")
+    group_by = optional_arg(reqdata, str, "group_by", "")
+    group_by = [k.strip() for k in group_by.split(",") if len(k.strip())]
+    explain = len(optional_arg(reqdata, str, "explain", "")) > 0
+    analyze = len(optional_arg(reqdata, str, "analyze", "")) > 0
     for_humans = True
 
     if output_format == full_path_format:
         for_humans = False
-        query_type = "names"
+        query_type = "instances"
     elif output_format == file_name_format:
         for_humans = False
     elif output_format == human_file_format:
@@ -1261,6 +1703,8 @@ def execute_search_ui():
         for_humans = True
     elif output_format == human_session_format:
         for_humans = True
+    elif output_format == human_file_stats_format:
+        for_humans = True
     elif output_format == stage_the_files_human_format:
         for_humans = True
         query_type = "instances-stores"
@@ -1273,6 +1717,9 @@ def execute_search_ui():
 
     status = 200
 
+    if explain:
+        for_humans = True
+
     if for_humans:
         mimetype = "text/html"
     else:
@@ -1281,11 +1728,36 @@ def execute_search_ui():
     try:
         search = compile_search(search_text, query_type=query_type)
 
-        if output_format == full_path_format:
-            from .file import FileInstance
+        # File statistics run a different statement from the search itself;
+        # its cost is checked when it's built.
+        if not explain and output_format != human_file_stats_format:
+            check_search_cost(search)
 
-            instances = FileInstance.query.filter(FileInstance.name.in_(search))
-            text = "\n".join(i.full_path_on_store() for i in instances)
+        if explain:
+            if output_format == human_file_stats_format:
+                stmt = _file_stats_query(search, group_by)
+            else:
+                stmt = search
+
+            if analyze:
+                check_search_cost(stmt)
+
+            info = explain_search(stmt, analyze=analyze)
+
+            if isinstance(info["plan"], list) and all(isinstance(p, str) for p in info["plan"]):
+                plan_text = "\n".join(info["plan"])
+            else:
+                plan_text = json.dumps(info["plan"], indent=2)
+
+            text = render_template(
+                "search-explain.html",
+                title="Search Explanation",
+                search_text=search_text,
+                info=info,
+                plan_text=plan_text,
+            )
+        elif output_format == full_path_format:
+            text = "\n".join(i.full_path_on_store() for i in search)
         elif output_format == file_name_format:
             text = "\n".join(f.name for f in search)
         elif output_format == human_file_format:
@@ -1316,6 +1788,16 @@ def execute_search_ui():
                 sess=sess,
                 error_message=None,
             )
+        elif output_format == human_file_stats_format:
+            stats = compute_file_stats(search, group_by, check_cost=True)
+            text = render_template(
+                "search-results-stats.html",
+                title="Search Results: File Statistics",
+                search_text=search_text,
+                group_by=group_by,
+                stats=stats,
+                error_message=None,
+            )
         elif output_format == stage_the_files_human_format:
             # This will DTRT if stage_dest_suffix is empty:
             dest_prefix = app.config["local_disk_staging"]["dest_prefix"]
@@ -1368,6 +1850,461 @@ instance_listing_json_format = "instance-listing-json"
 obs_listing_json_format = "obs-listing-json"
 
 
+# Listings for the JSON API. Building ORM objects for every row of a big
+# listing, with their identity map entries and instrumented attributes, only
+# to turn them straight into dicts costs more than the query itself. So we
+# select just the columns that each listing needs, and build the dicts from
+# the raw rows. The dicts must match those returned by the `to_dict()`
+# methods of the corresponding classes.
+
+
+def _file_listing_dict(row):
+    import calendar
+
+    return dict(
+        name=row.name,
+        type=row.type,
+        create_time=calendar.timegm(row.create_time.timetuple()),
+        obsid=row.obsid,
+        size=row.size,
+        md5=row.md5,
+    )
+
+
+def _obs_listing_dict(row):
+    return dict(
+        obsid=row.obsid,
+        start_time_jd=row.start_time_jd,
+        stop_time_jd=row.stop_time_jd,
+        start_lst_hr=row.start_lst_hr,
+        session_id=row.session_id,
+    )
+
+
+def _session_listing_dict(row):
+    return dict(id=row.id, start_time_jd=row.start_time_jd, stop_time_jd=row.stop_time_jd)
+
+
+def _instance_listing_dict(row):
+    from .file import DeletionPolicy
+
+    return dict(
+        store_name=row.store_name,
+        store_ssh_host=row.ssh_host,
+        parent_dirs=row.parent_dirs,
+        name=row.name,
+        deletion_policy=DeletionPolicy.textualize(row.deletion_policy),
+        full_path_on_store=os.path.join(row.path_prefix, row.parent_dirs, row.name),
+    )
+
+
+def compile_listing(search, query_type):
+    """Turn the query `search`, as returned by `compile_search`, into a Core
+    SELECT of just the columns needed to list its results. Returns `(select,
+    to_dict)`, where `to_dict` converts a result row into the same dict as
+    the `to_dict()` method of the matching ORM object.
+
+    """
+    from sqlalchemy import select
+
+    from .file import File, FileInstance
+    from .observation import Observation, ObservingSession
+    from .store import Store
+
+    if query_type == "files":
+        columns = [File.name, File.type, File.create_time, File.obsid, File.size, File.md5]
+        stmt = select(*columns)
+        to_dict = _file_listing_dict
+    elif query_type == "obs":
+        columns = [
+            Observation.obsid,
+            Observation.start_time_jd,
+            Observation.stop_time_jd,
+            Observation.start_lst_hr,
+            Observation.session_id,
+        ]
+        stmt = select(*columns)
+        to_dict = _obs_listing_dict
+    elif query_type == "sessions":
+        columns = [
+            ObservingSession.id,
+            ObservingSession.start_time_jd,
+            ObservingSession.stop_time_jd,
+        ]
+        stmt = select(*columns)
+        to_dict = _session_listing_dict
+    elif query_type == "instances":
+        # The store ID is needed to paginate instance listings.
+        columns = [
+            FileInstance.store,
+            FileInstance.parent_dirs,
+            FileInstance.name,
+            FileInstance.deletion_policy,
+            Store.name.label("store_name"),
+            Store.ssh_host,
+            Store.path_prefix,
+        ]
+        stmt = (
+            select(*columns)
+            .select_from(FileInstance)
+            .join(File, File.name == FileInstance.name, isouter=True)
+            .join(Store, Store.id == FileInstance.store)
+        )
+        to_dict = _instance_listing_dict
+    else:
+        raise ServerError("searches of type %r cannot be listed", query_type)
+
+    if search.whereclause is not None:
+        stmt = stmt.where(search.whereclause)
+
+    return stmt, to_dict
+
+
+# Streamed variants of the listings, as newline-delimited JSON.
+ndjson_listing_formats = {
+    "session-listing-ndjson": "sessions",
+    "file-listing-ndjson": "files",
+    "instance-listing-ndjson": "instances",
+    "obs-listing-ndjson": "obs",
+}
+
+STREAM_FETCH_SIZE = 1000
+
+
+def stream_search_results(search, query_type):
+    """Generate the results of the query `search` as lines of newline-delimited
+    JSON, one item per line. The rows are fetched from a server-side cursor
+    in batches, so memory use is bounded no matter how many results there
+    are.
+
+    The final line is a trailer, `{"success": true, "n_results": N}`, so that
+    the client can tell a complete listing from one that was cut off. If
+    something goes wrong partway through, the trailer instead has `"success":
+    false` and a "message".
+
+    """
+    stmt, to_dict = compile_listing(search, query_type)
+    stmt = stmt.execution_options(yield_per=STREAM_FETCH_SIZE)
+    n = 0
+
+    try:
+        for row in db.session.execute(stmt):
+            yield encode_json(to_dict(row)) + b"\n"
+            n += 1
+    except Exception as e:
+        logger.exception("streamed search failed after %d results", n)
+        yield encode_json({"success": False, "message": "search failed: %s" % e}) + b"\n"
+        return
+
+    yield encode_json({"success": True, "n_results": n}) + b"\n"
+
+
+# Aggregate statistics about the files matching a search, computed in the
+# database so that we don't have to ship every row to the client just to add
+# up their sizes.
+
+file_stats_json_format = "file-stats-json"
+
+FILE_STATS_GROUP_KEYS = ("type", "source", "obsid", "session", "store")
+
+
+def _file_stats_query(search, group_by):
+    from sqlalchemy import func
+
+    from .file import File, FileInstance
+    from .observation import Observation
+    from .store import Store
+
+    group_columns = {
+        "type": File.type,
+        "source": File.source,
+        "obsid": File.obsid,
+        "session": Observation.session_id,
+        "store": Store.name,
+    }
+
+    group_by = list(group_by)
+
+    for key in group_by:
+        if key not in group_columns:
+            raise ServerError("cannot group file statistics by %r", key)
+
+    if len(set(group_by)) != len(group_by):
+        raise ServerError("file statistics grouping keys may not be repeated")
+
+    keys = [group_columns[k] for k in group_by]
+    q = db.session.query(
+        *[col.label(k) for k, col in zip(group_by, keys)],
+        func.count().label("count"),
+        func.coalesce(func.sum(File.size), 0).label("total_size"),
+        func.min(File.create_time).label("min_create_time"),
+        func.max(File.create_time).label("max_create_time"),
+    ).select_from(File)
+
+    if "session" in group_by:
+        q = q.outerjoin(Observation, Observation.obsid == File.obsid)
+    if "store" in group_by:
+        q = q.join(FileInstance, FileInstance.name == File.name).join(
+            Store, Store.id == FileInstance.store
+        )
+    if search.whereclause is not None:
+        q = q.filter(search.whereclause)
+    if len(keys):
+        q = q.group_by(*keys).order_by(*keys)
+
+    return q
+
+
+def compute_file_stats(search, group_by=(), check_cost=False):
+    """Compute aggregate statistics of the files matched by the query `search`,
+    as returned by `compile_search` with `query_type="files"`.
+
+    Returns a list of dicts, one for each distinct combination of the values
+    named in `group_by`, which may contain any of `FILE_STATS_GROUP_KEYS`.
+    Each dict contains those values along with "count", "total_size",
+    "min_create_time", and "max_create_time", the last two as Unix times. If
+    `group_by` is empty, there is exactly one dict, covering all matches.
+
+    Grouping by "store" counts file instances rather than files: a file with
+    instances on two stores contributes to both of their groups, and files
+    without any instances are left out.
+
+    If `check_cost` is true, the statistics query is first passed to
+    `check_search_cost`.
+
+    """
+    import calendar
+
+    q = _file_stats_query(search, group_by)
+
+    if check_cost:
+        check_search_cost(q)
+
+    def unix(t):
+        return None if t is None else calendar.timegm(t.timetuple())
+
+    results = []
+
+    for row in q:
+        item = dict(row._mapping)
+        item["total_size"] = int(item["total_size"])
+        item["min_create_time"] = unix(item["min_create_time"])
+        item["max_create_time"] = unix(item["max_create_time"])
+        results.append(item)
+
+    return results
+
+
+# Paginated searches. Results are returned in order of a unique, stable key
+# for each query type, and the "cursor" that we hand out encodes the key of
+# the last item that was returned. The next page picks up after that key, so
+# the database can use the primary-key index rather than counting its way
+# through an OFFSET, and pages stay consistent if records are added
+# in the meantime.
+
+MAX_SEARCH_PAGE_SIZE = 10000
+
+
+def _keyset_columns(query_type):
+    from .file import File, FileInstance
+    from .observation import Observation, ObservingSession
+
+    keysets = {
+        "files": [File.name],
+        "obs": [Observation.obsid],
+        "sessions": [ObservingSession.id],
+        "instances": [FileInstance.store, FileInstance.parent_dirs, FileInstance.name],
+    }
+
+    if query_type not in keysets:
+        raise ServerError("searches of type %r cannot be paginated", query_type)
+
+    return keysets[query_type]
+
+
+def _encode_search_cursor(key):
+    import base64
+
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def _decode_search_cursor(cursor, n_items):
+    import base64
+
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ServerError("invalid search cursor %r", cursor)
+
+    if not isinstance(key, list) or len(key) != n_items:
+        raise ServerError("invalid search cursor %r", cursor)
+
+    return key
+
+
+def _keyset_page(q, columns, limit, cursor):
+    """Restrict the ORM query or Core select `q` to one page of results,
+    starting after the key encoded in `cursor`. We fetch one extra item so
+    that we know whether there's another page.
+
+    """
+    from sqlalchemy import tuple_
+
+    if limit < 1:
+        raise ServerError("search page size must be positive; got %d", limit)
+
+    limit = min(limit, MAX_SEARCH_PAGE_SIZE)
+
+    if cursor is not None:
+        key = _decode_search_cursor(cursor, len(columns))
+
+        if len(columns) == 1:
+            q = q.filter(columns[0] > key[0])
+        else:
+            q = q.filter(tuple_(*columns) > tuple_(*key))
+
+    return q.order_by(*columns).limit(limit + 1), limit
+
+
+def _next_cursor(items, columns, limit):
+    if len(items) <= limit:
+        return items, None
+
+    items = items[:limit]
+    last = items[-1]
+    return items, _encode_search_cursor([getattr(last, c.key) for c in columns])
+
+
+def paginate_search(search, query_type, limit, cursor=None):
+    """Get one page of results from the query `search`, as returned by
+    `compile_search`. Returns `(items, next_cursor)`, where `next_cursor` is
+    None if there are no more results.
+
+    """
+    columns = _keyset_columns(query_type)
+    search, limit = _keyset_page(search, columns, limit, cursor)
+    return _next_cursor(search.all(), columns, limit)
+
+
+def paginate_listing(search, query_type, limit, cursor=None, check_cost=False):
+    """Like `paginate_search`, but return the items as dicts built directly
+    from the database rows; see `compile_listing`. If `check_cost` is true,
+    the query for the page is first passed to `check_search_cost`.
+
+    """
+    columns = _keyset_columns(query_type)
+    stmt, to_dict = compile_listing(search, query_type)
+    stmt, limit = _keyset_page(stmt, columns, limit, cursor)
+
+    if check_cost:
+        check_search_cost(stmt)
+
+    rows, next_cursor = _next_cursor(db.session.execute(stmt).all(), columns, limit)
+    return [to_dict(row) for row in rows], next_cursor
+
+
+# Explaining searches. The SQL that a search compiles to isn't always obvious,
+# and the nested subqueries of clauses such as "obs-matches" can get slow, so
+# users can ask to see the SQL and the database's plan for it. Separately,
+# the server can be configured with a `search_cost_limit` to refuse searches
+# that the database thinks would be very expensive, such as ones that scan
+# the whole file table. Cost estimates are only available with PostgreSQL.
+
+
+def _search_statement(search):
+    """Get the Core statement for an ORM query or Core select."""
+    return getattr(search, "statement", search)
+
+
+def _run_explain(stmt, analyze=False):
+    """Run EXPLAIN on the statement `stmt`, with the same parameters that it
+    would be executed with. Returns `(sql, params, plan, cost)`, where
+    `params` gives the values of the parameters in `sql`. For PostgreSQL the
+    plan is the JSON output of EXPLAIN and `cost` is the planner's estimate
+    of the total cost; for other databases the plan is a list of text lines
+    and the cost is None.
+
+    """
+    conn = db.session.connection()
+    dialect = conn.dialect
+    compiled = _search_statement(stmt).compile(
+        dialect=dialect, compile_kwargs={"render_postcompile": True}
+    )
+    sql = str(compiled)
+    params = compiled.params
+
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    # Note the parameter values alongside the SQL, in a JSON-friendly form.
+    sql_params = {
+        name: value if isinstance(value, (int, float, str, type(None))) else str(value)
+        for name, value in compiled.params.items()
+    }
+
+    if dialect.name == "postgresql":
+        options = "ANALYZE, FORMAT JSON" if analyze else "FORMAT JSON"
+        plan = conn.exec_driver_sql(f"EXPLAIN ({options}) {sql}", params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return sql, sql_params, plan, plan[0]["Plan"]["Total Cost"]
+
+    if dialect.name == "sqlite":
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params)
+        return sql, sql_params, [row[-1] for row in rows], None
+
+    rows = conn.exec_driver_sql(f"EXPLAIN {sql}", params)
+    return sql, sql_params, [" ".join(str(c) for c in row) for row in rows], None
+
+
+def explain_search(stmt, analyze=False):
+    """Explain how the database would execute the search query `stmt`, which
+    may be an ORM query or Core select. If `analyze` is true, the query is
+    actually run; PostgreSQL then includes actual timings and row counts in
+    its plan.
+
+    Returns a dict with the generated "sql" and its "parameters", the
+    database's "plan", its "estimated_cost" (if available), and the
+    "elapsed" time in seconds taken to produce the plan, or to run the query
+    if `analyze` is true. In the latter case it also has the number of rows
+    that the query returned, "n_rows".
+
+    """
+    t0 = time.time()
+    sql, params, plan, cost = _run_explain(stmt, analyze=analyze)
+    info = dict(sql=sql, parameters=params, plan=plan, estimated_cost=cost, analyzed=analyze)
+
+    if analyze and db.session.connection().dialect.name == "postgresql":
+        info["n_rows"] = plan[0]["Plan"]["Actual Rows"]
+    elif analyze:
+        t0 = time.time()
+        info["n_rows"] = sum(1 for _ in db.session.execute(_search_statement(stmt)))
+
+    info["elapsed"] = time.time() - t0
+    return info
+
+
+def check_search_cost(stmt):
+    """Raise a ServerError if the estimated cost of running the search query
+    `stmt` exceeds the configured `search_cost_limit`. This does nothing if
+    no limit is configured or the database can't estimate costs.
+
+    """
+    limit = app.config.get("search_cost_limit")
+    if limit is None:
+        return
+
+    _, _, _, cost = _run_explain(stmt)
+
+    if cost is not None and cost > limit:
+        raise ServerError(
+            "search is too expensive to run: its estimated cost is %.0f, but the limit is %.0f; "
+            "try making it more specific",
+            cost,
+            limit,
+        )
+
+
 @app.route("/api/search", methods=["GET", "POST"])
 @json_api
 def execute_search_api(args, sourcename=None):
@@ -1377,11 +2314,32 @@ def execute_search_api(args, sourcename=None):
     (Besides checking that it corresponds to a real system user.) This is
     incredibly lame but I'm not keen to build a real login system here.
 
+    Listings can be paginated by passing a `limit` on the number of results
+    to return. The reply then includes a `next_cursor`, which should be
+    passed as the `cursor` argument to get the next page; it is null once
+    all of the results have been returned. Otherwise, all of the results are
+    returned at once.
+
+    The "*-listing-ndjson" output formats stream the results instead; see
+    `stream_search_results`. The "file-stats-json" format returns aggregate
+    statistics of the matching files, optionally grouped by the keys listed
+    in `group_by`; see `compute_file_stats`.
+
+    If `search_result_cache_ttl` is set, the results of listings and
+    statistics are cached; see the `searchcache` module.
+
+    If `explain` is true, the search isn't run; instead, the reply describes
+    how the database would run it. See `explain_search`, which is also passed
+    the `analyze` flag. Searches that the database estimates would cost more
+    than `search_cost_limit` are refused; see `check_search_cost`.
+
     """
     search_text = required_arg(args, str, "search")
     output_format = required_arg(args, str, "output_format")
     stage_user = optional_arg(args, str, "stage_user", "")
     stage_dest = optional_arg(args, str, "stage_dest", "")
+    limit = optional_arg(args, int, "limit")
+    cursor = optional_arg(args, str, "cursor")
 
     if output_format == stage_the_files_json_format:
         query_type = "instances-stores"
@@ -1400,21 +2358,82 @@ def execute_search_api(args, sourcename=None):
         query_type = "instances"
     elif output_format == obs_listing_json_format:
         query_type = "obs"
+    elif output_format in ndjson_listing_formats:
+        query_type = ndjson_listing_formats[output_format]
+    elif output_format == file_stats_json_format:
+        query_type = "files"
     else:
         raise ServerError("illegal search output type %r", output_format)
 
-    search = compile_search(search_text, query_type=query_type)
+    group_by = optional_arg(args, list, "group_by", [])
+
+    if not all(isinstance(k, str) for k in group_by):
+        raise ServerError('parameter "group_by" should be a list of text')
+
+    if optional_arg(args, bool, "explain", False):
+        analyze = optional_arg(args, bool, "analyze", False)
+        search = compile_search(search_text, query_type=query_type)
+
+        if output_format == file_stats_json_format:
+            stmt = _file_stats_query(search, group_by)
+        elif query_type in ("files", "obs", "sessions", "instances"):
+            stmt, _ = compile_listing(search, query_type)
+        else:
+            stmt = search
+
+        if analyze:
+            check_search_cost(stmt)
+        return explain_search(stmt, analyze=analyze)
 
     if output_format == stage_the_files_json_format:
+        search = compile_search(search_text, query_type=query_type)
+        check_search_cost(search)
         final_dest, n_instances, n_bytes = launch_stage_operation(stage_user, search, stage_dest)
         return dict(destination=final_dest, n_instances=n_instances, n_bytes=n_bytes)
-    elif output_format == session_listing_json_format:
-        return dict(results=[sess.to_dict() for sess in search])
-    elif output_format == file_listing_json_format:
-        return dict(results=[files.to_dict() for files in search])
-    elif output_format == instance_listing_json_format:
-        return dict(results=[instance.to_dict() for instance in search])
-    elif output_format == obs_listing_json_format:
-        return dict(results=[obs.to_dict() for obs in search])
-    else:
-        raise ServerError("internal logic failure mishandled output format")
+
+    if output_format in ndjson_listing_formats:
+        from flask import stream_with_context
+
+        search = compile_search(search_text, query_type=query_type)
+        check_search_cost(search)
+        return Response(
+            stream_with_context(stream_search_results(search, query_type)),
+            mimetype="application/x-ndjson",
+        )
+
+    if limit is not None or cursor is not None:
+        # If the client gave us a cursor but no limit, it's continuing a
+        # paginated search, so the page size doesn't matter much.
+        if limit is None:
+            limit = MAX_SEARCH_PAGE_SIZE
+
+    # The listings can be big, so we build them from plain rows rather than
+    # ORM objects, and encode them ourselves with the fastest encoder we have.
+
+    # We check the cost of the statement that actually gets run: one page of
+    # a listing can be cheap even when the whole listing would not be.
+
+    def compute():
+        search = compile_search(search_text, query_type=query_type)
+
+        if output_format == file_stats_json_format:
+            stats = compute_file_stats(search, group_by, check_cost=True)
+            result = dict(success=True, results=stats)
+        elif limit is not None:
+            items, next_cursor = paginate_listing(
+                search, query_type, limit, cursor, check_cost=True
+            )
+            result = dict(success=True, results=items, next_cursor=next_cursor)
+        else:
+            stmt, to_dict = compile_listing(search, query_type)
+            check_search_cost(stmt)
+            rows = db.session.execute(stmt)
+            result = dict(success=True, results=[to_dict(row) for row in rows])
+
+        return encode_json(result)
+
+    from .searchcache import cached_result, normalize_search
+
+    _, key = normalize_search(search_text)
+    key = (output_format, key, limit, cursor, tuple(group_by))
+    return Response(cached_result(key, compute), mimetype="application/json")
@@ -0,0 +1,251 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the BSD License.
+
+"""Caches for searches.
+
+There are two levels of caching here. First, compiling a search into an
+SQLAlchemy clause is a fair amount of Python work, and the same handful of
+searches are compiled over and over by standing orders and the web UI, so we
+keep an LRU cache of compiled clauses keyed by the normalized search text.
+Searches whose meaning depends on the current time, such as
+`not-older-than`, are never cached.
+
+Second, there's an optional cache of the results of API searches, enabled
+by setting `search_result_cache_ttl` to a number of seconds. Identical
+searches that arrive while one is already running wait for its result
+rather than hitting the database again. Cached results are dropped as soon
+as anything writes to a table that they might depend on; we track this with
+a generation counter that is bumped by every INSERT, UPDATE, or DELETE on
+those tables. The counter is per-process, so if the server runs several
+processes, writes made by one of them only invalidate the others' caches
+through the TTL.
+
+"""
+
+
+__all__ = str(
+    """
+cached_clause
+cached_result
+normalize_search
+write_generation
+"""
+).split()
+
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.dml import UpdateBase
+
+from . import app, db
+from .webutil import ServerError
+
+DEFAULT_COMPILE_CACHE_SIZE = 256
+RESULT_CACHE_MAX_ENTRIES = 256
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Writes to these tables invalidate cached search results.
+WATCHED_TABLES = frozenset(["file", "file_instance", "file_event", "observation"])
+
+
+def normalize_search(search_string):
+    """Parse the JSON text of a search, stripping out #-delimited comments.
+    Returns `(search, key)`, where `search` is the parsed search and `key` is
+    a canonical textual form of it, so that searches differing only in
+    comments, whitespace, or the order of their clauses have the same key.
+
+    """
+    # As a convenience, we strip out #-delimited comments from the input text.
+    # The default JSON parser doesn't accept them, but they're nice for users.
+
+    def filter_comments():
+        for line in search_string.splitlines():
+            yield line.split("#", 1)[0]
+
+    try:
+        search = json.loads("\n".join(filter_comments()))
+    except Exception as e:
+        app.log_exception(sys.exc_info())
+        raise ServerError("can't parse search as JSON: %s", e)
+
+    return search, json.dumps(search, sort_keys=True, separators=(",", ":"))
+
+
+# The write generation counter.
+
+_generation_lock = threading.Lock()
+_generation = 0
+_pending = threading.local()
+
+
+def write_generation():
+    """Get the current value of the write generation counter."""
+    return _generation
+
+
+def _bump_generation():
+    global _generation
+
+    with _generation_lock:
+        _generation += 1
+
+
+@event.listens_for(Engine, "after_execute")
+def _note_write(conn, clauseelement, multiparams, params, execution_options, result):
+    if not isinstance(clauseelement, UpdateBase):
+        return
+
+    if getattr(clauseelement.table, "name", None) in WATCHED_TABLES:
+        # Bump now, so that nobody uses results from before this write, and
+        # again once it's committed, in case anyone cached results computed
+        # in between without being able to see it yet.
+        _bump_generation()
+        _pending.wrote = True
+
+
+@event.listens_for(db.session, "after_commit")
+def _note_commit(session):
+    if getattr(_pending, "wrote", False):
+        _pending.wrote = False
+        _bump_generation()
+
+
+@event.listens_for(db.session, "after_rollback")
+def _note_rollback(session):
+    _pending.wrote = False
+
+
+# The compiled-clause cache.
+
+_compiled_lock = threading.Lock()
+_compiled = OrderedDict()
+
+
+def _is_volatile(search, volatile_clauses):
+    if isinstance(search, dict):
+        for name, payload in search.items():
+            if name in volatile_clauses or _is_volatile(payload, volatile_clauses):
+                return True
+    elif isinstance(search, list):
+        return any(_is_volatile(item, volatile_clauses) for item in search)
+
+    return False
+
+
+def cached_clause(compiler, search, key):
+    """Compile the parsed search `search` with `compiler`, a
+    GenericSearchCompiler, reusing a previous compilation of the search with
+    the normalized text `key` if possible.
+
+    """
+    size = app.config.get("search_compile_cache_size", DEFAULT_COMPILE_CACHE_SIZE)
+
+    if size < 1 or _is_volatile(search, compiler.volatile_clauses):
+        return compiler.compile(search)
+
+    key = (compiler.__class__.__name__, key)
+
+    with _compiled_lock:
+        clause = _compiled.get(key)
+        if clause is not None:
+            _compiled.move_to_end(key)
+            return clause
+
+    clause = compiler.compile(search)
+
+    with _compiled_lock:
+        _compiled[key] = clause
+        while len(_compiled) > size:
+            _compiled.popitem(last=False)
+
+    return clause
+
+
+# The result cache.
+
+
+class _Flight:
+    """A computation of a search result that other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+_results_lock = threading.Lock()
+_results = OrderedDict()  # key => (generation, expiration time, value)
+_results_bytes = 0
+_in_flight = {}
+
+
+def _store_result(key, generation, expires, value):
+    global _results_bytes
+
+    old = _results.pop(key, None)
+    if old is not None:
+        _results_bytes -= len(old[2])
+
+    if len(value) > RESULT_CACHE_MAX_BYTES:
+        return
+
+    _results[key] = (generation, expires, value)
+    _results_bytes += len(value)
+
+    while len(_results) > RESULT_CACHE_MAX_ENTRIES or _results_bytes > RESULT_CACHE_MAX_BYTES:
+        _, (_, _, evicted) = _results.popitem(last=False)
+        _results_bytes -= len(evicted)
+
+
+def cached_result(key, compute):
+    """Get the result of a search, identified by the hashable `key`. If
+    result caching is enabled and there's a current cached value, it's
+    returned. Otherwise, the value is computed by calling `compute()`, which
+    must return bytes, unless the same computation is already under way in
+    another thread, in which case we wait for that instead.
+
+    """
+    ttl = app.config.get("search_result_cache_ttl", 0)
+    if ttl <= 0:
+        return compute()
+
+    with _results_lock:
+        generation = _generation
+        entry = _results.get(key)
+
+        if entry is not None and entry[0] == generation and entry[1] > time.monotonic():
+            _results.move_to_end(key)
+            return entry[2]
+
+        flight_key = (key, generation)
+        flight = _in_flight.get(flight_key)
+        leader = flight is None
+
+        if leader:
+            flight = _in_flight[flight_key] = _Flight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    try:
+        flight.value = compute()
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _results_lock:
+            del _in_flight[flight_key]
+
+            if flight.error is None and generation == _generation:
+                _store_result(key, generation, time.monotonic() + ttl, flight.value)
+
+        flight.done.set()
+
+    return flight.value
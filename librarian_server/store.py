@@ -34,6 +34,7 @@ from hera_librarian.base_store import BaseStore
 
 from . import app, bgtasks, db, logger
 from .dbutil import NotNull
+from .fileevents import record_event
 from .webutil import ServerError, json_api, login_required, optional_arg, required_arg
 
 
@@ -242,6 +243,146 @@ class Store(db.Model, BaseStore):
 
         return inst
 
+    def register_instances(self, file_info, source_name, null_obsid=False):
+        """Register files that have appeared on this store, creating File and
+        FileInstance records for them as needed. See the `register_instances`
+        API call.
+
+        *file_info* maps full paths on the store to the information gathered
+        about each file (MD5, size, etc.). Files that we already know about
+        are ignored. This is designed to handle a whole night's worth of files
+        efficiently: existing records are looked up with a few set queries,
+        and the new records are inserted in bulk in a single transaction.
+        Either all of the new records are created, or none of them are.
+
+        Returns the number of new instances.
+
+        """
+        from collections import Counter
+        from sqlalchemy import insert
+
+        from . import mc_integration as mc
+        from . import rollups
+        from .dbutil import in_chunks, note_new_keys
+        from .file import File, FileEvent, FileInstance, FileNamePrefix
+
+        slashed_prefix = self.path_prefix + "/"
+        entries = []
+
+        # Sort the files to get the creation times to line up.
+
+        for full_path in sorted(file_info.keys()):
+            if not full_path.startswith(slashed_prefix):
+                raise ServerError('file path %r should start with "%s"', full_path, slashed_prefix)
+
+            store_path = full_path[len(slashed_prefix) :]
+            entries.append((store_path, file_info[full_path]))
+
+        # Which of these instances and files do we already know about?
+
+        names = sorted({os.path.basename(store_path) for store_path, _ in entries})
+        known_instances = set()
+        known_files = set()
+
+        for chunk in in_chunks(names):
+            q = db.session.query(FileInstance.parent_dirs, FileInstance.name).filter(
+                FileInstance.store == self.id, FileInstance.name.in_(chunk)
+            )
+            known_instances.update(tuple(row) for row in q)
+
+            q = db.session.query(File.name).filter(File.name.in_(chunk))
+            known_files.update(row[0] for row in q)
+
+        # Figure out the new records that we need.
+
+        new_entries = []
+        new_file_entries = []
+
+        for store_path, info in entries:
+            parent_dirs = os.path.dirname(store_path)
+            name = os.path.basename(store_path)
+
+            if (parent_dirs, name) in known_instances:
+                continue
+
+            new_entries.append((parent_dirs, name))
+
+            if name not in known_files:
+                known_files.add(name)  # in case the same file appears twice
+                new_file_entries.append((store_path, info))
+
+        if not len(new_entries):
+            return 0
+
+        new_files = File.infer_new_files(self, new_file_entries, source_name, null_obsid=null_obsid)
+
+        # Now insert everything in bulk. This bypasses the ORM's unit of work,
+        # so we need to update the file name prefixes and rollups, and tell
+        # anyone who's watching for new instances, ourselves.
+
+        instances = [FileInstance(self, parent_dirs, name) for parent_dirs, name in new_entries]
+        events = [
+            FileEvent(
+                inst.name,
+                "create_instance",
+                {"store_name": self.name, "parent_dirs": inst.parent_dirs},
+            )
+            for inst in instances
+        ]
+
+        try:
+            FileNamePrefix.note_files((f.name, f.obsid) for f in new_files)
+            db.session.flush()  # any new Observations need to go in first
+
+            if len(new_files):
+                db.session.execute(
+                    insert(File),
+                    [
+                        dict(
+                            name=f.name,
+                            type=f.type,
+                            create_time=f.create_time,
+                            obsid=f.obsid,
+                            size=f.size,
+                            md5=f.md5,
+                            source=f.source,
+                        )
+                        for f in new_files
+                    ],
+                )
+
+            db.session.execute(
+                insert(FileInstance),
+                [
+                    dict(
+                        store=inst.store,
+                        parent_dirs=inst.parent_dirs,
+                        name=inst.name,
+                        deletion_policy=inst.deletion_policy,
+                    )
+                    for inst in instances
+                ],
+            )
+            db.session.execute(
+                insert(FileEvent),
+                [
+                    dict(name=ev.name, time=ev.time, type=ev.type, payload=ev.payload)
+                    for ev in events
+                ],
+            )
+            conn = db.session.connection()
+            rollups.apply_file_changes(conn, added=[(f.obsid, f.size) for f in new_files])
+            rollups.apply_instance_changes(conn, Counter(inst.name for inst in instances))
+            note_new_keys(FileInstance, [inst.name for inst in instances])
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            app.log_exception(sys.exc_info())
+            raise ServerError("failed to commit new records to database; see logs for details")
+
+        mc.note_files_created(new_files)
+        return len(instances)
+
 
 # RPC API
 
@@ -384,13 +525,67 @@ def complete_upload(args, sourcename=None):
     if not staging_was_known:
         store._delete(staging_dir)
 
-    # Finally, trigger a look at our standing orders.
+    # We don't need to poke the standing orders: they're evaluated against
+    # the new instance as soon as it's committed.
 
-    from .search import queue_standing_order_copies
+    return {}
 
-    queue_standing_order_copies()
 
-    return {}
+@app.route("/api/complete_upload_batch", methods=["GET", "POST"])
+@json_api
+def complete_upload_batch(args, sourcename=None):
+    """Like `complete_upload`, but for a batch of files that were all uploaded
+    into the same staging directory. Each file is validated and ingested
+    independently, so that one bad file doesn't spoil the whole batch. We
+    return a dictionary mapping the names of any files that couldn't be
+    ingested to error messages.
+
+    """
+    store_name = required_arg(args, str, "store_name")
+    staging_dir = required_arg(args, str, "staging_dir")
+    dest_store_paths = required_arg(args, list, "dest_store_paths")
+    meta_mode = required_arg(args, str, "meta_mode")
+    deletion_policy = optional_arg(args, str, "deletion_policy", "disallowed")
+    staging_was_known = optional_arg(args, bool, "staging_was_known", False)
+    null_obsid = optional_arg(args, bool, "null_obsid", False)
+    store = Store.get_by_name(store_name)  # ServerError if failure
+
+    from .file import DeletionPolicy
+
+    # See complete_upload() for why we do this.
+    deletion_policy = DeletionPolicy.parse_safe(deletion_policy)
+    errors = {}
+
+    for dest_store_path in dest_store_paths:
+        if not isinstance(dest_store_path, str):
+            raise ServerError(
+                'items of "dest_store_paths" should be text, but got %r', dest_store_path
+            )
+
+        file_name = os.path.basename(dest_store_path)
+        staged_path = os.path.join(staging_dir, file_name)
+
+        try:
+            store.process_staged_file(
+                staged_path,
+                dest_store_path,
+                meta_mode,
+                deletion_policy,
+                source_name=sourcename,
+                null_obsid=null_obsid,
+            )
+        except ServerError as e:
+            logger.warn("failed to complete upload of %s:%s: %s", store.name, dest_store_path, e)
+            db.session.rollback()
+            errors[file_name] = str(e)
+
+    # Failed files are left in the staging directory in case they're helpful
+    # for debugging, as with complete_upload().
+
+    if not staging_was_known and not len(errors):
+        store._delete(staging_dir)
+
+    return {"errors": errors}
 
 
 @app.route("/api/register_instances", methods=["GET", "POST"])
@@ -417,57 +612,51 @@ def register_instances(args, sourcename=None):
     file_info = required_arg(args, dict, "file_info")
     null_obsid = optional_arg(args, bool, "null_obsid", False)
 
-    from .file import File, FileInstance
-
     store = Store.get_by_name(store_name)  # ServerError if failure
-    slashed_prefix = store.path_prefix + "/"
-
-    # Sort the files to get the creation times to line up.
-
-    for full_path in sorted(file_info.keys()):
-        if not full_path.startswith(slashed_prefix):
-            raise ServerError('file path %r should start with "%s"', full_path, slashed_prefix)
+    store.register_instances(file_info, sourcename, null_obsid=null_obsid)
 
-        # Do we already know about this instance? If so, just ignore it.
+    # The commit automatically triggers evaluation of the standing orders
+    # against the new instances.
 
-        store_path = full_path[len(slashed_prefix) :]
-        parent_dirs = os.path.dirname(store_path)
-        name = os.path.basename(store_path)
+    return {}
 
-        instance = FileInstance.query.get((store.id, parent_dirs, name))
-        if instance is not None:
-            continue
 
-        # OK, we have to create some stuff.
+# File uploads and copies -- maybe this should be separated into its own file?
 
-        file = File.get_inferring_info(
-            store, store_path, sourcename, info=file_info[full_path], null_obsid=null_obsid
-        )
-        inst = FileInstance(store, parent_dirs, name)
-        db.session.add(inst)
-        db.session.add(file.make_instance_creation_event(inst, store))
 
-    try:
-        db.session.commit()
-    except SQLAlchemyError:
-        db.session.rollback()
-        app.log_exception(sys.exc_info())
-        raise ServerError("failed to commit new records to database; see logs for details")
+def _get_globus_settings():
+    """Figure out if we should try to use globus or not.
 
-    # Finally, trigger a look at our standing orders.
+    Returns a tuple `(use_globus, client_id, transfer_token,
+    source_endpoint_id)`.
 
-    from .search import queue_standing_order_copies
+    """
+    if not app.config.get("use_globus", False):
+        return False, None, None, None
 
-    queue_standing_order_copies()
+    source_endpoint_id = app.config.get("globus_endpoint_id", None)
+    try:
+        client_id = app.config["globus_client_id"]
+        transfer_token = app.config["globus_transfer_token"]
+    except KeyError:
+        return False, None, None, source_endpoint_id
 
-    return {}
+    return True, client_id, transfer_token, source_endpoint_id
 
 
-# File uploads and copies -- maybe this should be separated into its own file?
+DEFAULT_UPLOAD_BATCH_SIZE = 1
 
 
+@bgtasks.durable_task
 class UploaderTask(bgtasks.BackgroundTask):
-    """Object that manages the task of copying a file to another Librarian.
+    """Object that manages the task of copying files to another Librarian.
+
+    A single task can carry a whole batch of files, as long as they all live
+    on the same store and are going to the same destination. Batches are
+    uploaded with a single transfer and a single pair of `initiate_upload` /
+    `complete_upload_batch` calls on the remote Librarian, which saves a lot
+    of overhead when there are many small files. Whether each file made it is
+    recorded separately, so that the failures can be retried individually.
 
     If `known_staging_store` and `known_staging_subdir` are not None, the copy
     will be launched assuming that files have already been staged at a known
@@ -482,21 +671,21 @@ class UploaderTask(bgtasks.BackgroundTask):
     conn_name : str
         The name of the connection to use, as defined in ~/.hl_client.cfg.
     rec_info : dict
-        A dictionary containing database information for the file to be
+        A dictionary containing database information for the files to be
         transferred.
-    store_path : str
-        The full path to the file in the local store.
-    remote_store_path : str, optional
-        The path to place the file in the destination store. This may be None,
-        in which case we will request the same "store path" as the FileInstance
-        in this Librarian.
+    store_paths : list of str
+        The paths to the files in the local store.
+    remote_store_paths : list of str, optional
+        The paths to place the files in the destination store. This may be
+        None, or contain None items, in which case we will request the same
+        "store path" as the FileInstance in this Librarian.
     standing_order_name : str, optional
         The standing order corresponding to this upload task.
     known_staging_store : str, optional
-        The store corresponding to the already-uploaded file. Must be specified
+        The store corresponding to the already-uploaded files. Must be specified
         if `known_staging_subdir` is specified.
     known_staging_subdir : str, optional
-        The target directory corresponding to the already-uploaded file. Must by
+        The target directory corresponding to the already-uploaded files. Must by
         specified if `known_staging_store` is specified.
     use_globus : bool, optional
         Specify whether to try to use globus to transfer files.
@@ -507,8 +696,16 @@ class UploaderTask(bgtasks.BackgroundTask):
     source_endpoint_id : str, optional
         The globus endpoint ID of the source store. May be omitted, in which
         case we assume it is a "personal" (as opposed to public) client.
+    priority : int, optional
+        The TaskPriority class of the upload.
+
+    Uploads are durable tasks: they are recorded in the job table and survive
+    server restarts. The globus credentials are not persisted; they are
+    re-read from the server configuration when the task is reconstructed.
     """
 
+    kind = "upload"
+    pool = "transfer"
     t_start = None
     t_finish = None
 
@@ -517,8 +714,8 @@ class UploaderTask(bgtasks.BackgroundTask):
         store,
         conn_name,
         rec_info,
-        store_path,
-        remote_store_path,
+        store_paths,
+        remote_store_paths=None,
         standing_order_name=None,
         known_staging_store=None,
         known_staging_subdir=None,
@@ -526,12 +723,19 @@ class UploaderTask(bgtasks.BackgroundTask):
         client_id=None,
         transfer_token=None,
         source_endpoint_id=None,
+        priority=bgtasks.TaskPriority.NORMAL,
     ):
+        if remote_store_paths is None:
+            remote_store_paths = [None] * len(store_paths)
+
+        if len(remote_store_paths) != len(store_paths):
+            raise ValueError("must have the same number of local and remote store paths")
+
         self.store = store
         self.conn_name = conn_name
         self.rec_info = rec_info
-        self.store_path = store_path
-        self.remote_store_path = remote_store_path
+        self.store_paths = list(store_paths)
+        self.remote_store_paths = list(remote_store_paths)
         self.standing_order_name = standing_order_name
         self.known_staging_store = known_staging_store
         self.known_staging_subdir = known_staging_subdir
@@ -539,31 +743,102 @@ class UploaderTask(bgtasks.BackgroundTask):
         self.client_id = client_id
         self.transfer_token = transfer_token
         self.source_endpoint_id = source_endpoint_id
+        self.priority = priority
 
-        self.desc = "upload {}:{} to {}:{}".format(
-            store.name, store_path, conn_name, remote_store_path or "<any>"
-        )
+        if len(self.store_paths) == 1:
+            self.desc = "upload {}:{} to {}:{}".format(
+                store.name, self.store_paths[0], conn_name, self.remote_store_paths[0] or "<any>"
+            )
+        else:
+            self.desc = "upload {} files from {} to {}".format(
+                len(self.store_paths), store.name, conn_name
+            )
 
         if standing_order_name is not None:
             self.desc += ' (standing order "%s")' % standing_order_name
 
+    def to_payload(self):
+        return {
+            "store_name": self.store.name,
+            "conn_name": self.conn_name,
+            "rec_info": self.rec_info,
+            "store_paths": self.store_paths,
+            "remote_store_paths": self.remote_store_paths,
+            "standing_order_name": self.standing_order_name,
+            "known_staging_store": self.known_staging_store,
+            "known_staging_subdir": self.known_staging_subdir,
+        }
+
+    @classmethod
+    def from_payload(cls, payload):
+        store = Store.get_by_name(payload["store_name"])
+        use_globus, client_id, transfer_token, source_endpoint_id = _get_globus_settings()
+
+        # Jobs queued by older versions of the server carry just one file.
+        if "store_path" in payload:
+            store_paths = [payload["store_path"]]
+            remote_store_paths = [payload["remote_store_path"]]
+        else:
+            store_paths = payload["store_paths"]
+            remote_store_paths = payload["remote_store_paths"]
+
+        return cls(
+            store.convert_to_base_object(),
+            payload["conn_name"],
+            payload["rec_info"],
+            store_paths,
+            remote_store_paths,
+            payload["standing_order_name"],
+            known_staging_store=payload["known_staging_store"],
+            known_staging_subdir=payload["known_staging_subdir"],
+            use_globus=use_globus,
+            client_id=client_id,
+            transfer_token=transfer_token,
+            source_endpoint_id=source_endpoint_id,
+        )
+
     def thread_function(self):
+        """Returns a dict mapping the names of any files that the remote
+        Librarian failed to ingest to error messages. If the transfer failed
+        altogether, an exception is raised instead.
+
+        """
         import time
 
         self.t_start = time.time()
-        self.store.upload_file_to_other_librarian(
-            self.conn_name,
-            self.rec_info,
-            self.store_path,
-            self.remote_store_path,
-            known_staging_store=self.known_staging_store,
-            known_staging_subdir=self.known_staging_subdir,
-            use_globus=self.use_globus,
-            client_id=self.client_id,
-            transfer_token=self.transfer_token,
-            source_endpoint_id=self.source_endpoint_id,
-        )
+
+        if len(self.store_paths) == 1:
+            # Stick with the plain upload command for single files, so that we
+            # can still talk to Librarians that don't support batches.
+            self.store.upload_file_to_other_librarian(
+                self.conn_name,
+                self.rec_info,
+                self.store_paths[0],
+                self.remote_store_paths[0],
+                known_staging_store=self.known_staging_store,
+                known_staging_subdir=self.known_staging_subdir,
+                use_globus=self.use_globus,
+                client_id=self.client_id,
+                transfer_token=self.transfer_token,
+                source_endpoint_id=self.source_endpoint_id,
+            )
+            errors = {}
+        else:
+            errors = self.store.upload_files_to_other_librarian(
+                self.conn_name,
+                self.rec_info,
+                self.store_paths,
+                self.remote_store_paths,
+                known_staging_store=self.known_staging_store,
+                known_staging_subdir=self.known_staging_subdir,
+                use_globus=self.use_globus,
+                client_id=self.client_id,
+                transfer_token=self.transfer_token,
+                source_endpoint_id=self.source_endpoint_id,
+            )
+
         self.t_finish = time.time()
+        return errors
 
     def wrapup_function(self, retval, exc):
         # In principle, we might want different integer error codes if there are
@@ -571,64 +846,98 @@ class UploaderTask(bgtasks.BackgroundTask):
         # parsing the error messages. At the time being, we just use "1" to mean
         # that some exception happened. An "error" code of 0 always means success.
 
-        if exc is None:
-            logger.info(
-                "upload of %s:%s => %s:%s succeeded",
-                self.store.name,
-                self.store_path,
-                self.conn_name,
-                self.remote_store_path or self.store_path,
-            )
-            error_code = 0
-            error_message = "success"
-        else:
-            logger.warn(
-                "upload of %s:%s => %s:%s FAILED: %s",
-                self.store.name,
-                self.store_path,
-                self.conn_name,
-                self.remote_store_path or self.store_path,
-                exc,
-            )
-            error_code = 1
-            error_message = str(exc)
-
         from .file import File
 
-        file = File.query.get(os.path.basename(self.store_path))
+        names = [os.path.basename(p) for p in self.store_paths]
 
-        if error_code != 0:
-            dt = rate = None
+        if exc is None:
+            errors = retval
         else:
+            errors = {name: str(exc) for name in names}
+
+        files = {f.name: f for f in File.query.filter(File.name.in_(names))}
+
+        if len(errors) < len(names):
             dt = self.t_finish - self.t_start  # seconds
             dt_eff = max(dt, 0.5)  # avoid div-by-zero just in case
-            rate = file.size / (dt_eff * 1024.0)  # kilobytes/sec (AKA kB/s)
+            n_bytes = sum(f.size for f in files.values() if f.name not in errors)
+            rate = n_bytes / (dt_eff * 1024.0)  # kilobytes/sec (AKA kB/s)
+        else:
+            dt = rate = None
 
-            from . import mc_integration
+        storder = None
 
-            mc_integration.note_file_upload_succeeded(self.conn_name, file.size)
+        if self.standing_order_name is not None:
+            from .search import StandingOrder
 
-        db.session.add(
-            file.make_copy_finished_event(
-                self.conn_name,
-                self.remote_store_path,
-                error_code,
-                error_message,
-                duration=dt,
-                average_rate=rate,
-            )
-        )
+            storder = StandingOrder.query.filter(
+                StandingOrder.name == self.standing_order_name
+            ).first()
 
-        if self.standing_order_name is not None and error_code == 0:
-            # XXX keep this name synched with that in search.py:StandingOrder
-            _type = "standing_order_succeeded:" + self.standing_order_name
-            db.session.add(file.make_generic_event(_type))
+        from . import mc_integration
 
-        if error_code == 0:
+        for store_path, remote_store_path, name in zip(
+            self.store_paths, self.remote_store_paths, names
+        ):
+            file = files.get(name)
+            if file is None:
+                logger.warn("uploaded file %s has vanished from the database", name)
+                continue
+
+            error_message = errors.get(name)
+
+            if error_message is None:
+                logger.info(
+                    "upload of %s:%s => %s:%s succeeded",
+                    self.store.name,
+                    store_path,
+                    self.conn_name,
+                    remote_store_path or store_path,
+                )
+                mc_integration.note_file_upload_succeeded(self.conn_name, file.size)
+                record_event(
+                    file.make_copy_finished_event(
+                        self.conn_name,
+                        remote_store_path,
+                        0,
+                        "success",
+                        duration=dt,
+                        average_rate=rate,
+                    )
+                )
+            else:
+                logger.warn(
+                    "upload of %s:%s => %s:%s FAILED: %s",
+                    self.store.name,
+                    store_path,
+                    self.conn_name,
+                    remote_store_path or store_path,
+                    error_message,
+                )
+                record_event(
+                    file.make_copy_finished_event(
+                        self.conn_name, remote_store_path, 1, error_message
+                    )
+                )
+
+            if self.standing_order_name is not None:
+                if error_message is None:
+                    # This event is just an audit trail; the StandingOrderProgress
+                    # record is what the order actually looks at. XXX keep this
+                    # name synched with that in search.py:StandingOrder
+                    _type = "standing_order_succeeded:" + self.standing_order_name
+                    record_event(file.make_generic_event(_type))
+
+                    if storder is not None:
+                        storder.note_copy_succeeded(file.name)
+                elif storder is not None:
+                    storder.note_copy_failed(file.name, error_message)
+
+        if dt is not None:
             logger.info(
-                "transfer of %s:%s: duration %.1f s, average rate %.1f kB/s",
+                "transfer of %d file(s) from %s: duration %.1f s, average rate %.1f kB/s",
+                len(names) - len(errors),
                 self.store.name,
-                self.store_path,
                 dt,
                 rate,
             )
@@ -649,14 +958,15 @@ def launch_copy_by_file_name(
     no_instance="raise",
     known_staging_store=None,
     known_staging_subdir=None,
+    priority=bgtasks.TaskPriority.NORMAL,
 ):
     """Launch a copy of a file to a remote Librarian.
 
     A ServerError will be raised if no instance of the file is available.
 
-    The copy will be registered as a "background task" that the server will
-    execute in a separate thread. If the server crashes, information about the
-    background task will be lost.
+    The copy will be registered as a durable "background job" that one of the
+    server processes will execute in a separate thread. If the server crashes,
+    the job will be picked up again after it restarts.
 
     If `remote_store_path` is None, we request that the instance be located in
     whatever "store path" was used by the instance we locate.
@@ -671,6 +981,10 @@ def launch_copy_by_file_name(
     copied from one Librarian site to another outside of the Librarian
     framework.
 
+    `priority` is the TaskPriority class of the resulting background task.
+    Copies requested directly by users should be INTERACTIVE so that they
+    don't get stuck behind big backlogs of standing-order copies.
+
     """
     # Find a local instance of the file
 
@@ -694,33 +1008,23 @@ def launch_copy_by_file_name(
 
     rec_info = gather_records(file)
 
-    # Figure out if we should try to use globus or not
-    if app.config["use_globus"]:
-        source_endpoint_id = app.config.get("globus_endpoint_id", None)
-        try:
-            client_id = app.config["globus_client_id"]
-            transfer_token = app.config["globus_transfer_token"]
-            use_globus = True
-        except KeyError:
-            client_id = None
-            transfer_token = None
-            use_globus = False
-    else:
-        use_globus = False
-        client_id = None
-        transfer_token = None
-        source_endpoint_id = None
+    use_globus, client_id, transfer_token, source_endpoint_id = _get_globus_settings()
 
-    # Launch the background task. We need to convert the Store to a base object since
-    # the background task can't access the database.
+    # Failed standing-order copies are retried on the order's own backoff
+    # schedule, so the job queue shouldn't retry them on top of that.
+    max_attempts = 1 if standing_order_name is not None else None
+
+    # Queue the upload as a durable background job; it gets committed along
+    # with the copy-launched event below. We need to convert the Store to a
+    # base object since the background task can't access the database.
     basestore = inst.store_object.convert_to_base_object()
-    bgtasks.submit_background_task(
+    bgtasks.submit_durable_task(
         UploaderTask(
             basestore,
             connection_name,
             rec_info,
-            inst.store_path,
-            remote_store_path,
+            [inst.store_path],
+            [remote_store_path],
             standing_order_name,
             known_staging_store=known_staging_store,
             known_staging_subdir=known_staging_subdir,
@@ -728,11 +1032,22 @@ def launch_copy_by_file_name(
             client_id=client_id,
             transfer_token=transfer_token,
             source_endpoint_id=source_endpoint_id,
-        )
+            priority=priority,
+        ),
+        subject=file.name,
+        tag=standing_order_name,
+        max_attempts=max_attempts,
     )
 
     # Remember that we launched this copy.
-    db.session.add(file.make_copy_launched_event(connection_name, remote_store_path))
+    record_event(file.make_copy_launched_event(connection_name, remote_store_path))
+
+    if standing_order_name is not None:
+        from .search import StandingOrder
+
+        storder = StandingOrder.query.filter(StandingOrder.name == standing_order_name).first()
+        if storder is not None:
+            storder.note_copy_launched(file.name)
 
     try:
         db.session.commit()
@@ -742,6 +1057,96 @@ def launch_copy_by_file_name(
         raise ServerError("failed to commit copy-launch event to database")
 
 
+def launch_copies_by_file_names(
+    file_names, connection_name, standing_order_name=None, priority=bgtasks.TaskPriority.NORMAL
+):
+    """Launch copies of a group of files to a remote Librarian.
+
+    This is like `launch_copy_by_file_name`, but files that live on the same
+    local store are grouped into batches that are uploaded by a single
+    background job, up to the limit set by the "upload_batch_size"
+    configuration item. The files are always placed at the same "store
+    paths" as the local instances that we find.
+
+    Returns a list of the names of files for which no local instance is
+    available. Copies of these files are not launched.
+
+    """
+    from .file import File, FileInstance
+    from .misc import gather_records
+
+    batch_size = max(app.config.get("upload_batch_size", DEFAULT_UPLOAD_BATCH_SIZE), 1)
+
+    # Find one local instance of each file, grouped by store, since each
+    # batch is uploaded from one store.
+
+    file_names = sorted(set(file_names))
+    instances_by_store = {}
+    seen = set()
+
+    for inst in FileInstance.query.filter(FileInstance.name.in_(file_names)):
+        if inst.name in seen:
+            continue
+
+        seen.add(inst.name)
+        instances_by_store.setdefault(inst.store, []).append(inst)
+
+    use_globus, client_id, transfer_token, source_endpoint_id = _get_globus_settings()
+
+    # See launch_copy_by_file_name().
+    max_attempts = 1 if standing_order_name is not None else None
+
+    storder = None
+
+    if standing_order_name is not None:
+        from .search import StandingOrder
+
+        storder = StandingOrder.query.filter(StandingOrder.name == standing_order_name).first()
+
+    for instances in instances_by_store.values():
+        instances.sort(key=lambda i: i.name)
+        basestore = instances[0].store_object.convert_to_base_object()
+
+        for i in range(0, len(instances), batch_size):
+            batch = instances[i : i + batch_size]
+            files = File.query.filter(File.name.in_([inst.name for inst in batch])).all()
+            rec_info = gather_records(files)
+
+            bgtasks.submit_durable_task(
+                UploaderTask(
+                    basestore,
+                    connection_name,
+                    rec_info,
+                    [inst.store_path for inst in batch],
+                    None,
+                    standing_order_name,
+                    use_globus=use_globus,
+                    client_id=client_id,
+                    transfer_token=transfer_token,
+                    source_endpoint_id=source_endpoint_id,
+                    priority=priority,
+                ),
+                subject=batch[0].name,
+                tag=standing_order_name,
+                max_attempts=max_attempts,
+            )
+
+            for file in files:
+                record_event(file.make_copy_launched_event(connection_name, None))
+
+                if storder is not None:
+                    storder.note_copy_launched(file.name)
+
+    try:
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        app.log_exception(sys.exc_info())
+        raise ServerError("failed to commit copy-launch events to database")
+
+    return [name for name in file_names if name not in seen]
+
+
 @app.route("/api/launch_file_copy", methods=["GET", "POST"])
 @json_api
 def launch_file_copy(args, sourcename=None):
@@ -764,6 +1169,7 @@ def launch_file_copy(args, sourcename=None):
         remote_store_path,
         known_staging_store=known_staging_store,
         known_staging_subdir=known_staging_subdir,
+        priority=bgtasks.TaskPriority.INTERACTIVE,
     )
     return {}
 
@@ -787,6 +1193,8 @@ class OffloaderTask(bgtasks.BackgroundTask):
 
     """
 
+    pool = "local"
+
     def __init__(self, source_store, dest_store, staging_dir, instance_info):
         self.source_store = source_store
         self.dest_store = dest_store
@@ -875,7 +1283,7 @@ class OffloaderTask(bgtasks.BackgroundTask):
 
             logger.info('offloader: marking "%s" for deletion', source_inst.descriptive_name())
             source_inst.deletion_policy = DeletionPolicy.ALLOWED
-            db.session.add(
+            record_event(
                 source_inst.file.make_generic_event(
                     "instance_deletion_policy_changed",
                     store_name=source_inst.store_object.name,
@@ -14,6 +14,8 @@ import os
 import sys
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import BigInteger
+from sqlalchemy.ext.compiler import compiles
 
 _log_level_names = {
     "debug": logging.DEBUG,
@@ -68,3 +70,72 @@ def db_connection():
     app.testing = True
     db = SQLAlchemy(app)
     return logger, app, db
+
+
+@compiles(BigInteger, "sqlite")
+def _compile_sqlite_big_integer(type_, compiler, **kw):
+    # SQLite only autoincrements primary keys declared as exactly "INTEGER",
+    # so our BigInteger keys need to be created that way in the test database.
+    return "INTEGER"
+
+
+SCRATCH_SCHEMA = "librarian_test_scratch"
+
+
+def _scratch_engine(engine, tmp_dir):
+    """Make an engine for a scratch database that's separate from the one
+    that `engine` uses: a new file for SQLite, or a dedicated schema in the
+    same database for PostgreSQL. Returns `(scratch_engine, cleanup)`.
+
+    """
+    from sqlalchemy import create_engine
+
+    if engine.dialect.name == "sqlite":
+        scratch = create_engine("sqlite:///" + str(tmp_dir / "librarian.sqlite"))
+        return scratch, lambda conn: None
+
+    if engine.dialect.name == "postgresql":
+        # Extensions such as pg_trgm live in the public schema, so we keep it
+        # on the search path after our own.
+        scratch = create_engine(
+            engine.url, connect_args={"options": f"-csearch_path={SCRATCH_SCHEMA},public"}
+        )
+
+        with scratch.begin() as conn:
+            conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCRATCH_SCHEMA} CASCADE")
+            conn.exec_driver_sql(f"CREATE SCHEMA {SCRATCH_SCHEMA}")
+
+        def cleanup(conn):
+            conn.exec_driver_sql(f"DROP SCHEMA {SCRATCH_SCHEMA} CASCADE")
+
+        return scratch, cleanup
+
+    pytest.skip(f"the server tests don't support {engine.dialect.name} databases")
+
+
+@pytest.fixture()
+def librarian_db(tmp_path_factory):
+    """Provide the main server app and database, with freshly created tables.
+
+    The database isn't the configured one, which is left alone: it's a
+    scratch database built just for the test, and thrown away afterwards.
+
+    """
+    from librarian_server import app, db
+
+    with app.app_context():
+        engine = db.engines[None]
+        scratch, cleanup = _scratch_engine(engine, tmp_path_factory.mktemp("db"))
+        db.engines[None] = scratch
+
+        try:
+            db.create_all()
+            yield app, db
+        finally:
+            db.session.remove()
+
+            with scratch.begin() as conn:
+                cleanup(conn)
+
+            scratch.dispose()
+            db.engines[None] = engine
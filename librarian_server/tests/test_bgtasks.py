@@ -0,0 +1,263 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License
+
+"""Test code in librarian_server/bgtasks.py
+
+"""
+
+
+import pytest
+
+import datetime
+import threading
+import time
+
+from librarian_server import bgtasks
+from librarian_server.bgtasks import TaskPriority
+
+
+class FakeIOLoop:
+    """Stand-in for the Tornado IOLoop that just remembers its callbacks."""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add_callback(self, func, *args):
+        self.callbacks.append((func, args))
+
+
+class RecordingTask(bgtasks.BackgroundTask):
+    def __init__(self, name, priority, record, gate=None):
+        self.desc = name
+        self.priority = priority
+        self.record = record
+        self.gate = gate
+
+    def thread_function(self):
+        if self.gate is not None:
+            self.gate.wait()
+        self.record.append(self.desc)
+
+
+def _submit(pool, task, submit_time):
+    task.submit_time = submit_time
+    pool.submit(task)
+
+
+def test_task_priority():
+    assert TaskPriority.textualize(TaskPriority.INTERACTIVE) == "interactive"
+    assert TaskPriority.textualize(TaskPriority.BULK) == "bulk"
+
+    with pytest.raises(AssertionError):
+        TaskPriority()
+
+
+def test_sort_key_aging():
+    record = []
+    bulk = RecordingTask("bulk", TaskPriority.BULK, record)
+    interactive = RecordingTask("interactive", TaskPriority.INTERACTIVE, record)
+
+    bulk.submit_time = 1000.0
+    interactive.submit_time = 1000.0
+    assert bgtasks._task_sort_key(interactive) < bgtasks._task_sort_key(bulk)
+
+    # A bulk task that has been waiting long enough beats fresh interactive work.
+    interactive.submit_time = 1000.0 + 2 * bgtasks.PRIORITY_AGING_TIME + 1
+    assert bgtasks._task_sort_key(bulk) < bgtasks._task_sort_key(interactive)
+
+
+def test_worker_pool_dispatch_order():
+    ioloop = FakeIOLoop()
+    pool = bgtasks.WorkerPool("test", 1, ioloop)
+    record = []
+    gate = threading.Event()
+
+    # Occupy the only worker thread so that everything else queues up.
+    _submit(pool, RecordingTask("blocker", TaskPriority.NORMAL, record, gate), 0.0)
+    while pool.n_active == 0:
+        time.sleep(0.01)
+
+    _submit(pool, RecordingTask("bulk", TaskPriority.BULK, record), 1.0)
+    _submit(pool, RecordingTask("normal", TaskPriority.NORMAL, record), 2.0)
+    _submit(pool, RecordingTask("interactive", TaskPriority.INTERACTIVE, record), 3.0)
+    gate.set()
+    pool.close_and_join()
+
+    assert record == ["blocker", "interactive", "normal", "bulk"]
+    assert len(ioloop.callbacks) == 4
+    assert pool.n_active == 0
+    assert pool.n_pending == 0
+
+    with pytest.raises(RuntimeError):
+        pool.submit(RecordingTask("late", TaskPriority.NORMAL, record))
+
+
+@bgtasks.durable_task
+class EchoTask(bgtasks.BackgroundTask):
+    kind = "test_echo"
+
+    def __init__(self, message, fail=False):
+        self.message = message
+        self.fail = fail
+        self.desc = "echo " + message
+
+    def to_payload(self):
+        return {"message": self.message, "fail": self.fail}
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(payload["message"], fail=payload["fail"])
+
+    def thread_function(self):
+        if self.fail:
+            raise Exception(self.message)
+        return self.message
+
+    def wrapup_function(self, retval, exc):
+        pass
+
+
+def _make_poller():
+    manager = bgtasks.TaskManager()
+    ioloop = FakeIOLoop()
+    manager.pools["default"] = bgtasks.WorkerPool("default", 2, ioloop)
+    return bgtasks.JobPoller(manager), ioloop
+
+
+def _run_claimed_tasks(poller, ioloop):
+    """Run everything that the poller claimed and record the outcomes."""
+    poller.manager.pools["default"].close_and_join()
+
+    for _func, args in ioloop.callbacks:
+        task = args[0]
+        task.wrapup_function(args[1], args[2])
+        poller.record_outcome(task)
+
+
+def test_durable_job_lifecycle(librarian_db):
+    app, db = librarian_db
+    job = bgtasks.submit_durable_task(EchoTask("hello"), subject="zen.2458000.uv", tag="test")
+    db.session.commit()
+    assert job.state == "pending"
+
+    poller, ioloop = _make_poller()
+    poller.poll()
+    db.session.refresh(job)
+    assert job.state == "running"
+    assert job.attempts == 1
+    assert job.lease_owner == poller.owner
+
+    # Another process shouldn't be able to claim the same job.
+    other, other_ioloop = _make_poller()
+    other.poll()
+    assert not len(other.in_flight)
+
+    _run_claimed_tasks(poller, ioloop)
+    db.session.refresh(job)
+    assert job.state == "done"
+    assert job.lease_owner is None
+    assert job.finish_time is not None
+    assert bgtasks.get_job_state_counts() == {"done": 1}
+
+
+def test_durable_job_retries(librarian_db):
+    app, db = librarian_db
+    job = bgtasks.submit_durable_task(EchoTask("oops", fail=True), max_attempts=2)
+    db.session.commit()
+
+    poller, ioloop = _make_poller()
+    poller.poll()
+    _run_claimed_tasks(poller, ioloop)
+    db.session.refresh(job)
+    assert job.state == "pending"
+    assert job.result == "oops"
+    assert job.not_before is not None
+
+    # Skip the retry delay; the second failure exhausts the attempts.
+    job.not_before = None
+    db.session.commit()
+    poller, ioloop = _make_poller()
+    poller.poll()
+    _run_claimed_tasks(poller, ioloop)
+    db.session.refresh(job)
+    assert job.state == "failed"
+    assert job.attempts == 2
+
+
+def test_durable_job_lease_recovery(librarian_db):
+    app, db = librarian_db
+    job = bgtasks.submit_durable_task(EchoTask("orphan"))
+    db.session.commit()
+
+    crashed, crashed_ioloop = _make_poller()
+    crashed.poll()
+
+    # The first process "dies": its lease runs out without being renewed.
+    db.session.refresh(job)
+    job.lease_expires = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    db.session.commit()
+
+    survivor, ioloop = _make_poller()
+    survivor.poll()
+    db.session.refresh(job)
+    assert job.state == "running"
+    assert job.attempts == 2
+    assert job.lease_owner == survivor.owner
+
+    _run_claimed_tasks(survivor, ioloop)
+    db.session.refresh(job)
+    assert job.state == "done"
+
+    # The dead process's outcome mustn't clobber the real one.
+    crashed.manager.pools["default"].close_and_join()
+    crashed.record_outcome(crashed_ioloop.callbacks[0][1][0])
+    db.session.refresh(job)
+    assert job.state == "done"
+
+
+def _wait_for(job):
+    while job.running:
+        time.sleep(0.01)
+
+
+def test_periodic_job_overlap():
+    gate = threading.Event()
+    runs = []
+
+    def func():
+        gate.wait()
+        runs.append(1)
+
+    job = bgtasks.PeriodicJob("test", func)
+    assert job.trigger()
+    assert not job.trigger()  # still running
+    gate.set()
+    _wait_for(job)
+
+    assert runs == [1]
+    assert job.n_runs == 1
+    assert job.n_skipped == 1
+    assert job.last_status == "success"
+    assert job.last_duration >= 0
+
+
+def test_periodic_job_coalesce_and_failure():
+    gate = threading.Event()
+    runs = []
+
+    def func():
+        gate.wait()
+        runs.append(1)
+        raise Exception("boom")
+
+    job = bgtasks.PeriodicJob("test", func, coalesce=True)
+    assert job.trigger()
+    assert not job.trigger()
+    assert not job.trigger()  # multiple triggers coalesce into one rerun
+    gate.set()
+    _wait_for(job)
+
+    assert runs == [1, 1]
+    assert job.n_runs == 2
+    assert job.n_skipped == 0
+    assert job.last_status == "boom"
@@ -0,0 +1,95 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License
+
+"""Test code in librarian_server/dbutil.py
+
+"""
+
+
+import pytest
+
+from librarian_server import dbutil
+
+
+@pytest.fixture()
+def file_watcher():
+    from librarian_server.file import File
+
+    seen = []
+    watcher = (File, "name", seen.append)
+    dbutil._watchers.append(watcher)
+    yield seen
+    dbutil._watchers.remove(watcher)
+
+
+def _make_file(name):
+    from librarian_server.file import File
+
+    return File(name, "uv", None, "test", 1024, "d41d8cd98f00b204e9800998ecf8427e")
+
+
+def test_watch_new_objects(librarian_db, file_watcher):
+    app, db = librarian_db
+
+    db.session.add(_make_file("zen.a.uv"))
+    db.session.flush()
+    db.session.add(_make_file("zen.b.uv"))
+    assert file_watcher == []  # nothing until commit
+
+    db.session.commit()
+    assert file_watcher == [{"zen.a.uv", "zen.b.uv"}]
+
+    # Rolled-back objects aren't reported.
+    db.session.add(_make_file("zen.c.uv"))
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+    assert len(file_watcher) == 1
+
+
+def test_watch_new_objects_savepoint(librarian_db, file_watcher):
+    from sqlalchemy.exc import IntegrityError
+
+    app, db = librarian_db
+
+    db.session.add(_make_file("zen.a.uv"))
+    db.session.flush()
+
+    # Rolling back a savepoint doesn't forget the objects flushed before it.
+    def add_duplicate():
+        with db.session.begin_nested():
+            db.session.add(_make_file("zen.a.uv"))
+
+    with pytest.raises(IntegrityError):
+        add_duplicate()
+
+    db.session.commit()
+    assert file_watcher == [{"zen.a.uv"}]
+
+
+def test_note_new_keys(librarian_db, file_watcher):
+    from librarian_server.file import File
+
+    app, db = librarian_db
+
+    dbutil.note_new_keys(File, ["zen.d.uv"])
+    db.session.commit()
+    assert file_watcher == [{"zen.d.uv"}]
+
+
+def test_insert_missing_rows(librarian_db):
+    from librarian_server.file import FileNamePrefix
+
+    app, db = librarian_db
+    table = FileNamePrefix.__table__
+    db.session.add(FileNamePrefix("zen.1.2", 1000))
+    db.session.commit()
+
+    rows = [
+        dict(prefix="zen.1.2", obsid=1001, conflicted=False),
+        dict(prefix="zen.1.3", obsid=1002, conflicted=False),
+    ]
+    dbutil.insert_missing_rows(db.session.connection(), table, rows)
+    dbutil.insert_missing_rows(db.session.connection(), table, [])
+    db.session.commit()
+    assert {p.prefix: p.obsid for p in FileNamePrefix.query} == {"zen.1.2": 1000, "zen.1.3": 1002}
@@ -0,0 +1,81 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License
+
+"""Test code in librarian_server/file.py
+
+"""
+
+
+import pytest
+
+from librarian_server import file
+from librarian_server.webutil import ServerError
+
+MD5 = "d41d8cd98f00b204e9800998ecf8427e"
+
+
+def test_hera_name_prefix():
+    assert file.hera_name_prefix("zen.2458000.12345.xx.uvh5") == "zen.2458000.12345"
+    assert file.hera_name_prefix("zen.2458000.uvh5") is None
+
+
+def test_file_name_prefix(librarian_db):
+    from librarian_server.observation import Observation
+
+    app, db = librarian_db
+    db.session.add(Observation(1000, 2458000.2, 2458000.21, 1.0))
+    db.session.add(Observation(1001, 2458000.3, 2458000.31, 1.0))
+    db.session.add(file.File("zen.2458000.12345.xx.uv", "uv", 1000, "test", 1, MD5))
+    db.session.add(file.File("zen.2458000.23456.xx.uv", "uv", 1000, "test", 1, MD5))
+    db.session.add(file.File("README", "txt", None, "test", 1, MD5))
+    db.session.commit()
+
+    assert {p.prefix: p.obsid for p in file.FileNamePrefix.query} == {
+        "zen.2458000.12345": 1000,
+        "zen.2458000.23456": 1000,
+    }
+    assert file.infer_file_obsid(None, "zen.2458000.12345.yy.uv", None) == 1000
+
+    with pytest.raises(ServerError, match="got 0 candidate"):
+        file.infer_file_obsid(None, "zen.2458001.12345.yy.uv", None)
+
+    # A file with a different obsid poisons the prefix.
+    db.session.add(file.File("zen.2458000.23456.yy.uv", "uv", 1001, "test", 1, MD5))
+    db.session.commit()
+    assert file.FileNamePrefix.query.get("zen.2458000.23456").conflicted
+
+    with pytest.raises(ServerError, match="got 2 candidate"):
+        file.infer_file_obsid(None, "zen.2458000.23456.xy.uv", None)
+
+
+def test_file_name_prefix_added_elsewhere(librarian_db):
+    from sqlalchemy import insert
+
+    app, db = librarian_db
+
+    # Another process adds the prefix with a different obsid before we commit.
+    db.session.add(file.File("zen.2458000.12345.xx.uv", "uv", None, "test", 1, MD5))
+
+    with db.engine.begin() as conn:
+        conn.execute(
+            insert(file.FileNamePrefix.__table__),
+            dict(prefix="zen.2458000.12345", obsid=1000, conflicted=False),
+        )
+
+    db.session.commit()
+    row = file.FileNamePrefix.query.get("zen.2458000.12345")
+    assert row.obsid == 1000
+    assert row.conflicted
+
+
+def test_obsid_inferrer_batch(librarian_db):
+    app, db = librarian_db
+    inferrer = file.ObsidInferrer()
+
+    # Files earlier in a batch count as candidates for later ones.
+    inferrer.note_file("zen.2458000.12345.xx.uv", 1000)
+    assert inferrer.infer("zen.2458000.12345.yy.uv") == 1000
+
+    inferrer.note_file("zen.2458000.12345.xy.uv", None)
+    with pytest.raises(ServerError):
+        inferrer.infer("zen.2458000.12345.yx.uv")
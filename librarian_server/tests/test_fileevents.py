@@ -0,0 +1,306 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License
+
+"""Test code in librarian_server/fileevents.py"""
+
+import pytest
+
+import datetime
+import gzip
+import json
+
+from librarian_server import fileevents
+
+MD5 = "d41d8cd98f00b204e9800998ecf8427e"
+NOW = datetime.datetime(2026, 10, 1)
+
+
+@pytest.fixture()
+def events(librarian_db, tmp_path, monkeypatch):
+    from librarian_server.file import File, FileEvent
+
+    app, db = librarian_db
+    monkeypatch.setitem(app.config, "file_event_retention_days", 30)
+    monkeypatch.setitem(app.config, "file_event_archive_dir", str(tmp_path))
+    db.session.add(File("a.uv", "uv", None, "test", 1024, MD5))
+    db.session.flush()
+
+    for days_ago, tp in [
+        (100, "create_instance"),
+        (90, "standing_order_succeeded:offsite"),
+        (60, "nrao_notified"),
+        (40, "create_instance"),
+        (10, "create_instance"),
+    ]:
+        event = FileEvent("a.uv", tp, {"days_ago": days_ago})
+        event.time = NOW - datetime.timedelta(days=days_ago)
+        db.session.add(event)
+
+    db.session.commit()
+    return app, db, tmp_path
+
+
+def test_archive(events, monkeypatch):
+    from librarian_server.file import FileEvent
+
+    app, db, archive_dir = events
+    monkeypatch.setattr(fileevents, "ARCHIVE_BATCH_SIZE", 2)
+    assert fileevents.archive_file_events(now=NOW) == 3
+
+    remaining = sorted((e.type, e.payload_json["days_ago"]) for e in FileEvent.query)
+    assert remaining == [("create_instance", 10), ("nrao_notified", 60)]
+
+    archived = []
+    for path in sorted(archive_dir.iterdir()):
+        assert path.name.endswith(".jsonl.gz")
+        with gzip.open(path, "rt") as f:
+            archived += [json.loads(line) for line in f]
+    assert [json.loads(e["payload"])["days_ago"] for e in archived] == [100, 90, 40]
+    assert archived[0]["name"] == "a.uv"
+
+    # Nothing more to do the second time around.
+    assert fileevents.archive_file_events(now=NOW) == 0
+
+    monkeypatch.setitem(app.config, "file_event_archive_types", ["nrao_*"])
+    assert fileevents.archive_file_events(now=NOW) == 1
+
+
+def test_summary(events):
+    app, db, _ = events
+    fileevents.archive_file_events(now=NOW)
+
+    reply = app.test_client().post(
+        "/api/file_event_summary", data={"request": json.dumps({"authenticator": "I am a bot"})}
+    )
+    summary = {item["type"]: item for item in reply.get_json()["types"]}
+    assert len(summary) == 3
+
+    item = summary["create_instance"]
+    assert (item["count"], item["num_archived"]) == (3, 2)
+    assert item["last_time"] - item["first_time"] == 90 * 86400
+    assert summary["nrao_notified"]["num_archived"] == 0
+
+
+def test_archiving_disabled(events, monkeypatch):
+    app, db, archive_dir = events
+    monkeypatch.delitem(app.config, "file_event_retention_days")
+    assert fileevents.archive_file_events(now=NOW) == 0
+    assert not list(archive_dir.iterdir())
+
+
+def test_month_partitions():
+    parts = list(
+        fileevents._month_partitions(
+            datetime.datetime(2025, 11, 15, 12), datetime.datetime(2026, 2, 1)
+        )
+    )
+    assert [p[0] for p in parts] == [
+        "file_event_y2025m11",
+        "file_event_y2025m12",
+        "file_event_y2026m01",
+        "file_event_y2026m02",
+    ]
+    assert parts[1][1:] == (datetime.datetime(2025, 12, 1), datetime.datetime(2026, 1, 1))
+    ahead = fileevents._months_ahead(datetime.datetime(2026, 11, 20))
+    assert ahead == datetime.datetime(2027, 2, 1)
+
+
+def test_partitioning_needs_postgresql(librarian_db):
+    from librarian_server.webutil import ServerError
+
+    app, db = librarian_db
+    if db.engine.dialect.name == "postgresql":
+        pytest.skip("partitioning is supported with PostgreSQL")
+
+    with pytest.raises(ServerError, match="only be partitioned with PostgreSQL"):
+        fileevents.partition_file_events()
+
+    assert fileevents.ensure_partitions() == 0
+
+
+def test_partitioning(events):
+    from librarian_server.file import FileEvent
+    from librarian_server.webutil import ServerError
+
+    app, db, archive_dir = events
+    if db.engine.dialect.name != "postgresql":
+        pytest.skip("file events can only be partitioned with PostgreSQL")
+
+    # The oldest event is from June, and we go three months ahead.
+    assert fileevents.partition_file_events(now=NOW) == 8
+    assert FileEvent.query.count() == 5
+
+    with pytest.raises(ServerError, match="already partitioned"):
+        fileevents.partition_file_events(now=NOW)
+
+    event = FileEvent("a.uv", "create_instance", {"days_ago": 0})
+    event.time = NOW
+    db.session.add(event)
+    db.session.commit()
+    assert fileevents.archive_file_events(now=NOW) == 3
+    assert sorted(e.payload_json["days_ago"] for e in FileEvent.query) == [0, 10, 60]
+
+    later = datetime.datetime(2027, 3, 15)
+    assert fileevents.ensure_partitions(now=later) == 4
+    assert fileevents.ensure_partitions(now=later) == 0
+
+
+@pytest.fixture()
+def buffered(librarian_db, monkeypatch):
+    from librarian_server.file import File
+
+    app, db = librarian_db
+    monkeypatch.setitem(app.config, "file_event_buffer_rows", 3)
+    monkeypatch.setattr(fileevents, "_buffer", [])
+    monkeypatch.setattr(fileevents, "_buffer_started", True)
+    db.session.add(File("a.uv", "uv", None, "test", 1024, MD5))
+    db.session.commit()
+    yield app, db
+    db.session.remove()
+    del fileevents._buffer[:]
+
+
+def _pending(db):
+    return db.session.info.get("fileevents_pending", [])
+
+
+def _count_saved_events(db):
+    # Use a separate connection, which doesn't flush the buffer.
+    with db.engine.connect() as conn:
+        return conn.exec_driver_sql("SELECT COUNT(*) FROM file_event").scalar()
+
+
+def _record(n):
+    from librarian_server.file import FileEvent
+
+    for i in range(n):
+        fileevents.record_event(FileEvent("a.uv", "test", {"i": i}))
+
+
+def test_unbuffered(librarian_db):
+    from librarian_server.file import File, FileEvent
+
+    app, db = librarian_db
+    db.session.add(File("a.uv", "uv", None, "test", 1024, MD5))
+    _record(1)
+    assert len(db.session.new) == 2
+    db.session.commit()
+    assert FileEvent.query.count() == 1
+
+
+def test_buffer_not_started(librarian_db, monkeypatch):
+    from librarian_server.file import File
+
+    app, db = librarian_db
+    monkeypatch.setitem(app.config, "file_event_buffer_rows", 3)
+    monkeypatch.setattr(fileevents, "_buffer", [])
+    db.session.add(File("a.uv", "uv", None, "test", 1024, MD5))
+    _record(1)
+    assert not len(fileevents._buffer)
+    assert len(db.session.new) == 2
+
+
+def test_client_events_unbuffered(buffered):
+    app, db = buffered
+    request = json.dumps(
+        dict(authenticator="I am a bot", file_name="a.uv", type="note", payload={"x": 1})
+    )
+    reply = app.test_client().post("/api/create_file_event", data={"request": request})
+    assert reply.get_json()["success"]
+    assert not len(fileevents._buffer)
+    assert _count_saved_events(db) == 1
+
+
+def test_buffer_fills(buffered):
+    app, db = buffered
+    _record(2)
+    assert len(_pending(db)) == 2
+    assert not len(fileevents._buffer)
+    db.session.commit()
+    assert len(fileevents._buffer) == 2
+    assert _count_saved_events(db) == 0
+
+    _record(1)
+    assert len(fileevents._buffer) == 2
+    db.session.commit()
+    assert not len(fileevents._buffer)
+    assert _count_saved_events(db) == 3
+
+
+def test_read_your_writes(buffered):
+    from librarian_server import search
+    from librarian_server.file import File, FileEvent
+
+    app, db = buffered
+    _record(1)
+    assert FileEvent.query.filter(FileEvent.name == "a.uv").count() == 1
+    assert not len(fileevents._buffer)
+
+    # Queries where the events are only in a subquery count too, as do
+    # relationship loads.
+    _record(1)
+    q = search.compile_search('{"no-file-has-event": "test"}', "sessions")
+    q.all()
+    assert not len(fileevents._buffer)
+
+    _record(1)
+    db.session.expire_all()
+    assert len(File.query.get("a.uv").events) == 3
+
+    # Other queries don't force a flush.
+    _record(1)
+    File.query.all()
+    assert len(_pending(db)) == 1
+
+
+def test_rollback_drops(buffered):
+    app, db = buffered
+    _record(1)
+    db.session.rollback()
+    assert not len(_pending(db))
+    db.session.commit()
+    assert not len(fileevents._buffer)
+
+    _record(1)
+    fileevents.flush_events()
+    db.session.rollback()
+    assert not len(fileevents._buffer)
+
+
+def test_savepoint_rollback(buffered):
+    app, db = buffered
+    _record(1)
+    savepoint = db.session.begin_nested()
+    _record(2)
+    savepoint.rollback()
+    assert len(_pending(db)) == 1
+
+    # An event recorded outside the savepoint that was written inside it
+    # survives.
+    savepoint = db.session.begin_nested()
+    assert fileevents.flush_events() == 1
+    savepoint.rollback()
+    assert len(_pending(db)) == 1
+    db.session.commit()
+    assert len(fileevents._buffer) == 1
+
+
+def test_rollback_requeues(buffered):
+    app, db = buffered
+    fileevents._buffer.append(dict(name="a.uv", time=NOW, type="test", payload="{}"))
+    assert fileevents.flush_events() == 1
+    db.session.rollback()
+    assert len(fileevents._buffer) == 1
+
+    fileevents._flush_in_background()
+    assert not len(fileevents._buffer)
+    assert _count_saved_events(db) == 1
+
+
+def test_bad_events_dropped(buffered):
+    app, db = buffered
+    good = dict(name="a.uv", time=NOW, type="test", payload="{}")
+    fileevents._buffer[:] = [good, dict(good, time=None), good]
+    fileevents._flush_in_background()
+    assert not len(fileevents._buffer)
+    assert _count_saved_events(db) == 2
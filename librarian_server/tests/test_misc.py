@@ -0,0 +1,68 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License
+
+"""Test code in librarian_server/misc.py
+
+"""
+
+
+from librarian_server import misc
+
+
+def _make_records(db):
+    from librarian_server.file import File
+    from librarian_server.observation import Observation, ObservingSession
+
+    sess = ObservingSession(1, 2458000.1, 2458000.5)
+    obs = Observation(1000, 2458000.2, 2458000.21, 1.0)
+    obs.session_id = 1
+    db.session.add_all([sess, obs])
+
+    files = [
+        File("zen.%d.uv" % i, "uv", 1000, "test", 1024, "d41d8cd98f00b204e9800998ecf8427e")
+        for i in range(3)
+    ]
+    files.append(File("maint.txt", "txt", None, "test", 10, "d41d8cd98f00b204e9800998ecf8427e"))
+    db.session.add_all(files)
+    db.session.commit()
+    return files
+
+
+def test_gather_records(librarian_db):
+    app, db = librarian_db
+    files = _make_records(db)
+
+    info = misc.gather_records(files)
+    assert sorted(info["files"]) == ["maint.txt", "zen.0.uv", "zen.1.uv", "zen.2.uv"]
+    assert list(info["observations"]) == [1000]
+    assert list(info["sessions"]) == [1]
+
+    # A single file is OK too.
+    info = misc.gather_records(files[-1])
+    assert list(info["files"]) == ["maint.txt"]
+    assert "observations" not in info
+
+
+def test_create_records(librarian_db):
+    import json
+
+    from librarian_server.file import File
+    from librarian_server.observation import Observation
+
+    app, db = librarian_db
+    files = _make_records(db)
+
+    # Simulate records coming from another Librarian: some of them are new,
+    # and some we already have. Round-trip through JSON like the API does.
+    info = misc.gather_records(files)
+    info["files"]["zen.3.uv"] = dict(info["files"]["zen.0.uv"], name="zen.3.uv")
+    info["observations"][1000]["stop_time_jd"] = 2458000.22
+    info = json.loads(json.dumps(info))
+
+    misc.create_records(info, "elsewhere")
+    db.session.expire_all()
+
+    assert File.query.count() == 5
+    assert File.query.get("zen.3.uv").source == "elsewhere"
+    assert File.query.get("zen.0.uv").source == "test"
+    assert Observation.query.get(1000).stop_time_jd == 2458000.22
@@ -0,0 +1,172 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License
+
+"""Test code in librarian_server/observation.py
+
+"""
+
+
+import pytest
+
+import datetime
+import numpy as np
+
+from librarian_server import observation
+from librarian_server.webutil import ServerError
+
+
+def _legacy_segments(start_jds, gap_tol=observation.SESSION_GAP_TOLERANCE):
+    """The original one-observation-at-a-time session segmentation."""
+    djds = np.diff(start_jds)
+    segments = []
+    i0 = 0
+
+    while i0 < len(start_jds):
+        if i0 == len(start_jds) - 1:
+            segments.append((i0, i0 + 1))
+            break
+
+        gap = np.clip(djds[i0] * gap_tol, observation.MIN_SESSION_GAP, observation.MAX_SESSION_GAP)
+        i1 = i0 + 1
+        while i1 < len(start_jds) and start_jds[i1] - start_jds[i1 - 1] < gap:
+            i1 += 1
+
+        segments.append((i0, i1))
+        i0 = i1
+
+    return segments
+
+
+def test_segment_sessions():
+    assert observation._segment_sessions([]) == []
+    assert observation._segment_sessions([2458000.1]) == [(0, 1)]
+
+    # Two nights of 10-minute observations, the second interrupted by an
+    # hour-long break that's short of the gap tolerance, plus a stray.
+    night1 = 2458000.1 + np.arange(50) / 144
+    night2 = 2458001.1 + np.concatenate((np.arange(20), 26 + np.arange(20))) / 144
+    starts = np.concatenate((night1, night2, [2458003.0]))
+    assert observation._segment_sessions(starts) == [(0, 50), (50, 90), (90, 91)]
+
+    rng = np.random.default_rng(1234)
+
+    for _ in range(20):
+        gaps = rng.choice([1.0 / 144, 0.1, 1.0, 1e-5], size=200, p=[0.85, 0.05, 0.05, 0.05])
+        starts = 2458000.0 + np.cumsum(gaps)
+        assert observation._segment_sessions(starts) == _legacy_segments(starts)
+
+
+def test_assign_sessions(librarian_db):
+    app, db = librarian_db
+    from librarian_server.observation import Observation, ObservingSession
+
+    # A preexisting session, with one observation inside it and one that
+    # overruns it.
+    db.session.add(ObservingSession(1, 2458000.0, 2458000.5))
+    obs = [
+        Observation(1, 2458000.1, 2458000.11, 1.0),
+        Observation(2, 2458000.45, 2458000.55, 1.0),
+        Observation(3, 2458000.46, 2458000.56, 1.0),
+        Observation(10, 2458002.1, 2458002.11, 1.0),
+        Observation(11, 2458002.11, 2458002.12, 1.0),
+    ]
+    db.session.add_all(obs)
+    db.session.commit()
+
+    new_info = observation.assign_sessions()
+    assert [(i["id"], i["n_obs"]) for i in new_info] == [(2, 2), (10, 2)]
+    assert new_info[0]["stop_time_jd"] == 2458000.56
+
+    assert [o.session_id for o in Observation.query.order_by(Observation.obsid)] == [
+        1,
+        2,
+        2,
+        10,
+        10,
+    ]
+    assert ObservingSession.query.count() == 3
+    db.session.expire_all()
+    assert [s.num_obs for s in ObservingSession.query.order_by(ObservingSession.id)] == [1, 2, 2]
+
+    # Nothing left to do.
+    assert observation.assign_sessions() == []
+
+
+def test_assign_sessions_overlapping(librarian_db):
+    app, db = librarian_db
+    from librarian_server.observation import Observation, ObservingSession
+
+    # An observation inside the earlier of two overlapping sessions, but
+    # starting after the later one does.
+    db.session.add(ObservingSession(1, 2458000.0, 2458000.5))
+    db.session.add(ObservingSession(2, 2458000.45, 2458000.46))
+    db.session.add(Observation(3, 2458000.47, 2458000.48, 1.0))
+    db.session.commit()
+
+    assert observation.assign_sessions() == []
+    assert Observation.query.get(3).session_id == 1
+
+
+def test_assign_sessions_needs_stop_times(librarian_db):
+    app, db = librarian_db
+    from librarian_server.observation import Observation, ObservingSession
+
+    db.session.add(Observation(1, 2458000.1, None, 1.0))
+    db.session.commit()
+
+    with pytest.raises(ServerError):
+        observation.assign_sessions()
+
+    assert ObservingSession.query.count() == 0
+
+
+def test_attach_to_session(librarian_db, monkeypatch):
+    app, db = librarian_db
+    from librarian_server.observation import Observation, ObservingSession
+
+    def add_obs(obsid, start):
+        obs = Observation(obsid, start, start + 0.007, 1.0)
+        db.session.add(obs)
+        sess = observation.attach_to_session(obs)
+        db.session.commit()
+        return sess.id if sess is not None else None
+
+    # Nothing happens unless we're configured to do it.
+    assert add_obs(1, 2458000.1) is None
+
+    monkeypatch.setitem(app.config, "session_assignment_mode", "incremental")
+    assert add_obs(2, 2458000.2) == 2
+    assert add_obs(3, 2458000.207) == 2
+    assert add_obs(4, 2458000.214) == 2
+    assert add_obs(5, 2458000.3) == 2  # within 20 times the first gap
+    assert add_obs(6, 2458000.5) == 6  # beyond it
+
+    sess = ObservingSession.query.get(2)
+    assert sess.stop_time_jd == 2458000.307
+    assert sess.is_open
+
+    # Late arrivals within a session are always accepted, but once a session
+    # has closed it won't be extended.
+    assert add_obs(7, 2458000.25) == 2
+    sess = ObservingSession.query.get(6)
+    sess.open_until = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    db.session.commit()
+    assert add_obs(8, 2458000.51) == 8
+
+
+def test_create_records_attaches_sessions(librarian_db, monkeypatch):
+    app, db = librarian_db
+    from librarian_server.misc import create_records
+    from librarian_server.observation import Observation
+
+    monkeypatch.setitem(app.config, "session_assignment_mode", "incremental")
+    info = {
+        "observations": {
+            str(obsid): dict(obsid=obsid, start_time_jd=start, stop_time_jd=start + 0.007)
+            for obsid, start in [(11, 2458000.207), (10, 2458000.2), (12, 2458001.2)]
+        }
+    }
+    create_records(info, "test")
+    db.session.commit()
+
+    assert [o.session_id for o in Observation.query.order_by(Observation.obsid)] == [10, 10, 12]
@@ -0,0 +1,151 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License
+
+"""Check that the searches that the Librarian runs all the time are answered
+using indexes, rather than by scanning the big tables.
+
+"""
+
+import pytest
+
+import json
+import re
+
+from librarian_server import search
+
+MD5 = "d41d8cd98f00b204e9800998ecf8427e"
+
+# A table scan in SQLite's EXPLAIN QUERY PLAN output looks like "SCAN file"
+# or "SCAN file USING INDEX ...", whereas index lookups are "SEARCH". We
+# describe PostgreSQL's sequential scans, and index scans without an index
+# condition, the same way.
+BIG_TABLES = ("file", "file_event", "file_instance", "observation")
+_scan = re.compile(r"^SCAN (%s)\b" % "|".join(BIG_TABLES))
+
+# Searches that should never need a table scan, one for each kind of clause
+# that can use an index.
+INDEXED_SEARCHES = [
+    ("files", {"name-is-exactly": "zen.2458000.10001.uvh5"}),
+    ("files", {"name-matches": "%10001%"}),
+    ("files", {"obsid-is-exactly": 1000}),
+    ("files", {"obsid-in-range": [1000, 1010]}),
+    ("files", {"source-is-exactly": "correlator"}),
+    ("files", {"not-older-than": 1}),
+    ("files", {"start-time-jd-greater-than": 2458010.0}),
+    ("files", {"start-time-jd-in-range": [2458010.0, 2458010.5]}),
+    ("files", {"session-id-is-exactly": 3}),
+    ("files", {"obs-matches": {"start-time-jd-less-than": 2458001.0}}),
+    ("instances", {"obsid-is-exactly": 1000}),
+    ("obs", {"obsid-is-exactly": 1000}),
+    ("obs", {"start-time-jd-less-than": 2458001.0}),
+    ("obs", {"session-id-is-exactly": 3}),
+    ("sessions", {"no-file-has-event": "ingested"}),
+]
+
+
+@pytest.fixture()
+def catalog(librarian_db):
+    from librarian_server.file import File, FileEvent, FileInstance
+    from librarian_server.observation import Observation, ObservingSession
+    from librarian_server.store import Store
+
+    app, db = librarian_db
+    store = Store("teststore", "/data", "localhost")
+    db.session.add(store)
+
+    for sessid in range(10):
+        start = 2458000.0 + sessid
+        db.session.add(ObservingSession(sessid, start, start + 0.5))
+    db.session.flush()
+
+    names = {}
+
+    for i in range(200):
+        obsid = 1000 + i
+        start = 2458000.0 + 0.05 * i
+        obs = Observation(obsid, start, start + 0.01, 1.0)
+        obs.session_id = i // 20
+        db.session.add(obs)
+        names[obsid] = "zen.%.5f.uvh5" % start
+    db.session.flush()
+
+    for obsid, name in names.items():
+        db.session.add(File(name, "uvh5", obsid, "correlator", 1024, MD5))
+    db.session.flush()
+
+    for name in names.values():
+        db.session.add(FileInstance(store, "a", name))
+        db.session.add(FileEvent(name, "ingested", {}))
+    db.session.commit()
+    return app, db
+
+
+def _plan(stmt):
+    from sqlalchemy import text
+
+    from librarian_server import db
+
+    if db.session.connection().dialect.name == "postgresql":
+        # The test tables are so small that PostgreSQL would rather scan and
+        # hash them whether or not there's a usable index.
+        for setting in "enable_seqscan", "enable_hashjoin", "enable_mergejoin":
+            db.session.execute(text(f"SET LOCAL {setting} = off"))
+
+    return search.explain_search(stmt)["plan"]
+
+
+def _postgresql_scans(node):
+    table = node.get("Relation Name")
+
+    if node["Node Type"] == "Seq Scan":
+        yield f"SCAN {table}"
+    elif node["Node Type"] in ("Index Scan", "Index Only Scan") and "Index Cond" not in node:
+        yield f"SCAN {table} USING INDEX {node['Index Name']}"
+
+    for child in node.get("Plans", []):
+        yield from _postgresql_scans(child)
+
+
+def _scans(plan):
+    if isinstance(plan[0], dict):
+        plan = _postgresql_scans(plan[0]["Plan"])
+
+    return [line for line in plan if _scan.match(line)]
+
+
+@pytest.mark.parametrize(("query_type", "s"), INDEXED_SEARCHES)
+def test_search_uses_indexes(catalog, query_type, s):
+    query = search.compile_search(json.dumps(s), query_type)
+    plan = _plan(query)
+    assert not _scans(plan), plan
+
+
+def test_hot_paths_use_indexes(catalog):
+    from sqlalchemy import select
+
+    from librarian_server.file import File, FileEvent
+    from librarian_server.observation import Observation
+
+    # The front page's list of recent files. This is a scan, but in index
+    # order, so that it can stop as soon as it has enough rows.
+    plan = _plan(File.query.order_by(File.create_time.desc()).limit(50))
+    assert _scans(plan) == ["SCAN file USING INDEX file_create_time"], plan
+
+    # The standing order machinery's and describe_session_without_event's
+    # lookups of the files that do or don't have a given event.
+    done = select(FileEvent.name).where(FileEvent.type == "ingested")
+    plan = _plan(
+        File.query.join(Observation).filter(
+            Observation.session_id.isnot(None), File.source == "correlator", File.name.notin_(done)
+        )
+    )
+    assert not _scans(plan), plan
+
+    plan = _plan(FileEvent.query.filter(FileEvent.name == "x", FileEvent.type == "ingested"))
+    assert not _scans(plan), plan
+
+
+def test_unindexed_search_is_detected(catalog):
+    # Make sure that the test would actually notice a table scan.
+    plan = _plan(search.compile_search('{"size-greater-than": 10}'))
+    assert _scans(plan)
@@ -0,0 +1,121 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License
+
+"""Test code in librarian_server/rollups.py"""
+
+from librarian_server import rollups
+
+MD5 = "d41d8cd98f00b204e9800998ecf8427e"
+
+
+def _make_catalog(db):
+    from librarian_server.file import File, FileInstance
+    from librarian_server.observation import Observation, ObservingSession
+    from librarian_server.store import Store
+
+    store = Store("teststore", "/data", "localhost")
+    store.id = 1
+    db.session.add(store)
+
+    db.session.add_all(
+        [ObservingSession(1, 2458000.1, 2458000.5), ObservingSession(2, 2458001.1, 2458001.5)]
+    )
+    db.session.flush()
+
+    for obsid in (10, 11):
+        obs = Observation(obsid, 2458000.1 + 0.01 * obsid, 2458000.2 + 0.01 * obsid, 1.0)
+        obs.session_id = 1
+        db.session.add(obs)
+
+    db.session.add_all([File("f%d.uv" % i, "uv", 10 + i % 2, "test", 100, MD5) for i in range(4)])
+    db.session.flush()
+    db.session.add_all([FileInstance(store, "a", "f0.uv"), FileInstance(store, "b", "f0.uv")])
+    db.session.add(FileInstance(store, "a", "f1.uv"))
+    db.session.commit()
+    return store
+
+
+def _rollups(db):
+    from librarian_server.file import File
+    from librarian_server.observation import Observation, ObservingSession
+
+    db.session.expire_all()
+    return (
+        {f.name: f.num_instances for f in File.query},
+        {
+            o.obsid: (o.num_files, o.total_size, o.num_files_with_instances)
+            for o in Observation.query
+        },
+        {
+            s.id: (s.num_obs, s.num_files, s.total_size, s.num_files_with_instances)
+            for s in ObservingSession.query
+        },
+    )
+
+
+def test_rollups_follow_changes(librarian_db):
+    from librarian_server.file import FileInstance
+    from librarian_server.observation import Observation
+
+    app, db = librarian_db
+    _make_catalog(db)
+
+    files, obs, sess = _rollups(db)
+    assert files == {"f0.uv": 2, "f1.uv": 1, "f2.uv": 0, "f3.uv": 0}
+    assert obs == {10: (2, 200, 1), 11: (2, 200, 1)}
+    assert sess == {1: (2, 4, 400, 2), 2: (0, 0, 0, 0)}
+
+    # Deleting one of two instances doesn't change the coverage; deleting the
+    # only one does.
+    for inst in FileInstance.query.filter(FileInstance.parent_dirs == "a"):
+        db.session.delete(inst)
+    db.session.commit()
+
+    files, obs, sess = _rollups(db)
+    assert files == {"f0.uv": 1, "f1.uv": 0, "f2.uv": 0, "f3.uv": 0}
+    assert obs == {10: (2, 200, 1), 11: (2, 200, 0)}
+    assert sess[1] == (2, 4, 400, 1)
+
+    # Moving an observation moves its rollups.
+    Observation.query.get(11).session_id = 2
+    db.session.commit()
+
+    files, obs, sess = _rollups(db)
+    assert sess == {1: (1, 2, 200, 1), 2: (1, 2, 200, 0)}
+
+
+def test_reconcile(librarian_db):
+    from sqlalchemy import update
+
+    from librarian_server.file import File
+    from librarian_server.observation import Observation, ObservingSession
+
+    app, db = librarian_db
+    _make_catalog(db)
+    expected = _rollups(db)
+
+    db.session.execute(update(File).values(num_instances=7))
+    db.session.execute(update(Observation).values(total_size=0))
+    db.session.execute(update(ObservingSession).values(num_obs=5))
+    db.session.commit()
+    assert _rollups(db) != expected
+
+    rollups.reconcile()
+    assert _rollups(db) == expected
+
+    # Reconciling again has nothing to do.
+    conn = db.session.connection()
+    assert rollups.recompute_files(conn) == 0
+    assert rollups.recompute_observations(conn) == 0
+    assert rollups.recompute_sessions(conn) == 0
+
+
+def test_num_instances_search(librarian_db):
+    from librarian_server.file import File
+    from librarian_server.search import the_file_search_compiler
+
+    app, db = librarian_db
+    _make_catalog(db)
+
+    clause = the_file_search_compiler.compile({"num-instances-greater-than": 0})
+    assert sorted(f.name for f in File.query.filter(clause)) == ["f0.uv", "f1.uv"]
@@ -8,7 +8,10 @@
 
 import pytest
 
-from librarian_server import search
+import datetime
+import json
+
+from librarian_server import bgtasks, search
 from librarian_server.webutil import ServerError
 
 
@@ -20,3 +23,632 @@ class TestGenericSearchCompiler:
         bogus_search = "foo"
         with pytest.raises(ServerError):
             gsc.compile(bogus_search)
+
+
+def _make_file(db, name):
+    from librarian_server.file import File
+
+    f = File(name, "uv", None, "test", 1024, "d41d8cd98f00b204e9800998ecf8427e")
+    db.session.add(f)
+    return f
+
+
+class TestStandingOrder:
+    """Tests for the StandingOrder object"""
+
+    def test_retry_delay(self, librarian_db):
+        assert search.standing_order_retry_delay(1) == search.DEFAULT_STANDING_ORDER_RETRY_BASE
+        assert search.standing_order_retry_delay(2) == 2 * search.DEFAULT_STANDING_ORDER_RETRY_BASE
+        assert (
+            search.standing_order_retry_delay(30) == search.DEFAULT_STANDING_ORDER_RETRY_MAX_DELAY
+        )
+
+    def test_failure_backoff(self, librarian_db):
+        app, db = librarian_db
+        _make_file(db, "zen.2458000.12345.uv")
+        _make_file(db, "zen.2458000.23456.uv")
+        storder = search.StandingOrder("test", '{"name-matches": "zen.%"}', "elsewhere")
+        db.session.add(storder)
+        db.session.commit()
+
+        names = {f.name for f in storder.get_files_to_copy()}
+        assert names == {"zen.2458000.12345.uv", "zen.2458000.23456.uv"}
+
+        # A failed file is held back until its next attempt is due.
+        progress = storder.note_copy_failed("zen.2458000.12345.uv", "no route to host")
+        db.session.commit()
+        assert progress.state == "retrying"
+        names = {f.name for f in storder.get_files_to_copy()}
+        assert names == {"zen.2458000.23456.uv"}
+
+        # After enough failures it's dead and stays held back.
+        for _ in range(search.DEFAULT_STANDING_ORDER_MAX_ATTEMPTS - 1):
+            progress = storder.note_copy_failed("zen.2458000.12345.uv", "no route to host")
+        db.session.commit()
+        assert progress.state == "dead"
+        assert progress.next_attempt is None
+        assert [p.file_name for p in storder.get_failed_copies()] == ["zen.2458000.12345.uv"]
+
+        # Once it's been copied, it's no longer a failure, but it's still
+        # not copied again.
+        storder.note_copy_succeeded("zen.2458000.12345.uv")
+        db.session.commit()
+        assert storder.get_failed_copies() == []
+        names = {f.name for f in storder.get_files_to_copy()}
+        assert names == {"zen.2458000.23456.uv"}
+
+    def test_launched(self, librarian_db):
+        import datetime
+
+        app, db = librarian_db
+        _make_file(db, "zen.2458000.12345.uv")
+        storder = search.StandingOrder("test", '{"name-matches": "zen.%"}', "elsewhere")
+        db.session.add(storder)
+        db.session.commit()
+
+        progress = storder.note_copy_launched("zen.2458000.12345.uv")
+        db.session.commit()
+        assert list(storder.get_files_to_copy()) == []
+
+        # If the copy never reports back, we eventually try again.
+        progress.updated -= datetime.timedelta(
+            seconds=search.DEFAULT_STANDING_ORDER_LAUNCH_TIMEOUT + 1
+        )
+        db.session.commit()
+        names = [f.name for f in storder.get_files_to_copy()]
+        assert names == ["zen.2458000.12345.uv"]
+
+    def test_only_files(self, librarian_db):
+        app, db = librarian_db
+        _make_file(db, "zen.2458000.12345.uv")
+        _make_file(db, "zen.2458000.23456.uv")
+        storder = search.StandingOrder("test", '{"name-matches": "zen.%"}', "elsewhere")
+        db.session.add(storder)
+        db.session.commit()
+
+        names = [f.name for f in storder.get_files_to_copy(only_files=["zen.2458000.23456.uv"])]
+        assert names == ["zen.2458000.23456.uv"]
+
+
+class FakeIOLoop:
+    def __init__(self):
+        self.calls = []
+
+    def add_callback(self, func, *args):
+        self.calls.append((func, args))
+
+    def call_later(self, delay, func):
+        self.calls.append((delay, func))
+
+
+def test_standing_order_manager_new_files():
+    manager = search.StandingOrderManager()
+
+    # Not started: nothing to do.
+    manager.note_new_instances({"zen.a.uv"})
+    assert not len(manager.new_files)
+
+    manager.ioloop = FakeIOLoop()
+    manager.new_files_job = bgtasks.PeriodicJob("test", manager.launch_copies_for_new_files)
+    manager.note_new_instances({"zen.a.uv"})
+    manager.note_new_instances({"zen.b.uv"})
+    assert manager.new_files == {"zen.a.uv", "zen.b.uv"}
+    assert len(manager.ioloop.calls) == 1
+
+
+def test_paginate_search(librarian_db):
+    from librarian_server.file import FileInstance
+    from librarian_server.store import Store
+
+    app, db = librarian_db
+    store = Store("teststore", "/data", "localhost")
+    store.id = 1
+    db.session.add(store)
+
+    for i in range(5):
+        _make_file(db, "f%d.uv" % i)
+    db.session.flush()
+
+    for i in range(5):
+        db.session.add(FileInstance(store, "b" if i % 2 else "a", "f%d.uv" % i))
+    db.session.commit()
+
+    everything = {"name-matches": "%.uv"}
+    names = []
+    cursor = None
+
+    while True:
+        files, cursor = search.paginate_search(
+            search.compile_search(json.dumps(everything)), "files", 2, cursor
+        )
+        names += [f.name for f in files]
+        if cursor is None:
+            break
+
+    assert names == ["f0.uv", "f1.uv", "f2.uv", "f3.uv", "f4.uv"]
+
+    # Instances page on their whole (store, parent_dirs, name) key.
+    instances, cursor = search.paginate_search(
+        search.compile_search(json.dumps(everything), "instances"), "instances", 3
+    )
+    assert [(i.parent_dirs, i.name) for i in instances] == [
+        ("a", "f0.uv"),
+        ("a", "f2.uv"),
+        ("a", "f4.uv"),
+    ]
+    instances, cursor = search.paginate_search(
+        search.compile_search(json.dumps(everything), "instances"), "instances", 3, cursor
+    )
+    assert [i.name for i in instances] == ["f1.uv", "f3.uv"]
+    assert cursor is None
+
+    with pytest.raises(ServerError):
+        search.paginate_search(search.compile_search("{}"), "files", 2, "bogus")
+
+
+def test_stream_search(librarian_db):
+    app, db = librarian_db
+
+    for i in range(3):
+        _make_file(db, "f%d.uv" % i)
+    db.session.commit()
+
+    request = json.dumps(
+        {
+            "authenticator": "I am a bot",
+            "search": json.dumps({"name-matches": "%.uv"}),
+            "output_format": "file-listing-ndjson",
+        }
+    )
+    reply = app.test_client().post("/api/search", data={"request": request})
+    assert reply.status_code == 200
+    assert reply.mimetype == "application/x-ndjson"
+
+    lines = [json.loads(line) for line in reply.get_data(as_text=True).splitlines()]
+    assert sorted(item["name"] for item in lines[:-1]) == ["f0.uv", "f1.uv", "f2.uv"]
+    assert lines[-1] == {"success": True, "n_results": 3}
+
+    # Bad searches are reported before streaming starts.
+    request = json.dumps(
+        {"authenticator": "I am a bot", "search": "{", "output_format": "obs-listing-ndjson"}
+    )
+    reply = app.test_client().post("/api/search", data={"request": request})
+    assert reply.status_code == 400
+    assert not reply.get_json()["success"]
+
+
+def test_file_stats(librarian_db):
+    from librarian_server.file import File, FileInstance
+    from librarian_server.store import Store
+
+    app, db = librarian_db
+    store = Store("teststore", "/data", "localhost")
+    store.id = 1
+    db.session.add(store)
+
+    for i in range(3):
+        _make_file(db, "f%d.uv" % i)
+    db.session.add(File("f3.uvh5", "uvh5", None, "test", 4096, "d41d8cd98f00b204e9800998ecf8427e"))
+    db.session.flush()
+    db.session.add(FileInstance(store, "a", "f0.uv"))
+    db.session.add(FileInstance(store, "b", "f0.uv"))
+    db.session.add(FileInstance(store, "a", "f3.uvh5"))
+    db.session.commit()
+
+    def stats(text, group_by=()):
+        return search.compute_file_stats(search.compile_search(text), group_by)
+
+    (total,) = stats('{"name-matches": "f%"}')
+    assert total["count"] == 4
+    assert total["total_size"] == 3 * 1024 + 4096
+    assert total["min_create_time"] <= total["max_create_time"]
+
+    # Nothing matches: one row of zeros.
+    assert stats('{"name-matches": "nope%"}') == [
+        {"count": 0, "total_size": 0, "min_create_time": None, "max_create_time": None}
+    ]
+
+    by_type = stats('{"name-matches": "f%"}', ["type"])
+    assert [(s["type"], s["count"], s["total_size"]) for s in by_type] == [
+        ("uv", 3, 3 * 1024),
+        ("uvh5", 1, 4096),
+    ]
+
+    # Grouping by store counts instances.
+    by_store = stats('{"name-matches": "f%"}', ["store", "type"])
+    assert [(s["store"], s["type"], s["count"]) for s in by_store] == [
+        ("teststore", "uv", 2),
+        ("teststore", "uvh5", 1),
+    ]
+
+    (by_session,) = stats('{"name-matches": "f%"}', ["session"])
+    assert by_session["session"] is None
+    assert by_session["count"] == 4
+
+    with pytest.raises(ServerError):
+        stats("{}", ["color"])
+    with pytest.raises(ServerError):
+        stats("{}", ["type", "type"])
+
+    request = json.dumps(
+        {
+            "authenticator": "I am a bot",
+            "search": '{"type-is-exactly": "uv"}',
+            "output_format": "file-stats-json",
+            "group_by": ["source"],
+        }
+    )
+    reply = app.test_client().post("/api/search", data={"request": request})
+    assert reply.status_code == 200
+    (result,) = reply.get_json()["results"]
+    assert result["source"] == "test"
+    assert result["count"] == 3
+
+
+def test_instance_listing_query_count(librarian_db):
+    from sqlalchemy import event
+
+    from librarian_server.file import FileInstance
+    from librarian_server.store import Store
+
+    app, db = librarian_db
+    app.config["_version_string"] = app.config["_git_hash"] = "test"
+    client = app.test_client()
+
+    with client.session_transaction() as sess:
+        sess["sourcename"] = "HumanUser"
+
+    def add_instances(n):
+        # Each instance gets its own store, so that lazily loading the stores
+        # would take one query per row.
+        first = Store.query.count()
+
+        for i in range(first, first + n):
+            store = Store("store%d" % i, "/data%d" % i, "localhost")
+            store.id = i + 1
+            db.session.add(store)
+            _make_file(db, "f%d.uv" % i)
+            db.session.flush()
+            db.session.add(FileInstance(store, "a", "f%d.uv" % i))
+
+        db.session.commit()
+        db.session.expunge_all()
+
+    def count_statements(fetch):
+        statements = []
+
+        def note(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", note)
+        try:
+            result = fetch()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", note)
+            db.session.expunge_all()
+
+        return len(statements), result
+
+    def api_listing(output_format):
+        request = json.dumps(
+            {
+                "authenticator": "I am a bot",
+                "search": '{"name-matches": "%.uv"}',
+                "output_format": output_format,
+            }
+        )
+        return client.post("/api/search", data={"request": request}).get_data(as_text=True)
+
+    def full_paths():
+        args = {
+            "type": "files",
+            "search": '{"name-matches": "%.uv"}',
+            "output_format": search.full_path_format,
+        }
+        return client.get("/search", query_string=args).get_data(as_text=True)
+
+    fetchers = [
+        lambda: api_listing("instance-listing-json"),
+        lambda: api_listing("instance-listing-ndjson"),
+        full_paths,
+    ]
+
+    add_instances(2)
+    small = [count_statements(f) for f in fetchers]
+    add_instances(8)
+    large = [count_statements(f) for f in fetchers]
+
+    for (n_small, _), (n_large, result) in zip(small, large):
+        assert n_large == n_small
+        assert "/data9/a/f9.uv" in result
+
+
+def test_compile_listing(librarian_db):
+    from librarian_server.file import FileInstance
+    from librarian_server.observation import Observation, ObservingSession
+    from librarian_server.store import Store
+
+    app, db = librarian_db
+    store = Store("teststore", "/data", "localhost")
+    store.id = 1
+    db.session.add(store)
+    db.session.add(ObservingSession(1, 2458000.0, 2458000.5))
+    db.session.add(Observation(1200000000, 2458000.1, 2458000.2, 1.5))
+    db.session.flush()
+
+    for i in range(3):
+        f = _make_file(db, "f%d.uv" % i)
+        f.obsid = 1200000000 if i else None
+    db.session.flush()
+    db.session.add(FileInstance(store, "a/b", "f1.uv"))
+    db.session.commit()
+
+    # The listings built from plain rows must match the ORM objects' dicts.
+    searches = {
+        "files": '{"name-matches": "f%"}',
+        "instances": '{"name-matches": "f%"}',
+        "obs": '{"obsid-greater-than": 0}',
+        "sessions": '{"session-id-is-exactly": 1}',
+    }
+
+    for query_type, text in searches.items():
+        query = search.compile_search(text, query_type)
+        stmt, to_dict = search.compile_listing(query, query_type)
+        listed = sorted((to_dict(row) for row in db.session.execute(stmt)), key=json.dumps)
+        expected = sorted((item.to_dict() for item in query), key=json.dumps)
+        assert len(listed)
+        assert listed == expected
+
+        items, cursor = search.paginate_listing(query, query_type, 10)
+        assert sorted(items, key=json.dumps) == listed
+        assert cursor is None
+
+    with pytest.raises(ServerError):
+        search.compile_listing(search.compile_search(searches["files"], "names"), "names")
+
+
+def test_explain_search(librarian_db, monkeypatch):
+    app, db = librarian_db
+
+    for i in range(3):
+        _make_file(db, "f%d.uv" % i)
+    db.session.commit()
+
+    def api(**args):
+        args.setdefault("search", '{"name-matches": "f%", "not-older-than": 1}')
+        args.setdefault("output_format", "file-listing-json")
+        request = json.dumps(dict(authenticator="I am a bot", **args))
+        reply = app.test_client().post("/api/search", data={"request": request})
+        return reply.status_code, reply.get_json()
+
+    status, info = api(explain=True)
+    assert status == 200
+    assert "FROM file" in info["sql"]
+    assert len(info["plan"])
+    assert not info["analyzed"]
+
+    status, info = api(explain=True, analyze=True, output_format="file-stats-json")
+    assert "count(*)" in info["sql"]
+    assert info["n_rows"] == 1
+
+    status, info = api(explain=True, search='{"obs-matches": {"obsid-greater-than": 3}}')
+    assert "observation" in info["sql"]
+
+    # The cost limit only applies when the database gives us an estimate.
+    monkeypatch.setitem(app.config, "search_cost_limit", 100)
+    status, info = api()
+    assert status == 200
+    assert len(info["results"]) == 3
+
+    monkeypatch.setattr(search, "_run_explain", lambda stmt, analyze=False: ("", {}, [], 1000.0))
+    status, info = api()
+    assert status == 400
+    assert "too expensive" in info["message"]
+    status, info = api(explain=True)
+    assert status == 200
+
+    # Only the statement that actually runs is priced, so one page of a
+    # listing can get through even when the whole listing wouldn't.
+    def explain_pages_cheaply(stmt, analyze=False):
+        return "", {}, [], 10.0 if "LIMIT" in str(stmt) else 1000.0
+
+    monkeypatch.setattr(search, "_run_explain", explain_pages_cheaply)
+    status, info = api(limit=2)
+    assert status == 200
+    assert len(info["results"]) == 2
+    assert info["next_cursor"] is not None
+    status, info = api()
+    assert status == 400
+
+
+class TestSearchRewriting:
+    """Tests for the simplification of compiled searches"""
+
+    MD5 = "d41d8cd98f00b204e9800998ecf8427e"
+
+    searches = [
+        {"start-time-jd-greater-than": 2458000.3, "stop-time-jd-less-than": 2458000.8},
+        {"or": {"obsid-is-exactly": 2, "session-id-is-exactly": 1, "obsid-is-null": True}},
+        {"none-of": {"start-time-jd-less-than": 2458000.5, "size-greater-than": 150}},
+        {"and": {"and": {"obs-matches": {"duration-less-than": 0.05}}, "always-true": 1}},
+        {"or": {"always-false": 1, "none-of": {"always-false": 1}}},
+        {"and": {"or": {"name-matches": "f1%", "obsid-is-null": True}, "always-false": 1}},
+        {"num-instances-greater-than": 0, "obs-matches": {"obsid-in-range": [1, 3]}},
+        {
+            "none-of": {
+                "and": {
+                    "start-time-jd-greater-than": 2458000.5,
+                    "stop-time-jd-less-than": 2458000.5,
+                }
+            }
+        },
+    ]
+
+    def _make_catalog(self, db):
+        from librarian_server.file import File, FileInstance
+        from librarian_server.observation import Observation, ObservingSession
+        from librarian_server.store import Store
+
+        store = Store("teststore", "/data", "localhost")
+        store.id = 1
+        db.session.add(store)
+        db.session.add(ObservingSession(1, 2458000.0, 2458000.45))
+        db.session.flush()
+
+        for obsid in range(1, 6):
+            obs = Observation(obsid, 2458000.0 + 0.2 * obsid, 2458000.04 + 0.21 * obsid, 1.0)
+            obs.session_id = 1 if obsid < 3 else None
+            db.session.add(obs)
+        db.session.flush()
+
+        # Files with obsids 1 to 5, or none.
+        for i in range(14):
+            obsid = i % 7 if 0 < i % 7 < 6 else None
+            db.session.add(File("f%d.uv" % i, "uv", obsid, "test", 100 + 10 * i, self.MD5))
+        db.session.flush()
+
+        for i in range(0, 14, 3):
+            db.session.add(FileInstance(store, "a", "f%d.uv" % i))
+        db.session.commit()
+
+    def test_results_unchanged(self, librarian_db):
+        from librarian_server.file import File
+
+        app, db = librarian_db
+        self._make_catalog(db)
+        fc = search.the_file_search_compiler
+
+        for s in self.searches:
+            optimized = {f.name for f in File.query.filter(fc.compile(s))}
+            literal = {f.name for f in File.query.filter(fc.compile(s, optimize=False))}
+            assert optimized == literal, s
+
+    def test_merge_observation_predicates(self, librarian_db):
+        fc = search.the_file_search_compiler
+        s = {
+            "start-time-jd-greater-than": 1.0,
+            "or": {"stop-time-jd-less-than": 2.0, "obs-matches": {"duration-less-than": 0.1}},
+            "session-id-is-exactly": 1,
+        }
+        assert str(fc.compile(s, optimize=False)).count("FROM observation") == 4
+        assert str(fc.compile(s)).count("FROM observation") == 1
+
+        s["or"]["size-less-than"] = 5
+        assert str(fc.compile(s)).count("FROM observation") == 2
+
+        s = {"and": {"obsid-is-exactly": 1, "and": {"start-time-jd-greater-than": 1.0}}}
+        s["and"]["obs-matches"] = {"duration-less-than": 0.1}
+        assert str(fc.compile(s)).count("FROM observation") == 1
+
+        # ANDs under a NOT are left alone, but ORs are still merged.
+        s = {"none-of": {"and": {"start-time-jd-greater-than": 1.0, "stop-time-jd-less-than": 2.0}}}
+        assert str(fc.compile(s)).count("FROM observation") == 2
+        s = {"none-of": {"or": {"start-time-jd-greater-than": 1.0, "stop-time-jd-less-than": 2.0}}}
+        assert str(fc.compile(s)).count("FROM observation") == 1
+
+    def test_simplify(self):
+        t, f = search._Const(True), search._Const(False)
+        leaf = search._Leaf("x")
+
+        def simplify(op, *children):
+            return search._simplify(search._BoolOp(op, list(children)))
+
+        assert simplify("and", leaf, t) is leaf
+        assert simplify("and", leaf, f).value is False
+        assert simplify("or", leaf, t).value is True
+        assert simplify("or", f, f).value is False
+        assert simplify("and", search._Not(t), leaf).value is False
+        assert search._simplify(search._Not(search._Not(leaf))) is leaf
+
+        nested = simplify("and", leaf, search._BoolOp("and", [leaf, search._BoolOp("and", [leaf])]))
+        assert nested.op == "and"
+        assert nested.children == [leaf, leaf, leaf]
+        mixed = simplify("and", leaf, search._BoolOp("or", [leaf, leaf]))
+        assert [type(c) for c in mixed.children] == [search._Leaf, search._BoolOp]
+
+
+NAMES = ["zen.2458000.12345.xx.uv", "zen.2458000.54321.xx.uv", "Zen.2458001.12345.yy.uvh5"]
+
+
+def _make_named_files(db):
+    from librarian_server.file import File
+
+    for name in NAMES[:2]:
+        _make_file(db, name)
+    db.session.commit()
+
+    # Files inserted without the ORM are indexed too.
+    row = dict(name=NAMES[2], type="uv", obsid=None, source="test", size=1)
+    row.update(md5=TestSearchRewriting.MD5, create_time=datetime.datetime.now())
+    db.session.execute(File.__table__.insert(), [row])
+    db.session.commit()
+
+
+def _names_matching(pattern):
+    from librarian_server.file import File
+
+    clause = search.the_file_search_compiler.compile({"name-matches": pattern})
+    return sorted(f.name for f in File.query.filter(clause)), str(clause)
+
+
+def test_name_matches(librarian_db):
+    from librarian_server.file import File
+
+    app, db = librarian_db
+    _make_named_files(db)
+    assert _names_matching("%12345%.uv%")[0] == [NAMES[2], NAMES[0]]
+    assert _names_matching("%54%uv")[0] == [NAMES[1]]
+
+    File.query.filter(File.name == NAMES[0]).delete()
+    db.session.commit()
+    assert _names_matching("%12345%")[0] == [NAMES[2]]
+
+    renamed = "zen.2458002.99999.zz.uv"
+    db.session.execute(File.__table__.update().where(File.name == NAMES[1]).values(name=renamed))
+    db.session.commit()
+    assert _names_matching("%99999%")[0] == [renamed]
+    assert _names_matching("%54321%")[0] == []
+
+
+def test_sqlite_name_index(librarian_db):
+    from sqlalchemy import text
+
+    from librarian_server import nameindex
+    from librarian_server.file import File
+
+    app, db = librarian_db
+    if db.engine.dialect.name != "sqlite":
+        pytest.skip("the trigram table is only used on SQLite")
+
+    assert nameindex.trigram_index_available()
+    _make_named_files(db)
+
+    found, sql = _names_matching("%12345%.uv%")
+    assert found == [NAMES[2], NAMES[0]]
+    assert nameindex.TRIGRAM_TABLE in sql
+
+    found, sql = _names_matching("zen.%")
+    assert found == sorted(NAMES)
+    assert nameindex.TRIGRAM_TABLE in sql
+
+    # Patterns without three literal characters in a row can't use the index.
+    assert nameindex.TRIGRAM_TABLE not in _names_matching("%54%uv")[1]
+
+    # VACUUM and dump/restore can renumber the file rows, which mustn't throw
+    # the index off.
+    def indexed():
+        return sorted(
+            db.session.execute(text(f"SELECT name FROM {nameindex.TRIGRAM_TABLE}")).scalars()
+        )
+
+    File.query.filter(File.name == NAMES[0]).delete()
+    db.session.execute(text("UPDATE file SET rowid = rowid - 1"))
+    db.session.commit()
+
+    renamed = "zen.2458002.99999.zz.uv"
+    db.session.execute(File.__table__.update().where(File.name == NAMES[1]).values(name=renamed))
+    File.query.filter(File.name == NAMES[2]).delete()
+    _make_file(db, NAMES[0])
+    db.session.commit()
+    assert indexed() == [NAMES[0], renamed]
+    assert _names_matching("%99999%")[0] == [renamed]
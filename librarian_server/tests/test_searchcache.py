@@ -0,0 +1,135 @@
+# Copyright 2026 the HERA Collaboration
+# Licensed under the 2-clause BSD License
+
+"""Test code in librarian_server/searchcache.py"""
+
+import pytest
+
+import json
+import threading
+
+from librarian_server import search, searchcache
+
+MD5 = "d41d8cd98f00b204e9800998ecf8427e"
+
+
+@pytest.fixture()
+def caches(librarian_db, monkeypatch):
+    app, db = librarian_db
+    monkeypatch.setitem(app.config, "search_result_cache_ttl", 60)
+    monkeypatch.setattr(searchcache, "_compiled", searchcache.OrderedDict())
+    monkeypatch.setattr(searchcache, "_results", searchcache.OrderedDict())
+    monkeypatch.setattr(searchcache, "_results_bytes", 0)
+    return app, db
+
+
+def _add_file(db, name):
+    from librarian_server.file import File
+
+    db.session.add(File(name, "uv", None, "test", 1024, MD5))
+    db.session.commit()
+
+
+def test_normalize_search():
+    a = searchcache.normalize_search('{"size-less-than": 3, "name-matches": "a%"}')
+    b = searchcache.normalize_search('{ "name-matches": "a%",  # comment\n "size-less-than": 3}')
+    assert a == b
+
+
+def test_cached_clause(caches):
+    fc = search.the_file_search_compiler
+    first = search.compile_search('{"name-matches": "a%", "size-less-than": 3}')
+    second = search.compile_search('{"size-less-than": 3, "name-matches": "a%"}')
+    assert first.whereclause is second.whereclause
+
+    # The same text compiles to a different clause for a different compiler.
+    obs = search.compile_search('{"obsid-greater-than": 3}', "obs")
+    files = search.compile_search('{"obsid-greater-than": 3}', "files")
+    assert obs.whereclause is not files.whereclause
+
+    # Searches that depend on the current time aren't cached.
+    assert "not-older-than" in fc.volatile_clauses
+    text = '{"or": {"not-older-than": 1, "always-false": true}}'
+    assert search.compile_search(text).whereclause is not search.compile_search(text).whereclause
+    assert "age-less-than" in search.the_session_search_compiler.volatile_clauses
+
+
+def test_cached_result(caches):
+    app, db = caches
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return b"%d" % len(calls)
+
+    assert searchcache.cached_result("k", compute) == b"1"
+    assert searchcache.cached_result("k", compute) == b"1"
+
+    # Writes to the watched tables invalidate the cache...
+    _add_file(db, "a.uv")
+    assert searchcache.cached_result("k", compute) == b"2"
+
+    # ... while others don't.
+    from librarian_server.store import Store
+
+    db.session.add(Store("teststore", "/data", "localhost"))
+    db.session.commit()
+    assert searchcache.cached_result("k", compute) == b"2"
+
+    app.config["search_result_cache_ttl"] = 0
+    assert searchcache.cached_result("k", compute) == b"3"
+
+
+def test_single_flight(caches):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(10)
+        return b"result"
+
+    results = []
+
+    def run():
+        results.append(searchcache.cached_result("k", compute))
+
+    leader = threading.Thread(target=run)
+    leader.start()
+    started.wait(10)
+    followers = [threading.Thread(target=run) for _ in range(3)]
+
+    for t in followers:
+        t.start()
+
+    release.set()
+
+    for t in [leader] + followers:
+        t.join(10)
+
+    assert results == [b"result"] * 4
+    assert len(calls) == 1
+
+
+def test_search_api_cache(caches):
+    app, db = caches
+    _add_file(db, "a.uv")
+
+    def listing():
+        request = json.dumps(
+            {
+                "authenticator": "I am a bot",
+                "search": '{"name-matches": "%.uv"}',
+                "output_format": "file-listing-json",
+            }
+        )
+        reply = app.test_client().post("/api/search", data={"request": request})
+        assert reply.status_code == 200
+        return sorted(f["name"] for f in reply.get_json()["results"])
+
+    assert listing() == ["a.uv"]
+    assert len(searchcache._results) == 1
+    _add_file(db, "b.uv")
+    assert listing() == ["a.uv", "b.uv"]
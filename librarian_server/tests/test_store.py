@@ -5,6 +5,8 @@
 
 """
 
+import pytest
+
 from . import ALL_FILES
 
 
@@ -12,3 +14,162 @@ from . import ALL_FILES
 def test_initiate_upload():
     # test uploading a datafile
     pass
+
+
+def _make_stored_file(db, store, name):
+    from librarian_server.file import File, FileInstance
+
+    db.session.add(File(name, "uv", None, "test", 1024, "d41d8cd98f00b204e9800998ecf8427e"))
+    db.session.add(FileInstance(store, "2458000", name))
+
+
+def _make_store(db):
+    from librarian_server.store import Store
+
+    store = Store("teststore", "/data", "localhost")
+    store.available = True
+    db.session.add(store)
+    db.session.flush()
+    return store
+
+
+def test_uploader_task_payload(librarian_db):
+    from librarian_server.store import UploaderTask
+
+    app, db = librarian_db
+    store = _make_store(db)
+    db.session.commit()
+
+    task = UploaderTask(
+        store.convert_to_base_object(), "elsewhere", {}, ["2458000/a.uv", "2458000/b.uv"], None
+    )
+    assert task.desc == "upload 2 files from teststore to elsewhere"
+
+    task = UploaderTask.from_payload(task.to_payload())
+    assert task.store_paths == ["2458000/a.uv", "2458000/b.uv"]
+    assert task.remote_store_paths == [None, None]
+
+    # Jobs queued before uploads were batched only have one file.
+    legacy = {
+        "store_name": "teststore",
+        "conn_name": "elsewhere",
+        "rec_info": {},
+        "store_path": "2458000/a.uv",
+        "remote_store_path": "x/a.uv",
+        "standing_order_name": None,
+        "known_staging_store": None,
+        "known_staging_subdir": None,
+    }
+    task = UploaderTask.from_payload(legacy)
+    assert task.store_paths == ["2458000/a.uv"]
+    assert task.remote_store_paths == ["x/a.uv"]
+
+
+def test_launch_copies_by_file_names(librarian_db):
+    import json
+
+    from librarian_server import bgtasks
+    from librarian_server.search import StandingOrder, StandingOrderProgress
+    from librarian_server.store import launch_copies_by_file_names
+
+    app, db = librarian_db
+    store = _make_store(db)
+    names = ["zen.2458000.%d.uv" % i for i in range(3)]
+    for name in names:
+        _make_stored_file(db, store, name)
+    storder = StandingOrder("test", '{"name-matches": "zen.%"}', "elsewhere")
+    db.session.add(storder)
+    db.session.commit()
+
+    app.config["upload_batch_size"] = 2
+    try:
+        missing = launch_copies_by_file_names(
+            names + ["zen.nowhere.uv"], "elsewhere", standing_order_name="test"
+        )
+    finally:
+        del app.config["upload_batch_size"]
+
+    assert missing == ["zen.nowhere.uv"]
+
+    jobs = bgtasks.BackgroundJob.query.order_by(bgtasks.BackgroundJob.id).all()
+    payloads = [json.loads(job.payload) for job in jobs]
+    assert [len(p["store_paths"]) for p in payloads] == [2, 1]
+    assert sorted(payloads[0]["rec_info"]["files"]) == names[:2]
+    assert [p.state for p in StandingOrderProgress.query] == ["launched"] * 3
+
+
+def test_uploader_task_partial_failure(librarian_db):
+    from librarian_server.search import StandingOrder, StandingOrderProgress
+    from librarian_server.store import UploaderTask
+
+    app, db = librarian_db
+    store = _make_store(db)
+    _make_stored_file(db, store, "a.uv")
+    _make_stored_file(db, store, "b.uv")
+    storder = StandingOrder("test", '{"name-matches": "%.uv"}', "elsewhere")
+    db.session.add(storder)
+    db.session.commit()
+
+    task = UploaderTask(
+        store.convert_to_base_object(),
+        "elsewhere",
+        {},
+        ["2458000/a.uv", "2458000/b.uv"],
+        standing_order_name="test",
+    )
+    task.t_start, task.t_finish = 0.0, 1.0
+    task.wrapup_function({"b.uv": "bad checksum"}, None)
+
+    states = {p.file_name: p.state for p in StandingOrderProgress.query}
+    assert states == {"a.uv": "succeeded", "b.uv": "retrying"}
+    assert [f.name for f in storder.get_files_to_copy()] == []
+
+
+def test_register_instances(librarian_db):
+    from librarian_server.file import File, FileEvent, FileInstance
+    from librarian_server.observation import Observation
+    from librarian_server.webutil import ServerError
+
+    app, db = librarian_db
+    store = _make_store(db)
+    db.session.add(Observation(1000, 2458000.2, 2458000.21, 1.0))
+    db.session.commit()
+
+    md5 = "d41d8cd98f00b204e9800998ecf8427e"
+    file_info = {
+        # The obsid of the second file is inferred from the first.
+        "/data/2458000/zen.2458000.12345.xx.uv": dict(size=1, md5=md5, type="uv", obsid=1000),
+        "/data/2458000/zen.2458000.12345.yy.uv": dict(size=1, md5=md5, type="uv"),
+    }
+    assert store.register_instances(file_info, "test") == 2
+    assert {f.name: f.obsid for f in File.query} == {
+        "zen.2458000.12345.xx.uv": 1000,
+        "zen.2458000.12345.yy.uv": 1000,
+    }
+    assert FileInstance.query.count() == 2
+    assert FileEvent.query.filter(FileEvent.type == "create_instance").count() == 2
+
+    # Known instances are ignored; a second instance of a known file gets
+    # created without touching the File.
+    file_info["/data/copy/zen.2458000.12345.xx.uv"] = file_info[
+        "/data/2458000/zen.2458000.12345.xx.uv"
+    ]
+    assert store.register_instances(file_info, "test") == 1
+    assert FileInstance.query.count() == 3
+    assert File.query.count() == 2
+
+    # The bulk inserts keep the rollups up to date.
+    db.session.expire_all()
+    assert File.query.get("zen.2458000.12345.xx.uv").num_instances == 2
+    obs = Observation.query.get(1000)
+    assert (obs.num_files, obs.total_size, obs.num_files_with_instances) == (2, 2, 2)
+
+    # Failures are all-or-nothing.
+    bad_info = {
+        "/data/2458001/zen.2458001.12345.xx.uv": dict(size=1, md5=md5, type="uv", obsid=1000),
+        "/data/2458001/zen.2458001.55555.xx.uv": dict(size=1, md5=md5, type="uv"),
+    }
+    with pytest.raises(ServerError):
+        store.register_instances(bad_info, "test")
+    db.session.rollback()
+    assert File.query.count() == 2
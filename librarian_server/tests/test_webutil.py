@@ -8,14 +8,19 @@
 
 import pytest
 
+import asyncio
 import json
 import numpy as np
+import socket
 import urllib.error
 import urllib.parse
 import urllib.request
+from flask import Flask, Response
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
 
 from librarian_server import webutil
-from librarian_server.webutil import AuthFailedError, ServerError, json_api
+from librarian_server.webutil import AuthFailedError, ServerError, StreamingWSGIContainer, json_api
 
 
 def test_check_authentication():
@@ -186,3 +191,47 @@ def test_optional_arg():
     assert arg3 == 7
 
     return
+
+
+def test_streaming_wsgi_container():
+    app = Flask("test")
+    received = []
+
+    @app.route("/stream")
+    def stream():
+        def generate():
+            for i in range(3):
+                yield "line %d\n" % i
+
+        return Response(generate(), mimetype="text/plain")
+
+    @app.route("/plain")
+    def plain():
+        return "hello"
+
+    async def run():
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        server = HTTPServer(StreamingWSGIContainer(app))
+        server.listen(port, address="127.0.0.1")
+        client = AsyncHTTPClient()
+
+        try:
+            # The body arrives in chunks rather than all at once.
+            reply = await client.fetch(
+                "http://127.0.0.1:%d/stream" % port, streaming_callback=received.append
+            )
+            assert reply.headers.get("Transfer-Encoding") == "chunked"
+            assert len(received) > 1
+
+            reply = await client.fetch("http://127.0.0.1:%d/plain" % port)
+            assert reply.body == b"hello"
+            assert reply.headers["Content-Length"] == "5"
+        finally:
+            server.stop()
+
+    asyncio.run(run())
+    assert b"".join(received) == b"line 0\nline 1\nline 2\n"
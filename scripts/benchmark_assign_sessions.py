@@ -0,0 +1,110 @@
+#! /usr/bin/env python
+# Copyright 2026 the HERA Collaboration
+# Licensed under the BSD License.
+
+"""Benchmark the assignment of observations to observing sessions, as done
+by the `assign_observing_sessions` API call.
+
+We create synthetic observations for the requested number of years of nightly
+observing: each night has a 12-hour run of 10-minute observations, sometimes
+with a mid-night interruption that splits it into two sessions. Sessions are
+created ahead of time for the first half of the nights, so that both matching
+against existing sessions and creating new ones get exercised.
+
+Point LIBRARIAN_CONFIG_PATH at a server configuration with a *scratch*
+database: all of the tables are created at the start and dropped at the end.
+
+"""
+
+import argparse
+import time
+from sqlalchemy import BigInteger
+from sqlalchemy.ext.compiler import compiles
+
+OBS_PER_NIGHT = 72
+OBS_LENGTH = 1.0 / 144  # days
+FIRST_NIGHT = 2458000.1
+
+
+@compiles(BigInteger, "sqlite")
+def _compile_sqlite_big_integer(type_, compiler, **kw):
+    # SQLite only autoincrements primary keys declared as exactly "INTEGER",
+    # so create our BigInteger keys that way if benchmarking with SQLite.
+    return "INTEGER"
+
+
+def make_rows(n_nights):
+    obs_rows = []
+    sess_rows = []
+
+    for night in range(n_nights):
+        t0 = FIRST_NIGHT + night
+        night_starts = [t0 + i * OBS_LENGTH for i in range(OBS_PER_NIGHT)]
+
+        if night % 7 == 3:
+            # Insert a six-hour break in the middle of the night.
+            half = OBS_PER_NIGHT // 2
+            night_starts[half:] = [t + 0.25 for t in night_starts[half:]]
+
+        for start in night_starts:
+            obsid = int(round(start * 86400)) - 212000000000
+            obs_rows.append(
+                dict(
+                    obsid=obsid,
+                    start_time_jd=start,
+                    stop_time_jd=start + OBS_LENGTH,
+                    start_lst_hr=0.0,
+                )
+            )
+
+        if night < n_nights // 2:
+            sess_rows.append(
+                dict(
+                    id=obs_rows[-OBS_PER_NIGHT]["obsid"],
+                    start_time_jd=night_starts[0],
+                    stop_time_jd=night_starts[-1] + OBS_LENGTH,
+                )
+            )
+
+    return obs_rows, sess_rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("-y", dest="n_years", type=float, default=5, help="Number of years.")
+    args = ap.parse_args()
+
+    from sqlalchemy import insert
+
+    from librarian_server import app, db
+    from librarian_server.observation import Observation, ObservingSession, assign_sessions
+
+    with app.app_context():
+        db.create_all()
+
+        try:
+            obs_rows, sess_rows = make_rows(int(args.n_years * 365))
+            db.session.execute(insert(Observation), obs_rows)
+            db.session.execute(insert(ObservingSession), sess_rows)
+            db.session.commit()
+
+            t0 = time.time()
+            new_info = assign_sessions()
+            dt = time.time() - t0
+            n = Observation.query.filter(Observation.session_id.isnot(None)).count()
+            print(
+                f"assigned {n} of {len(obs_rows)} observations in {dt:.2f} s, "
+                f"creating {len(new_info)} new sessions"
+            )
+
+            # With everything assigned, a second pass should be a quick no-op.
+            t0 = time.time()
+            assign_sessions()
+            print(f"second pass took {time.time() - t0:.2f} s")
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#! /usr/bin/env python
+# Copyright 2026 the HERA Collaboration
+# Licensed under the BSD License.
+
+"""Benchmark the registration of a large number of new file instances, as done
+by the `register_instances` API call when a night's worth of data lands on a
+store.
+
+We create synthetic records for the requested number of files, spread over
+observations of 20 files each. The first file of each observation has its
+obsid given explicitly; the others have their obsids inferred from their
+names, so that the "hera" obsid inference logic gets exercised too.
+
+Point LIBRARIAN_CONFIG_PATH at a server configuration with a *scratch*
+database: all of the tables are created at the start and dropped at the end.
+
+"""
+
+import argparse
+import os
+import time
+from sqlalchemy import BigInteger
+from sqlalchemy.ext.compiler import compiles
+
+FILES_PER_OBS = 20
+
+
+@compiles(BigInteger, "sqlite")
+def _compile_sqlite_big_integer(type_, compiler, **kw):
+    # SQLite only autoincrements primary keys declared as exactly "INTEGER",
+    # so create our BigInteger keys that way if benchmarking with SQLite.
+    return "INTEGER"
+
+
+def make_file_info(prefix, n_files):
+    md5 = "d41d8cd98f00b204e9800998ecf8427e"
+    file_info = {}
+    obsids = set()
+
+    for i in range(n_files):
+        obs_index, pol_index = divmod(i, FILES_PER_OBS)
+        name = "zen.2458000.%05d.p%02d.uvh5" % (obs_index, pol_index)
+        info = dict(size=1024, md5=md5, type="uvh5")
+
+        if pol_index == 0:
+            info["obsid"] = 1200000000 + obs_index
+            obsids.add(info["obsid"])
+
+        file_info[os.path.join(prefix, "2458000", name)] = info
+
+    return file_info, obsids
+
+
+def register_per_file(store, file_info, source_name):
+    """The way that `register_instances` used to work, for comparison."""
+    from librarian_server import db
+    from librarian_server.file import File, FileInstance
+
+    slashed_prefix = store.path_prefix + "/"
+
+    for full_path in sorted(file_info.keys()):
+        store_path = full_path[len(slashed_prefix) :]
+        parent_dirs = os.path.dirname(store_path)
+        name = os.path.basename(store_path)
+
+        if FileInstance.query.get((store.id, parent_dirs, name)) is not None:
+            continue
+
+        file = File.get_inferring_info(store, store_path, source_name, info=file_info[full_path])
+        inst = FileInstance(store, parent_dirs, name)
+        db.session.add(inst)
+        db.session.add(file.make_instance_creation_event(inst, store))
+
+    db.session.commit()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("-n", dest="n_files", type=int, default=50000, help="Number of files.")
+    ap.add_argument(
+        "--per-file",
+        action="store_true",
+        help="Use the old one-file-at-a-time implementation, for comparison.",
+    )
+    args = ap.parse_args()
+
+    from librarian_server import app, db
+    from librarian_server.file import FileInstance
+    from librarian_server.observation import Observation
+    from librarian_server.store import Store
+
+    app.config["obsid_inference_mode"] = "hera"
+
+    with app.app_context():
+        db.create_all()
+
+        try:
+            store = Store("benchstore", "/data", "localhost")
+            store.id = 1
+            store.available = True
+            db.session.add(store)
+
+            file_info, obsids = make_file_info(store.path_prefix, args.n_files)
+
+            for obsid in obsids:
+                db.session.add(Observation(obsid, 2458000.0, 2458000.01, 0.0))
+
+            db.session.commit()
+
+            t0 = time.time()
+
+            if args.per_file:
+                register_per_file(store, file_info, "benchmark")
+            else:
+                store.register_instances(file_info, "benchmark")
+
+            dt = time.time() - t0
+            n = FileInstance.query.count()
+            print(f"registered {n} instances in {dt:.2f} s ({n / dt:.0f} per second)")
+
+            # Registering the same files again should be a quick no-op.
+            t0 = time.time()
+            store.register_instances(file_info, "benchmark")
+            print(f"re-registration took {time.time() - t0:.2f} s")
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
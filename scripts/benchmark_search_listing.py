@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+# Copyright 2026 the HERA Collaboration
+# Licensed under the BSD License.
+
+"""Benchmark the generation of a big JSON file listing, as done by the `search`
+API call with the "file-listing-json" output format.
+
+We create synthetic records for the requested number of files, then list all
+of them twice: once by loading ORM objects and calling their `to_dict()`
+methods, which is how listings used to be generated, and once with the Core
+path of `compile_listing`. For each we report the throughput in rows per
+second and the peak memory allocated while building and encoding the
+listing, as measured by `tracemalloc`.
+
+Point LIBRARIAN_CONFIG_PATH at a server configuration with a *scratch*
+database: all of the tables are created at the start and dropped at the end.
+
+"""
+
+import argparse
+import datetime
+import json
+import time
+import tracemalloc
+
+INSERT_BATCH_SIZE = 10000
+
+
+def insert_files(n_files):
+    from librarian_server import db
+    from librarian_server.file import File
+
+    md5 = "d41d8cd98f00b204e9800998ecf8427e"
+    ctime = datetime.datetime(2026, 1, 1)
+
+    for i0 in range(0, n_files, INSERT_BATCH_SIZE):
+        rows = [
+            dict(
+                name="zen.2458000.%07d.uvh5" % i,
+                type="uvh5",
+                create_time=ctime,
+                obsid=None,
+                size=1024,
+                md5=md5,
+                source="benchmark",
+                num_instances=0,
+            )
+            for i in range(i0, min(i0 + INSERT_BATCH_SIZE, n_files))
+        ]
+        db.session.execute(File.__table__.insert(), rows)
+
+    db.session.commit()
+
+
+def list_with_orm(query):
+    return json.dumps(dict(success=True, results=[f.to_dict() for f in query])).encode("utf-8")
+
+
+def list_with_core(query):
+    from librarian_server import db
+    from librarian_server.search import compile_listing
+    from librarian_server.webutil import encode_json
+
+    stmt, to_dict = compile_listing(query, "files")
+    return encode_json(
+        dict(success=True, results=[to_dict(row) for row in db.session.execute(stmt)])
+    )
+
+
+def measure(label, func, query, n):
+    from librarian_server import db
+
+    db.session.expunge_all()
+    tracemalloc.start()
+    t0 = time.time()
+    text = func(query)
+    dt = time.time() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(json.loads(text)["results"]) == n
+    print(f"{label}: {n / dt:.0f} rows per second, peak memory {peak / 2**20:.1f} MiB")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("-n", dest="n_files", type=int, default=200000, help="Number of files.")
+    args = ap.parse_args()
+
+    from librarian_server import app, db
+    from librarian_server.search import compile_search
+
+    with app.app_context():
+        db.create_all()
+
+        try:
+            insert_files(args.n_files)
+            query = compile_search('{"name-matches": "zen.%"}')
+            measure("ORM objects", list_with_orm, query, args.n_files)
+            measure("Core rows", list_with_core, query, args.n_files)
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+# Copyright 2026 the HERA Collaboration
+# Licensed under the BSD License.
+
+"""Benchmark the simplification of compiled searches on a large synthetic
+catalog.
+
+We create the requested number of observations, with 20 files each, and
+then run a few file searches that use several observation-level clauses,
+both as written and after simplification. For each we report the number of
+matches, the best time out of a few runs, and the database's plan.
+
+Point LIBRARIAN_CONFIG_PATH at a server configuration with a *scratch*
+database: all of the tables are created at the start and dropped at the end.
+
+"""
+
+import argparse
+import datetime
+import time
+
+FILES_PER_OBS = 20
+INSERT_BATCH_SIZE = 10000
+N_REPEATS = 3
+
+SEARCHES = [
+    {
+        "name-matches": "zen.%.uvh5",
+        "start-time-jd-greater-than": 2458100.0,
+        "stop-time-jd-less-than": 2458200.0,
+        "start-lst-hr-in-range": [2.0, 8.0],
+    },
+    {
+        "or": {
+            "start-time-jd-less-than": 2458010.0,
+            "obs-matches": {"start-lst-hr-greater-than": 23.5},
+            "size-greater-than": 2047,
+        }
+    },
+    {
+        "none-of": {"start-lst-hr-less-than": 12.0, "always-false": True},
+        "and": {"obs-matches": {"duration-greater-than": 0.001}, "always-true": True},
+    },
+]
+
+
+def make_catalog(n_obs):
+    from librarian_server import db
+    from librarian_server.file import File
+    from librarian_server.observation import Observation
+
+    md5 = "d41d8cd98f00b204e9800998ecf8427e"
+    ctime = datetime.datetime(2026, 1, 1)
+    obs_rows = []
+    file_rows = []
+
+    for i in range(n_obs):
+        obsid = 1200000000 + i
+        start = 2458000.0 + 0.01 * i
+        obs_rows.append(
+            dict(
+                obsid=obsid,
+                start_time_jd=start,
+                stop_time_jd=start + 0.007,
+                start_lst_hr=(0.24 * i) % 24,
+                num_files=FILES_PER_OBS,
+                total_size=FILES_PER_OBS * 1024,
+                num_files_with_instances=0,
+            )
+        )
+
+        for j in range(FILES_PER_OBS):
+            file_rows.append(
+                dict(
+                    name="zen.%.5f.p%02d.uvh5" % (start, j),
+                    type="uvh5",
+                    create_time=ctime,
+                    obsid=obsid,
+                    size=1024 * (1 + j % 2),
+                    md5=md5,
+                    source="benchmark",
+                    num_instances=0,
+                )
+            )
+
+    for table, rows in ((Observation.__table__, obs_rows), (File.__table__, file_rows)):
+        for i in range(0, len(rows), INSERT_BATCH_SIZE):
+            db.session.execute(table.insert(), rows[i : i + INSERT_BATCH_SIZE])
+
+    db.session.commit()
+
+
+def run(search, optimize):
+    from sqlalchemy import func, select
+
+    from librarian_server import db
+    from librarian_server.file import File
+    from librarian_server.search import explain_search, the_file_search_compiler
+
+    stmt = (
+        select(func.count())
+        .select_from(File)
+        .where(the_file_search_compiler.compile(search, optimize=optimize))
+    )
+    best = None
+
+    for _ in range(N_REPEATS):
+        t0 = time.time()
+        n = db.session.execute(stmt).scalar()
+        dt = time.time() - t0
+        best = dt if best is None else min(best, dt)
+
+    plan = explain_search(stmt)["plan"]
+    return n, best, plan
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("-n", dest="n_obs", type=int, default=20000, help="Number of observations.")
+    args = ap.parse_args()
+
+    from librarian_server import app, db
+
+    with app.app_context():
+        db.create_all()
+
+        try:
+            make_catalog(args.n_obs)
+
+            for search in SEARCHES:
+                print(search)
+
+                for optimize, label in ((False, "as written"), (True, "simplified")):
+                    n, dt, plan = run(search, optimize)
+                    print(f"  {label}: {n} matches in {dt:.3f} s; plan:")
+
+                    for line in plan:
+                        print("    ", line)
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+#! /usr/bin/env python
+# Copyright 2026 the HERA Collaboration
+# Licensed under the BSD License.
+
+"""Convert the file_event table of a PostgreSQL Librarian database into one
+that is partitioned by month.
+
+This copies every event, so it can take a while. Stop the Librarian server
+and bring the database up to date with `alembic upgrade head` first. Once
+the table is partitioned, the server creates new monthly partitions as
+needed by itself.
+
+"""
+
+import argparse
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.parse_args()
+
+    from librarian_server import app
+    from librarian_server.fileevents import partition_file_events
+
+    with app.app_context():
+        n = partition_file_events()
+
+    print(f"partitioned the file_event table into {n} monthly partitions")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,7 @@ server_reqs = [
     "pytz",
     "pyuvdata",
     "sqlalchemy>=1.4.0",
-    "tornado",
+    "tornado>=6.3",
 ]
 
 globus_reqs = [